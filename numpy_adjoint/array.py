@@ -1,11 +1,35 @@
+import functools
+import string
+import weakref
+
 import numpy
 from pyadjoint.overloaded_type import OverloadedType, register_overloaded_type, create_overloaded_object
 from pyadjoint.tape import get_working_tape, stop_annotating, annotate_tape
 from pyadjoint.block import Block
+from pyadjoint.block_variable import LazyAdjoint
 
 
 @register_overloaded_type
 class ndarray(OverloadedType, numpy.ndarray):
+    """An overloaded numpy array of floats.
+
+    Indexing, the ufuncs with derivative rules, sums, :func:`numpy.dot`,
+    :func:`numpy.matmul`, :func:`numpy.einsum`, :func:`numpy.broadcast_to`,
+    reshaping, transposing and copying are annotated with one block per
+    operation on the whole array, so that array models record a number of
+    blocks independent of the array sizes. :func:`numpy.mean`,
+    :func:`numpy.var`, :func:`numpy.std` and :func:`numpy.linalg.norm` are
+    annotated as a few of these operations. Other ufuncs and array functions
+    of overloaded arrays whose floating point results are not annotated raise
+    a NotImplementedError while annotating, instead of losing the dependency
+    on the arrays. Other array methods returning new views, such as
+    ``squeeze`` and ``swapaxes``, are not annotated.
+
+    The checkpoints of the arrays computed by these operations share the
+    memory of the array until it is written to through numpy_adjoint, see
+    :class:`CopyOnWriteCheckpoint`.
+    """
+
     def __init__(self, *args, **kwargs):
         pass
 
@@ -14,11 +38,52 @@ class ndarray(OverloadedType, numpy.ndarray):
         return cls(obj.shape, numpy.float_, buffer=obj)
 
     def _ad_create_checkpoint(self):
-        return self.copy()
+        if not self._ad_exclusive:
+            return numpy.ndarray.copy(self)
+        checkpoint = CopyOnWriteCheckpoint(self.view(ndarray))
+        if self._ad_checkpoints is None:
+            self._ad_checkpoints = []
+        self._ad_checkpoints.append(weakref.ref(checkpoint))
+        return checkpoint
 
     def _ad_restore_at_checkpoint(self, checkpoint):
+        if isinstance(checkpoint, CopyOnWriteCheckpoint):
+            return checkpoint.value
         return checkpoint
 
+    def _ad_prepare_write(self):
+        """Copy the checkpoints sharing the memory of the array, or of the arrays it is a view of."""
+        array = self
+        while isinstance(array, ndarray):
+            checkpoints = array._ad_checkpoints
+            if checkpoints is not None:
+                for ref in checkpoints:
+                    checkpoint = ref()
+                    if checkpoint is not None:
+                        checkpoint.detach()
+                array._ad_checkpoints = None
+            array = array.base
+
+    def __setitem__(self, item, value):
+        self._ad_prepare_write()
+        numpy.ndarray.__setitem__(self, item, value)
+
+    def fill(self, value):
+        self._ad_prepare_write()
+        numpy.ndarray.fill(self, value)
+
+    def sort(self, *args, **kwargs):
+        self._ad_prepare_write()
+        numpy.ndarray.sort(self, *args, **kwargs)
+
+    def partition(self, *args, **kwargs):
+        self._ad_prepare_write()
+        numpy.ndarray.partition(self, *args, **kwargs)
+
+    def put(self, *args, **kwargs):
+        self._ad_prepare_write()
+        numpy.ndarray.put(self, *args, **kwargs)
+
     def __getitem__(self, item):
         annotate = annotate_tape()
         if annotate:
@@ -34,23 +99,913 @@ class ndarray(OverloadedType, numpy.ndarray):
             block.add_output(out.create_block_variable())
         return out
 
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        """Evaluate `ufunc` on the raw arrays, recording a single block for the whole array.
+
+        Calls of the ufuncs in `_UFUNC_RULES` and of :func:`numpy.matmul`, and sums
+        with ``numpy.add.reduce`` are annotated, also when writing to an overloaded
+        `out` array. Their other methods, such as ``numpy.maximum.reduce``, and
+        calls with other keyword arguments raise a NotImplementedError while
+        annotating. Other ufuncs, such as comparisons, are evaluated without
+        annotation, and return plain numpy arrays while annotating.
+        """
+        out = kwargs.pop("out", ())
+        if any(o is not None for o in out):
+            kwargs["out"] = out
+        else:
+            out = ()
+        block = None
+        annotate = annotate_tape()
+        if (annotate and any(isinstance(x, OverloadedType) for x in inputs)
+                and all(isinstance(o, OverloadedType) for o in out)):
+            if _is_recorded(ufunc, method, kwargs):
+                block = _ufunc_block(ufunc, method, inputs, kwargs)
+                get_working_tape().add_block(block)
+            elif ufunc in _UFUNC_RULES or ufunc is numpy.matmul:
+                name = (f"{ufunc.__name__} with the arguments {sorted(kwargs)}" if method == "__call__"
+                        else f"{ufunc.__name__}.{method}")
+                raise NotImplementedError(f"numpy_adjoint does not differentiate numpy.{name}.")
+        if out:
+            for o in out:
+                if isinstance(o, ndarray):
+                    o._ad_prepare_write()
+            kwargs["out"] = tuple(_raw(o) for o in out)
+
+        with stop_annotating():
+            kwargs = {key: value if key == "out" else _raw(value) for key, value in kwargs.items()}
+            result = getattr(ufunc, method)(*[_raw(x) for x in inputs], **kwargs)
+
+        if out:
+            result = out[0] if ufunc.nout == 1 else out
+        elif ufunc.nout == 1 and method != "at" and (block is not None or not annotate):
+            result = _wrap(result, overload=block is not None)
+        if block is not None:
+            block.add_output(result.create_block_variable())
+        return result
+
+    def __array_function__(self, func, types, args, kwargs):
+        """Record a single block for the array functions in `_HANDLED_FUNCTIONS`.
+
+        The other functions use the default implementation, which records the
+        ufuncs and array methods they are implemented with. They raise a
+        NotImplementedError while annotating if their result is a floating
+        point array which no block on the tape computed.
+        """
+        if func in _WRITING_FUNCTIONS and isinstance(args[0], ndarray):
+            args[0]._ad_prepare_write()
+        annotate = annotate_tape()
+        handler = _HANDLED_FUNCTIONS.get(func)
+        if handler is not None and annotate:
+            return handler(*args, **kwargs)
+        result = super().__array_function__(func, types, args, kwargs)
+        if annotate and (_is_detached(result) or _is_untaped(result, args)):
+            raise NotImplementedError(f"numpy_adjoint does not differentiate numpy.{func.__name__}.")
+        return result
+
+    def dot(self, b, out=None):
+        if annotate_tape():
+            return _dot(self, b, out=out)
+        return numpy.ndarray.dot(self, b, out=out)
+
+    def reshape(self, *shape, order="C", **kwargs):
+        if annotate_tape():
+            return _reshape(self, shape[0] if len(shape) == 1 else shape, order, **kwargs)
+        return numpy.ndarray.reshape(self, *shape, order=order, **kwargs)
+
+    def ravel(self, order="C"):
+        if annotate_tape():
+            return _reshape(self, -1, order)
+        return numpy.ndarray.ravel(self, order)
+
+    def flatten(self, order="C"):
+        if annotate_tape():
+            return _reshape(self, -1, order, copy=True)
+        return numpy.ndarray.flatten(self, order)
+
+    def transpose(self, *axes):
+        if annotate_tape():
+            if len(axes) == 1 and (axes[0] is None or numpy.iterable(axes[0])):
+                axes = axes[0]
+            return _transpose(self, axes or None)
+        return numpy.ndarray.transpose(self, *axes)
+
+    @property
+    def T(self):
+        return self.transpose()
+
+    def copy(self, order="C"):
+        if annotate_tape():
+            return _copy(self, order)
+        return numpy.ndarray.copy(self, order)
+
+    def mean(self, *args, **kwargs):
+        if annotate_tape():
+            return _mean(self, *args, **kwargs)
+        return numpy.ndarray.mean(self, *args, **kwargs)
+
+    def var(self, *args, **kwargs):
+        if annotate_tape():
+            return _var(self, *args, **kwargs)
+        return numpy.ndarray.var(self, *args, **kwargs)
+
+    def std(self, *args, **kwargs):
+        if annotate_tape():
+            return _std(self, *args, **kwargs)
+        return numpy.ndarray.std(self, *args, **kwargs)
+
     def _ad_convert_type(self, value, options={}):
         return value
 
+    @staticmethod
+    def _ad_assign_numpy(dst, src, offset):
+        dst[...] = numpy.reshape(src[offset:offset + dst.size], dst.shape)
+        offset += dst.size
+        return dst, offset
+
+    @staticmethod
+    def _ad_to_list(m):
+        return numpy.asarray(m).ravel().tolist()
+
+    @staticmethod
+    def _ad_flat_view(m):
+        return numpy.ravel(numpy.asarray(m, dtype=numpy.float64))
+
+    def _ad_from_flat_view(self, src, offset):
+        view = numpy.reshape(src[offset:offset + self.size], self.shape)
+        return view.view(type(self)), offset + self.size
+
+    def _ad_copy(self):
+        return numpy.ndarray.copy(self)
+
+    def _ad_dim(self):
+        return self.size
+
     def __array_finalize__(self, obj):
         OverloadedType.__init__(self)
+        # Whether the memory of the array is only reachable through numpy_adjoint
+        # arrays, so that checkpoints may share it until it is written to.
+        self._ad_exclusive = self.base is None
+        # References to the checkpoints sharing the memory.
+        self._ad_checkpoints = None
 
 
 class NumpyArraySliceBlock(Block):
+    linear = True
+
     def __init__(self, array, item):
         super().__init__()
         self.add_dependency(array)
         self.item = item
 
     def evaluate_adj_component(self, inputs, adj_inputs, block_variable, idx, prepared=None):
-        adj_output = numpy.zeros(inputs[0].shape)
-        adj_output[self.item] = adj_inputs[0]
+        return SparseArrayAdjoint(inputs[0].shape, [(self.item, adj_inputs[0])])
+
+    def evaluate_adj_batch_component(self, inputs, adj_inputs, block_variable, idx, prepared=None):
+        item = self.item if isinstance(self.item, tuple) else (self.item,)
+        adj_output = numpy.zeros((len(adj_inputs[0]),) + inputs[0].shape)
+        numpy.add.at(adj_output, (slice(None),) + item, adj_inputs[0])
         return adj_output
 
+    def evaluate_tlm_component(self, inputs, tlm_inputs, block_variable, idx, prepared=None):
+        return tlm_inputs[0][self.item]
+
+    def evaluate_hessian_component(self, inputs, hessian_inputs, adj_inputs, block_variable, idx,
+                                   relevant_dependencies, prepared=None):
+        return self.evaluate_adj_component(inputs, hessian_inputs, block_variable, idx, prepared)
+
+    def evaluate_tlm_batch_component(self, inputs, tlm_inputs, block_variable, idx, prepared=None):
+        item = self.item if isinstance(self.item, tuple) else (self.item,)
+        return numpy.asarray(tlm_inputs[0])[(slice(None),) + item]
+
     def recompute_component(self, inputs, block_variable, idx, prepared):
         return inputs[0][self.item]
+
+    def sparsity_pattern(self, patterns):
+        pattern, = patterns
+        if isinstance(pattern, frozenset):
+            return [pattern]
+        entries = _pattern_array(pattern, numpy.shape(self.get_dependencies()[0].output))[self.item]
+        return [entries if isinstance(entries, frozenset) else entries.ravel().tolist()]
+
+
+class CopyOnWriteCheckpoint(object):
+    """A checkpoint of an :class:`ndarray` sharing the memory of the array until it is written to.
+
+    Writes to the array, or to numpy_adjoint views of it, copy the memory into
+    the checkpoint first. These are item assignment, the `out` argument of
+    ufuncs and thereby the in-place operators, the ``fill``, ``sort``,
+    ``partition`` and ``put`` methods, and :func:`numpy.copyto`,
+    :func:`numpy.put`, :func:`numpy.place`, :func:`numpy.putmask` and
+    :func:`numpy.fill_diagonal`. Writes through plain numpy views of the
+    array, e.g. ``numpy.asarray(x)``, bypass numpy_adjoint and change the
+    checkpoint. Only arrays whose memory can not be reached from plain numpy
+    arrays, e.g. the results of operations on overloaded arrays, are
+    checkpointed this way, and other arrays are copied.
+
+    Checkpoint storages, see :meth:`Tape.set_checkpoint_storage`, store a copy
+    of the array made with :meth:`_ad_detach`.
+
+    Args:
+        value (ndarray): A view of the array.
+    """
+    __slots__ = ("value", "shared", "__weakref__")
+
+    def __init__(self, value, shared=True):
+        self.value = value
+        self.shared = shared
+
+    def detach(self):
+        """Copy the shared memory into the checkpoint."""
+        if self.shared:
+            self.value = numpy.ndarray.copy(self.value)
+            self.shared = False
+
+    def _ad_detach(self):
+        """Copy the shared memory into the checkpoint, and return the copy."""
+        self.detach()
+        return self.value
+
+    def _ad_nbytes(self):
+        # Shared memory is held by the array.
+        return 0 if self.shared else self.value.nbytes
+
+    def __reduce__(self):
+        return CopyOnWriteCheckpoint, (self.value, False)
+
+
+class SparseArrayAdjoint(LazyAdjoint):
+    """The adjoint contributions of indexing an array, as pairs of an index and a value.
+
+    The contributions are summed into an array with ``numpy.add.at`` when the
+    adjoint is read, so indexing each entry of an array of n entries costs O(n)
+    in the adjoint sweep instead of O(n^2).
+
+    Args:
+        shape (tuple): The shape of the indexed array.
+        contributions (list[tuple]): The index and the value of each contribution.
+    """
+
+    def __init__(self, shape, contributions):
+        self.shape = shape
+        self.contributions = contributions
+        # The sum of the contributions to the whole array.
+        self.dense = None
+
+    @property
+    def nbytes(self):
+        return sum(numpy.asarray(value).nbytes for _, value in self.contributions) + \
+            (0 if self.dense is None else self.dense.nbytes)
+
+    def add(self, value):
+        if isinstance(value, SparseArrayAdjoint):
+            self.contributions.extend(value.contributions)
+            if value.dense is not None:
+                self.add(value.dense)
+        elif self.dense is None:
+            self.dense = value
+        else:
+            self.dense += value
+        return self
+
+    def add_to(self, value):
+        if self.dense is not None:
+            value += self.dense
+        points = []
+        values = []
+        for item, contribution in self.contributions:
+            if _is_point(item, len(self.shape)):
+                points.append(item)
+                values.append(contribution)
+            else:
+                numpy.add.at(value, item, contribution)
+        if points:
+            # Add the contributions to single entries at once.
+            indices = numpy.reshape(numpy.array(points, dtype=numpy.intp), (len(points), -1))
+            numpy.add.at(value, tuple(indices.T), values)
+        return value
+
+    def evaluate(self):
+        dense, self.dense = self.dense, None
+        return self.add_to(numpy.zeros(self.shape) if dense is None else dense)
+
+
+def _is_point(item, ndim):
+    """Return True if the index `item` selects a single entry of an array of dimension `ndim`."""
+    item = item if isinstance(item, tuple) else (item,)
+    return len(item) == ndim and all(isinstance(i, (int, numpy.integer)) and not isinstance(i, bool)
+                                     for i in item)
+
+
+def _raw(x):
+    """Return `x` as a plain numpy array, or `x` itself if it is not an array."""
+    return numpy.asarray(x) if isinstance(x, numpy.ndarray) else x
+
+
+def _constant(x):
+    """Return a copy of a constant argument of an annotated operation."""
+    return numpy.array(x) if isinstance(x, numpy.ndarray) else x
+
+
+def _wrap(result, overload=True):
+    """Return the result of an operation on overloaded arrays as an overloaded object.
+
+    Scalar results become AdjFloats if `overload` is True, and are otherwise returned as is.
+    """
+    if isinstance(result, numpy.ndarray) and result.ndim > 0:
+        output = result.view(ndarray)
+        output._ad_exclusive = result.flags.owndata
+        return output
+    if overload:
+        return create_overloaded_object(numpy.float64(result))
+    return result
+
+
+def _is_detached(result):
+    """Return True if `result` has floating point values which are not an overloaded object."""
+    if isinstance(result, (tuple, list)):
+        return any(_is_detached(r) for r in result)
+    return (isinstance(result, (numpy.ndarray, numpy.generic)) and not isinstance(result, OverloadedType)
+            and numpy.issubdtype(result.dtype, numpy.inexact))
+
+
+def _is_untaped(result, args):
+    """Return True if `result` has floating point values in a new overloaded object which no block computed."""
+    if isinstance(result, (tuple, list)):
+        return any(_is_untaped(r, args) for r in result)
+    return (isinstance(result, ndarray) and numpy.issubdtype(result.dtype, numpy.inexact)
+            and result.block_variable._checkpoint is None and not any(result is arg for arg in args))
+
+
+def _is_recorded(ufunc, method, kwargs):
+    """Return True if `ufunc.method` with the keyword arguments `kwargs` is annotated."""
+    if method == "__call__":
+        return ((ufunc in _UFUNC_RULES and set(kwargs) <= {"out", "casting", "dtype", "subok", "order"})
+                or (ufunc is numpy.matmul and set(kwargs) <= {"out"}))
+    return (method == "reduce" and ufunc is numpy.add and kwargs.get("where", True) is True
+            and set(kwargs) <= {"axis", "dtype", "out", "keepdims", "initial", "where"})
+
+
+def _ufunc_block(ufunc, method, inputs, kwargs):
+    """Return the block recording `ufunc.method(*inputs, **kwargs)`."""
+    kwargs = {key: value for key, value in kwargs.items() if key not in ("out", "where")}
+    if ufunc is numpy.matmul:
+        return NumpyEinsumBlock(_matmul_subscripts(*[numpy.ndim(x) for x in inputs]), inputs)
+    if method == "reduce":
+        return NumpySumBlock(inputs[0], **kwargs)
+    return NumpyUfuncBlock(ufunc, inputs, kwargs)
+
+
+def _unbroadcast(value, shape):
+    """Sum `value` over the axes it was broadcast along from an array of shape `shape`."""
+    value = numpy.asarray(value)
+    if value.shape == tuple(shape):
+        return value
+    leading = value.ndim - len(shape)
+    axes = tuple(range(leading)) + tuple(leading + i for i, n in enumerate(shape)
+                                         if n == 1 and value.shape[leading + i] != 1)
+    return numpy.reshape(numpy.sum(value, axis=axes), shape)
+
+
+def _dependency_value(x, value):
+    """Return `value` as a new array of the shape of the dependency `x`, or a float if `x` is a scalar."""
+    if numpy.ndim(x) == 0:
+        return float(numpy.sum(value))
+    return numpy.array(numpy.broadcast_to(value, numpy.shape(x)))
+
+
+class _UfuncRule(object):
+    """The first and second partial derivatives of a ufunc.
+
+    Args:
+        first (tuple[function]): The partial derivative with respect to each
+            argument, as a function of the arguments.
+        second (dict): The second partial derivatives with respect to arguments
+            `(p, q)`, for `p <= q`, as functions of the arguments. Missing
+            derivatives are zero.
+        linear (bool): Whether the ufunc is linear in its arguments.
+    """
+
+    def __init__(self, first, second=None, linear=False):
+        self.first = first
+        self.second = second or {}
+        self.linear = linear
+
+    def second_derivative(self, p, q):
+        return self.second.get((min(p, q), max(p, q)))
+
+
+def _power_first_exponent(a, b):
+    return numpy.power(a, b) * numpy.log(a)
+
+
+_UFUNC_RULES = {
+    numpy.negative: _UfuncRule((lambda a: -1.,), linear=True),
+    numpy.positive: _UfuncRule((lambda a: 1.,), linear=True),
+    numpy.exp: _UfuncRule((numpy.exp,), {(0, 0): numpy.exp}),
+    numpy.expm1: _UfuncRule((numpy.exp,), {(0, 0): numpy.exp}),
+    numpy.log: _UfuncRule((lambda a: 1. / a,), {(0, 0): lambda a: -1. / a ** 2}),
+    numpy.log1p: _UfuncRule((lambda a: 1. / (1. + a),), {(0, 0): lambda a: -1. / (1. + a) ** 2}),
+    numpy.sqrt: _UfuncRule((lambda a: 0.5 / numpy.sqrt(a),), {(0, 0): lambda a: -0.25 / a ** 1.5}),
+    numpy.square: _UfuncRule((lambda a: 2. * a,), {(0, 0): lambda a: 2.}),
+    numpy.reciprocal: _UfuncRule((lambda a: -1. / a ** 2,), {(0, 0): lambda a: 2. / a ** 3}),
+    numpy.sin: _UfuncRule((numpy.cos,), {(0, 0): lambda a: -numpy.sin(a)}),
+    numpy.cos: _UfuncRule((lambda a: -numpy.sin(a),), {(0, 0): lambda a: -numpy.cos(a)}),
+    numpy.tan: _UfuncRule((lambda a: 1. / numpy.cos(a) ** 2,),
+                          {(0, 0): lambda a: 2. * numpy.tan(a) / numpy.cos(a) ** 2}),
+    numpy.sinh: _UfuncRule((numpy.cosh,), {(0, 0): numpy.sinh}),
+    numpy.cosh: _UfuncRule((numpy.sinh,), {(0, 0): numpy.cosh}),
+    numpy.tanh: _UfuncRule((lambda a: 1. - numpy.tanh(a) ** 2,),
+                           {(0, 0): lambda a: -2. * numpy.tanh(a) * (1. - numpy.tanh(a) ** 2)}),
+    numpy.arctan: _UfuncRule((lambda a: 1. / (1. + a ** 2),), {(0, 0): lambda a: -2. * a / (1. + a ** 2) ** 2}),
+    numpy.absolute: _UfuncRule((numpy.sign,)),
+    numpy.add: _UfuncRule((lambda a, b: 1., lambda a, b: 1.), linear=True),
+    numpy.subtract: _UfuncRule((lambda a, b: 1., lambda a, b: -1.), linear=True),
+    numpy.multiply: _UfuncRule((lambda a, b: b, lambda a, b: a), {(0, 1): lambda a, b: 1.}),
+    numpy.true_divide: _UfuncRule((lambda a, b: 1. / b, lambda a, b: -a / b ** 2),
+                                  {(0, 1): lambda a, b: -1. / b ** 2, (1, 1): lambda a, b: 2. * a / b ** 3}),
+    numpy.power: _UfuncRule((lambda a, b: b * numpy.power(a, b - 1.), _power_first_exponent),
+                            {(0, 0): lambda a, b: b * (b - 1.) * numpy.power(a, b - 2.),
+                             (0, 1): lambda a, b: numpy.power(a, b - 1.) * (1. + b * numpy.log(a)),
+                             (1, 1): lambda a, b: numpy.power(a, b) * numpy.log(a) ** 2}),
+    numpy.maximum: _UfuncRule((lambda a, b: (a >= b) * 1., lambda a, b: (a < b) * 1.)),
+    numpy.minimum: _UfuncRule((lambda a, b: (a <= b) * 1., lambda a, b: (a > b) * 1.)),
+}
+
+
+class _NumpyOperationBlock(Block):
+    """A block computing an array operation of overloaded and constant arguments.
+
+    The same dependency may be passed as several arguments, e.g. in ``x * x``.
+    """
+
+    def __init__(self, args):
+        super().__init__()
+        # The index of the dependency passed as each argument, or None for constant arguments.
+        self.positions = []
+        self.constants = []
+        for arg in args:
+            if isinstance(arg, OverloadedType):
+                self.add_dependency(arg, no_duplicates=True)
+                dependencies = self.get_dependencies()
+                self.positions.append(next(i for i, dep in enumerate(dependencies)
+                                           if dep is arg.block_variable))
+                self.constants.append(None)
+            else:
+                self.positions.append(None)
+                self.constants.append(_constant(arg))
+        self.linear = self._linear()
+
+    def _linear(self):
+        """Return True if the operation is linear in its dependencies."""
+        return False
+
+    def _args(self, inputs):
+        """Return the arguments of the operation, with the dependencies given by `inputs`."""
+        return [c if p is None else _raw(inputs[p]) for p, c in zip(self.positions, self.constants)]
+
+    def _arguments_of(self, idx):
+        """Return the arguments which are dependency `idx`."""
+        return [k for k, p in enumerate(self.positions) if p == idx]
+
+    def _tlm_values(self):
+        """Return the TLM value of the dependency passed as each argument, or None."""
+        dependencies = self.get_dependencies()
+        return [None if p is None else dependencies[p].tlm_value for p in self.positions]
+
+    def evaluate_adj_component(self, inputs, adj_inputs, block_variable, idx, prepared=None):
+        args = self._args(inputs)
+        adj_input = _raw(adj_inputs[0])
+        value = sum(self._adjoint(args, k, adj_input) for k in self._arguments_of(idx))
+        return _dependency_value(inputs[idx], value)
+
+    def evaluate_tlm_component(self, inputs, tlm_inputs, block_variable, idx, prepared=None):
+        args = self._args(inputs)
+        value = None
+        for k, p in enumerate(self.positions):
+            if p is not None and tlm_inputs[p] is not None:
+                term = self._tangent(args, k, _raw(tlm_inputs[p]))
+                value = term if value is None else value + term
+        if value is None:
+            return None
+        shape = numpy.shape(block_variable.saved_output)
+        return float(value) if shape == () else numpy.broadcast_to(value, shape).copy()
+
+    def evaluate_hessian_component(self, inputs, hessian_inputs, adj_inputs, block_variable, idx,
+                                   relevant_dependencies, prepared=None):
+        args = self._args(inputs)
+        hessian_input = hessian_inputs[0]
+        adj_input = adj_inputs[0]
+        tlm_values = self._tlm_values()
+        value = 0.
+        for k in self._arguments_of(idx):
+            if hessian_input is not None:
+                value = value + self._adjoint(args, k, _raw(hessian_input))
+            if adj_input is None or self.linear:
+                continue
+            for m, tlm_value in enumerate(tlm_values):
+                if tlm_value is not None:
+                    term = self._second_order(args, k, m, _raw(adj_input), _raw(tlm_value))
+                    if term is not None:
+                        value = value + term
+        return _dependency_value(inputs[idx], value)
+
+    def _adjoint(self, args, k, adj_input):
+        """Return the action of the transposed derivative with respect to argument `k` on `adj_input`."""
+        raise NotImplementedError
+
+    def _tangent(self, args, k, tlm_input):
+        """Return the action of the derivative with respect to argument `k` on `tlm_input`."""
+        raise NotImplementedError
+
+    def _second_order(self, args, k, m, adj_input, tlm_input):
+        """Return the adjoint with respect to argument `k` of the derivative with respect to argument `m`.
+
+        That is the action of the second derivative with respect to arguments `k` and
+        `m` on `tlm_input`, contracted with `adj_input`, or None if it is zero.
+        """
+        raise NotImplementedError
+
+
+class NumpyUfuncBlock(_NumpyOperationBlock):
+    """Applies a ufunc elementwise to broadcast arrays, see `_UFUNC_RULES`."""
+
+    def __init__(self, ufunc, args, kwargs):
+        self.ufunc = ufunc
+        self.kwargs = kwargs
+        self.rule = _UFUNC_RULES[ufunc]
+        super().__init__(args)
+
+    def _linear(self):
+        return self.rule.linear
+
+    def __str__(self):
+        return f"numpy.{self.ufunc.__name__}"
+
+    def _adjoint(self, args, k, adj_input):
+        return _unbroadcast(adj_input * self.rule.first[k](*args), numpy.shape(args[k]))
+
+    def _tangent(self, args, k, tlm_input):
+        return self.rule.first[k](*args) * tlm_input
+
+    def _second_order(self, args, k, m, adj_input, tlm_input):
+        second = self.rule.second_derivative(k, m)
+        if second is None:
+            return None
+        return _unbroadcast(adj_input * second(*args) * tlm_input, numpy.shape(args[k]))
+
+    def recompute_component(self, inputs, block_variable, idx, prepared):
+        return _wrap(self.ufunc(*self._args(inputs), **self.kwargs), overload=False)
+
+    def sparsity_pattern(self, patterns):
+        # Elementwise, each entry depends on the broadcast entries of the arguments.
+        dependencies = self.get_dependencies()
+        entries = [_pattern_array(patterns[p], numpy.shape(dependencies[p].output))
+                   for p in set(self.positions) if p is not None]
+        shape = numpy.shape(self.get_outputs()[0].output)
+        entries = functools.reduce(_pattern_union, entries, _pattern_array(frozenset(), shape))
+        return [numpy.broadcast_to(entries, shape).ravel().tolist()]
+
+
+class NumpySumBlock(_NumpyOperationBlock):
+    """Sums an array over some of its axes, as ``numpy.add.reduce``."""
+
+    def __init__(self, array, axis=0, keepdims=False, **kwargs):
+        self.axis = axis
+        self.keepdims = keepdims
+        self.kwargs = dict(kwargs, axis=axis, keepdims=keepdims)
+        super().__init__([array])
+
+    def _linear(self):
+        return True
+
+    def __str__(self):
+        return "numpy.sum"
+
+    def _adjoint(self, args, k, adj_input):
+        shape = numpy.shape(args[0])
+        if not self.keepdims:
+            axis = tuple(range(len(shape))) if self.axis is None else self.axis
+            adj_input = numpy.expand_dims(adj_input, axis)
+        return numpy.broadcast_to(adj_input, shape)
+
+    def _tangent(self, args, k, tlm_input):
+        return numpy.sum(tlm_input, axis=self.axis, keepdims=self.keepdims)
+
+    def recompute_component(self, inputs, block_variable, idx, prepared):
+        return _wrap(numpy.add.reduce(self._args(inputs)[0], **self.kwargs), overload=False)
+
+
+def _parse_subscripts(subscripts, count):
+    """Return the input and output subscripts of an einsum specification, in explicit mode."""
+    subscripts = subscripts.replace(" ", "")
+    if "->" in subscripts:
+        inputs, output = subscripts.split("->")
+    else:
+        inputs = subscripts
+        letters = inputs.replace(".", "").replace(",", "")
+        output = ("..." if "..." in inputs else "") + "".join(
+            sorted(c for c in set(letters) if letters.count(c) == 1))
+    inputs = inputs.split(",")
+    if len(inputs) != count:
+        raise ValueError(f"The einsum subscripts {subscripts!r} do not match {count} operands.")
+    return inputs, output
+
+
+def _matmul_subscripts(ndim_a, ndim_b):
+    """Return the einsum subscripts of :func:`numpy.matmul` for operands of the given dimensions."""
+    a = "z" if ndim_a == 1 else "...iz"
+    b = "z" if ndim_b == 1 else "...zj"
+    output = ("" if ndim_a == ndim_b == 1 else "...") + ("i" if ndim_a > 1 else "") + ("j" if ndim_b > 1 else "")
+    return [a, b], output
+
+
+def _dot_subscripts(ndim_a, ndim_b):
+    """Return the einsum subscripts of :func:`numpy.dot` for operands of positive dimensions."""
+    letters = string.ascii_letters.replace("z", "")
+    leading_a = letters[:ndim_a - 1]
+    letters = letters[ndim_a - 1:]
+    if ndim_b == 1:
+        return [leading_a + "z", "z"], leading_a
+    leading_b, last_b = letters[:ndim_b - 2], letters[ndim_b - 2]
+    return [leading_a + "z", leading_b + "z" + last_b], leading_a + leading_b + last_b
+
+
+def _tokens(subscripts):
+    """Return the indices of `subscripts`, with "." for the broadcast axes of an ellipsis."""
+    return list(subscripts.replace("...", "."))
+
+
+class NumpyEinsumBlock(_NumpyOperationBlock):
+    """Computes a multilinear contraction of arrays with :func:`numpy.einsum`.
+
+    :func:`numpy.dot` and :func:`numpy.matmul` are recorded as this block.
+    The derivative with respect to an operand is a contraction of the other
+    operands, so the adjoint, TLM and Hessian are computed with einsum as well.
+    Subscripts repeating an index within one operand, i.e. taking diagonals,
+    are not supported.
+
+    Args:
+        subscripts (tuple): The subscripts of each operand, and of the output.
+        operands (list): The operands.
+        optimize: The `optimize` argument of :func:`numpy.einsum`.
+    """
+
+    def __init__(self, subscripts, operands, optimize=False):
+        self.inputs, self.output = subscripts
+        self.optimize = optimize
+        for sub in self.inputs:
+            if len(set(_tokens(sub))) != len(_tokens(sub)):
+                raise NotImplementedError(f"numpy_adjoint can not differentiate the einsum subscripts {sub!r}.")
+            if "..." in sub and "..." not in self.output:
+                raise NotImplementedError("numpy_adjoint can not differentiate einsum sums over broadcast axes.")
+        super().__init__(operands)
+
+    def _linear(self):
+        return sum(p is not None for p in self.positions) <= 1
+
+    def __str__(self):
+        return "numpy.einsum('%s')" % self.subscripts
+
+    @property
+    def subscripts(self):
+        return ",".join(self.inputs) + "->" + self.output
+
+    def _contract(self, args):
+        return numpy.einsum(self.subscripts, *args, optimize=self.optimize)
+
+    def _adjoint(self, args, k, adj_input):
+        # Contract all other operands with the adjoint input, and broadcast along
+        # the indices which only operand `k` has.
+        subs = [sub for i, sub in enumerate(self.inputs) if i != k] + [self.output]
+        operands = [arg for i, arg in enumerate(args) if i != k] + [adj_input]
+        present = set("".join(subs))
+        tokens = _tokens(self.inputs[k])
+        shape = numpy.shape(args[k])
+        for t, token in enumerate(tokens):
+            if token not in present:
+                # Axes after an ellipsis are counted from the end.
+                operands.append(numpy.ones(shape[t - len(tokens) if "." in tokens[:t] else t]))
+                subs.append(token)
+        output = self.inputs[k]
+        if "..." not in output and "..." in self.output:
+            # Keep the broadcast axes, which are summed by `_unbroadcast`.
+            output = "..." + output
+        value = numpy.einsum(",".join(subs) + "->" + output, *operands, optimize=self.optimize)
+        return _unbroadcast(value, shape)
+
+    def _tangent(self, args, k, tlm_input):
+        args = list(args)
+        args[k] = tlm_input
+        return self._contract(args)
+
+    def _second_order(self, args, k, m, adj_input, tlm_input):
+        if m == k:
+            return None
+        args = list(args)
+        args[m] = tlm_input
+        return self._adjoint(args, k, adj_input)
+
+    def recompute_component(self, inputs, block_variable, idx, prepared):
+        return _wrap(self._contract(self._args(inputs)), overload=False)
+
+
+class NumpyBroadcastBlock(_NumpyOperationBlock):
+    """Broadcasts an array to a shape, as :func:`numpy.broadcast_to`."""
+
+    def __init__(self, array, shape):
+        self.shape = tuple(shape) if numpy.iterable(shape) else (shape,)
+        super().__init__([array])
+
+    def _linear(self):
+        return True
+
+    def __str__(self):
+        return "numpy.broadcast_to"
+
+    def _adjoint(self, args, k, adj_input):
+        return _unbroadcast(adj_input, numpy.shape(args[0]))
+
+    def _tangent(self, args, k, tlm_input):
+        return numpy.broadcast_to(tlm_input, self.shape)
+
+    def recompute_component(self, inputs, block_variable, idx, prepared):
+        return _wrap(numpy.broadcast_to(self._args(inputs)[0], self.shape), overload=False)
+
+
+class NumpyReshapeBlock(_NumpyOperationBlock):
+    """Reshapes an array, as :meth:`numpy.ndarray.reshape`, or copies it if the shape is unchanged."""
+
+    def __init__(self, array, shape, order="C"):
+        self.shape = tuple(shape) if numpy.iterable(shape) else (shape,)
+        self.order = order
+        super().__init__([array])
+
+    def _linear(self):
+        return True
+
+    def __str__(self):
+        return "numpy.reshape"
+
+    def _adjoint(self, args, k, adj_input):
+        return numpy.reshape(adj_input, numpy.shape(args[0]), order=self.order)
+
+    def _tangent(self, args, k, tlm_input):
+        return numpy.reshape(tlm_input, self.shape, order=self.order)
+
+    def recompute_component(self, inputs, block_variable, idx, prepared):
+        return _wrap(numpy.array(numpy.reshape(self._args(inputs)[0], self.shape, order=self.order)),
+                     overload=False)
+
+    def sparsity_pattern(self, patterns):
+        pattern, = patterns
+        if isinstance(pattern, frozenset):
+            return [pattern]
+        entries = _pattern_array(pattern, numpy.shape(self.get_dependencies()[0].output))
+        return [numpy.reshape(entries, self.shape, order=self.order).ravel().tolist()]
+
+
+class NumpyTransposeBlock(_NumpyOperationBlock):
+    """Permutes the axes of an array, as :func:`numpy.transpose`."""
+
+    def __init__(self, array, axes=None):
+        ndim = numpy.ndim(array)
+        self.axes = tuple(range(ndim))[::-1] if axes is None else tuple(int(axis) % ndim for axis in axes)
+        super().__init__([array])
+
+    def _linear(self):
+        return True
+
+    def __str__(self):
+        return "numpy.transpose"
+
+    def _adjoint(self, args, k, adj_input):
+        return numpy.transpose(adj_input, numpy.argsort(self.axes))
+
+    def _tangent(self, args, k, tlm_input):
+        return numpy.transpose(tlm_input, self.axes)
+
+    def recompute_component(self, inputs, block_variable, idx, prepared):
+        return _wrap(numpy.array(numpy.transpose(self._args(inputs)[0], self.axes)), overload=False)
+
+    def sparsity_pattern(self, patterns):
+        pattern, = patterns
+        if isinstance(pattern, frozenset):
+            return [pattern]
+        entries = _pattern_array(pattern, numpy.shape(self.get_dependencies()[0].output))
+        return [numpy.transpose(entries, self.axes).ravel().tolist()]
+
+
+def _record(block, compute):
+    """Add `block` to the tape, and return the output of `compute` as its overloaded output."""
+    get_working_tape().add_block(block)
+    with stop_annotating():
+        output = _wrap(compute())
+    block.add_output(output.create_block_variable())
+    return output
+
+
+def _einsum(*operands, out=None, optimize=False, **kwargs):
+    if out is not None or kwargs or not isinstance(operands[0], str):
+        raise NotImplementedError("numpy_adjoint only differentiates einsum with string subscripts and no out.")
+    subscripts, operands = operands[0], operands[1:]
+    block = NumpyEinsumBlock(_parse_subscripts(subscripts, len(operands)), operands, optimize=optimize)
+    return _record(block, lambda: numpy.einsum(subscripts, *[_raw(x) for x in operands], optimize=optimize))
+
+
+def _dot(a, b, out=None):
+    if out is not None:
+        raise NotImplementedError("numpy_adjoint does not differentiate dot with out.")
+    if numpy.ndim(a) == 0 or numpy.ndim(b) == 0:
+        return numpy.multiply(a, b)
+    block = NumpyEinsumBlock(_dot_subscripts(numpy.ndim(a), numpy.ndim(b)), [a, b])
+    return _record(block, lambda: numpy.dot(_raw(a), _raw(b)))
+
+
+def _broadcast_to(array, shape, subok=False):
+    block = NumpyBroadcastBlock(array, shape)
+    return _record(block, lambda: numpy.broadcast_to(_raw(array), shape))
+
+
+def _index_order(a, order):
+    """Return the index order "C" or "F" of the reshaping order `order` of `a`."""
+    if order in ("C", "F"):
+        return order
+    if order == "A" or order == "K" and not a.flags.c_contiguous:
+        if numpy.isfortran(a):
+            return "F"
+        if order == "K":
+            raise NotImplementedError("numpy_adjoint only differentiates order 'K' of contiguous arrays.")
+    return "C"
+
+
+def _reshape(a, shape, order="C", copy=None):
+    order = _index_order(a, order)
+    block = NumpyReshapeBlock(a, shape, order)
+
+    def compute():
+        result = numpy.reshape(_raw(a), shape, order=order)
+        return numpy.array(result) if copy else result
+    return _record(block, compute)
+
+
+def _transpose(a, axes=None):
+    block = NumpyTransposeBlock(a, axes)
+    return _record(block, lambda: numpy.transpose(_raw(a), block.axes))
+
+
+def _copy(a, order="K", subok=False):
+    block = NumpyReshapeBlock(a, numpy.shape(a))
+    return _record(block, lambda: numpy.array(_raw(a), order=order))
+
+
+def _reduced_count(a, total):
+    """Return the number of entries of `a` summed into each entry of its sum `total`."""
+    return numpy.size(a) // max(numpy.size(total), 1)
+
+
+def _mean(a, axis=None, dtype=None, out=None, keepdims=False, *, where=True):
+    if dtype is not None or out is not None or where is not True:
+        raise NotImplementedError("numpy_adjoint only differentiates mean without dtype, out and where.")
+    total = numpy.sum(a, axis=axis, keepdims=keepdims)
+    return total * (1.0 / _reduced_count(a, total))
+
+
+def _var(a, axis=None, dtype=None, out=None, ddof=0, keepdims=False, *, where=True):
+    if dtype is not None or out is not None or where is not True:
+        raise NotImplementedError("numpy_adjoint only differentiates var and std without dtype, out and where.")
+    deviation = a - _mean(a, axis=axis, keepdims=True)
+    total = numpy.sum(deviation * deviation, axis=axis, keepdims=keepdims)
+    return total * (1.0 / (_reduced_count(a, total) - ddof))
+
+
+def _std(a, axis=None, dtype=None, out=None, ddof=0, keepdims=False, *, where=True):
+    return _var(a, axis=axis, dtype=dtype, out=out, ddof=ddof, keepdims=keepdims, where=where) ** 0.5
+
+
+def _norm(x, ord=None, axis=None, keepdims=False):
+    vector = numpy.ndim(x) == 1 or (axis is not None and numpy.ndim(axis) == 0)
+    if not (ord is None or ord == "fro" and not vector or ord == 2 and vector):
+        raise NotImplementedError("numpy_adjoint only differentiates the 2-norm of vectors and the Frobenius "
+                                  "norm of matrices.")
+    return numpy.sum(x * x, axis=axis, keepdims=keepdims) ** 0.5
+
+
+def _pattern_array(pattern, shape):
+    """Return a sparsity pattern, see :meth:`Block.sparsity_pattern`, as an object array of the given shape."""
+    entries = numpy.empty(shape, dtype=object)
+    if isinstance(pattern, frozenset):
+        entries.fill(pattern)
+    else:
+        entries.reshape(-1)[:] = pattern
+    return entries
+
+
+_pattern_union = numpy.frompyfunc(frozenset.union, 2, 1)
+
+# The array functions writing to their first argument.
+_WRITING_FUNCTIONS = {numpy.copyto, numpy.put, numpy.place, numpy.putmask, numpy.fill_diagonal}
+
+# The array functions recorded as one or a few blocks while annotating.
+_HANDLED_FUNCTIONS = {numpy.einsum: _einsum, numpy.dot: _dot, numpy.broadcast_to: _broadcast_to,
+                      numpy.mean: _mean, numpy.var: _var, numpy.std: _std, numpy.linalg.norm: _norm,
+                      numpy.copy: _copy}
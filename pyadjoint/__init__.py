@@ -13,7 +13,9 @@ from .tape import (Tape,
                    annotate_tape, stop_annotating, pause_annotation, continue_annotation)
 from .adjfloat import AdjFloat
 from .reduced_functional import ReducedFunctional
-from .drivers import compute_gradient, compute_hessian, solve_adjoint
+from .ensemble import EnsembleReducedFunctional
+from .drivers import (compute_gradient, compute_hessian, compute_tlm_batch, compute_jacobian,
+                      compute_hessian_matrix, solve_adjoint)
 from .verification import taylor_test, taylor_to_dict
 from .overloaded_type import OverloadedType, create_overloaded_object
 from .control import Control
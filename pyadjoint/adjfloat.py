@@ -1,6 +1,7 @@
 from .block import Block
 from .overloaded_type import OverloadedType, register_overloaded_type, create_overloaded_object
 from .tape import get_working_tape, annotate_tape, stop_annotating
+from .frozen_tape import FrozenTape
 
 
 def annotate_operator(operator):
@@ -112,7 +113,7 @@ class AdjFloat(OverloadedType, float):
 
     @staticmethod
     def _ad_assign_numpy(dst, src, offset):
-        dst = type(dst)(src[offset:offset + 1])
+        dst = type(dst)(src[offset])
         offset += 1
         return dst, offset
 
@@ -120,9 +121,20 @@ class AdjFloat(OverloadedType, float):
     def _ad_to_list(value):
         return [value]
 
+    @staticmethod
+    def _ad_flat_view(value):
+        import numpy
+        return numpy.array([value], dtype=numpy.float64)
+
+    def _ad_from_flat_view(self, src, offset):
+        return type(self)(src[offset]), offset + 1
+
     def _ad_copy(self):
         return self
 
+    def _ad_dim(self):
+        return 1
+
 
 _min = min
 _max = max
@@ -169,6 +181,9 @@ def max(a, b, **kwargs):
 
 
 class MinBlock(Block):
+    __slots__ = ()
+    linear = True
+
     def __init__(self, a, b):
         super().__init__()
         self.add_dependency(a)
@@ -182,10 +197,14 @@ class MinBlock(Block):
         else:
             return 0.
 
+    evaluate_adj_batch_component = evaluate_adj_component
+
     def evaluate_tlm_component(self, inputs, tlm_inputs, block_variable, idx, prepared=None):
         idx = 0 if inputs[0] <= inputs[1] else 1
         return tlm_inputs[idx]
 
+    evaluate_tlm_batch_component = evaluate_tlm_component
+
     def evaluate_hessian_component(self, inputs, hessian_inputs, adj_inputs, block_variable, idx,
                                    relevant_dependencies, prepared=None):
         return self.evaluate_adj_component(inputs, hessian_inputs, block_variable, idx, prepared)
@@ -195,6 +214,9 @@ class MinBlock(Block):
 
 
 class MaxBlock(Block):
+    __slots__ = ()
+    linear = True
+
     def __init__(self, a, b):
         super().__init__()
         self.add_dependency(a)
@@ -208,10 +230,14 @@ class MaxBlock(Block):
         else:
             return 0.
 
+    evaluate_adj_batch_component = evaluate_adj_component
+
     def evaluate_tlm_component(self, inputs, tlm_inputs, block_variable, idx, prepared=None):
         idx = 0 if inputs[0] >= inputs[1] else 1
         return tlm_inputs[idx]
 
+    evaluate_tlm_batch_component = evaluate_tlm_component
+
     def evaluate_hessian_component(self, inputs, hessian_inputs, adj_inputs, block_variable, idx,
                                    relevant_dependencies, prepared=None):
         return self.evaluate_adj_component(inputs, hessian_inputs, block_variable, idx, prepared)
@@ -222,6 +248,7 @@ class MaxBlock(Block):
 
 
 class FloatOperatorBlock(Block):
+    __slots__ = ['terms']
     # the float operator annotated in this Block
     operator = None
     symbol = None
@@ -239,11 +266,30 @@ class FloatOperatorBlock(Block):
     def recompute_component(self, inputs, block_variable, idx, prepared):
         return self.operator(*(term.saved_output for term in self.terms))
 
+    def evaluate_adj_batch_component(self, inputs, adj_inputs, block_variable, idx, prepared=None):
+        a = float(self.terms[0].saved_output)
+        b = float(self.terms[-1].saved_output)
+        return self._partial_derivative(idx, a, b) * adj_inputs[0]
+
+    def evaluate_tlm_batch_component(self, inputs, tlm_inputs, block_variable, idx, prepared=None):
+        a = float(self.terms[0].saved_output)
+        b = float(self.terms[-1].saved_output)
+        tlm_output = 0.
+        for k, term in enumerate(self.terms):
+            if term.tlm_value is not None:
+                tlm_output = tlm_output + self._partial_derivative(k, a, b) * term.tlm_value
+        return tlm_output
+
+    def _partial_derivative(self, k, a, b):
+        """Return the derivative of the operation with respect to term `k`."""
+        return _first_derivatives(_OPCODES[type(self)], a, b)[k]
+
     def __str__(self):
         return f"{self.terms[0]} {self.symbol} {self.terms[1]}"
 
 
 class PowBlock(FloatOperatorBlock):
+    __slots__ = ()
     operator = staticmethod(float.__pow__)
     symbol = "**"
 
@@ -260,6 +306,13 @@ class PowBlock(FloatOperatorBlock):
             return float.__mul__(float.__mul__(adj_input, log(base_value)),
                                  float.__pow__(base_value, exponent_value))
 
+    def _partial_derivative(self, k, a, b):
+        # The logarithm of the base is only evaluated if it is needed.
+        if k == 0:
+            return b * a ** (b - 1)
+        from numpy import log
+        return log(a) * a ** b
+
     def evaluate_tlm(self, markings=False):
         output = self.get_outputs()[0]
 
@@ -326,6 +379,8 @@ class PowBlock(FloatOperatorBlock):
 
 
 class AddBlock(FloatOperatorBlock):
+    __slots__ = ()
+    linear = True
     operator = staticmethod(float.__add__)
     symbol = "+"
 
@@ -349,6 +404,8 @@ class AddBlock(FloatOperatorBlock):
 
 
 class SubBlock(FloatOperatorBlock):
+    __slots__ = ()
+    linear = True
     operator = staticmethod(float.__sub__)
     symbol = "-"
 
@@ -377,6 +434,7 @@ class SubBlock(FloatOperatorBlock):
 
 
 class MulBlock(FloatOperatorBlock):
+    __slots__ = ()
     operator = staticmethod(float.__mul__)
     symbol = "*"
 
@@ -401,13 +459,14 @@ class MulBlock(FloatOperatorBlock):
         hessian_input = hessian_inputs[0]
         other_idx = 0 if idx == 1 else 1
         mixed = 0.0
-        for other_idx, bv in relevant_dependencies:
-            if other_idx != idx and bv.tlm_value is not None:
+        for dep_idx, bv in relevant_dependencies:
+            if dep_idx != idx and bv.tlm_value is not None:
                 mixed = float.__mul__(adj_input, bv.tlm_value)
         return float.__add__(mixed, float.__mul__(hessian_input, inputs[other_idx]))
 
 
 class DivBlock(FloatOperatorBlock):
+    __slots__ = ()
     operator = staticmethod(float.__truediv__)
     symbol = "/"
 
@@ -490,6 +549,8 @@ class DivBlock(FloatOperatorBlock):
 
 
 class NegBlock(FloatOperatorBlock):
+    __slots__ = ()
+    linear = True
     operator = staticmethod(float.__neg__)
     symbol = "-"
 
@@ -508,3 +569,405 @@ class NegBlock(FloatOperatorBlock):
 
     def __str__(self):
         return f"{self.symbol} {self.terms[0]}"
+
+
+_ADD, _SUB, _MUL, _DIV, _POW, _NEG, _MIN, _MAX = range(8)
+_OPCODES = {AddBlock: _ADD, SubBlock: _SUB, MulBlock: _MUL, DivBlock: _DIV,
+            PowBlock: _POW, NegBlock: _NEG, MinBlock: _MIN, MaxBlock: _MAX}
+
+
+def _vectorized_operators():
+    import numpy
+    return {_ADD: numpy.add, _SUB: numpy.subtract, _MUL: numpy.multiply,
+            _DIV: numpy.true_divide, _POW: numpy.power, _NEG: lambda a, b: numpy.negative(a),
+            _MIN: numpy.minimum, _MAX: numpy.maximum}
+
+
+# The float operations of the blocks, applied to the values of both operands.
+_OPERATORS = {_ADD: float.__add__, _SUB: float.__sub__, _MUL: float.__mul__,
+              _DIV: float.__truediv__, _POW: float.__pow__, _NEG: lambda a, b: float.__neg__(a),
+              _MIN: lambda a, b: a if a <= b else b, _MAX: lambda a, b: a if a >= b else b}
+
+
+def _first_derivatives(opcode, a, b):
+    """Return the derivatives of the operation with respect to both operands."""
+    import numpy
+    if opcode == _ADD:
+        return 1., 1.
+    elif opcode == _SUB:
+        return 1., -1.
+    elif opcode == _MUL:
+        return b, a
+    elif opcode == _DIV:
+        return 1. / b, -a / b ** 2
+    elif opcode == _POW:
+        return b * a ** (b - 1), numpy.log(a) * a ** b
+    elif opcode == _NEG:
+        return -1., 0.
+    elif opcode == _MIN:
+        return numpy.where(a <= b, 1., 0.), numpy.where(a <= b, 0., 1.)
+    else:
+        return numpy.where(a >= b, 1., 0.), numpy.where(a >= b, 0., 1.)
+
+
+def _second_derivatives(opcode, a, b):
+    """Return the second derivatives of the operation, (d2/da2, d2/dadb, d2/db2)."""
+    import numpy
+    if opcode == _MUL:
+        return 0., 1., 0.
+    elif opcode == _DIV:
+        return 0., -1. / b ** 2, 2. * a / b ** 3
+    elif opcode == _POW:
+        log_a = numpy.log(a)
+        return (b * (b - 1) * a ** (b - 2), a ** (b - 1) * (b * log_a + 1), log_a ** 2 * a ** b)
+    else:
+        return 0., 0., 0.
+
+
+class VectorizedFloatTape(FrozenTape):
+    """A frozen tape of :class:`AdjFloat` operations evaluated with NumPy.
+
+    The blocks are compiled into flat arrays of operation codes, operand and
+    output indices, and grouped by topological level and operation. The
+    recomputation and the tangent linear, adjoint and Hessian sweeps then
+    evaluate all the blocks of a group with a single NumPy operation, using
+    the derivatives of all the blocks computed at once from the forward values.
+    Groups of fewer than `min_width` blocks, as arise from long chains of
+    dependent operations, are evaluated block by block from the same arrays.
+
+    Only the blocks created by the :class:`AdjFloat` operators and by
+    :func:`min` and :func:`max` are supported. The values on the tape are read
+    from the block variables when the tape is compiled, and the inputs which
+    are not computed by a block are read again on every recomputation. The
+    results of each sweep are stored on the block variables as usual.
+
+    Use ``tape.freeze(vectorize=True)`` to compile a tape.
+
+    Args:
+        blocks (list[Block]): The blocks on the tape.
+        generations (tape._SweepGenerations|None): The sweep generations of the
+            tape, used to reuse the adjoint and TLM values of the latest sweeps in
+            the Hessian sweep. If None, the values are always read from the block
+            variables.
+    """
+    # Groups with fewer blocks than this are evaluated block by block.
+    min_width = 16
+    per_block = False
+
+    def __init__(self, blocks, generations=None):
+        import numpy
+        self._generations = generations
+        self._index_variables(blocks)
+        n = len(self.blocks)
+        try:
+            opcode = numpy.array([_OPCODES[type(block)] for block in self.blocks], dtype=numpy.int8)
+        except KeyError as e:
+            raise ValueError(f"Blocks of type {e.args[0].__name__} can not be vectorized.")
+        n_deps = numpy.diff(self.dep_ptr)
+        if (numpy.diff(self.out_ptr) != 1).any() or (n_deps != numpy.where(opcode == _NEG, 1, 2)).any():
+            raise ValueError("Only blocks with one output and one dependency per operand can be vectorized.")
+        self._opcode = opcode
+        self._has_b = n_deps == 2
+        self._a = self.dep_idx[self.dep_ptr[:-1]]
+        second = numpy.minimum(self.dep_ptr[:-1] + 1, len(self.dep_idx) - 1)
+        self._b = numpy.where(self._has_b, self.dep_idx[second], self._a)
+        self._out = self.out_idx[self.out_ptr[:-1]]
+        self._op_blocks = {op: numpy.flatnonzero(opcode == op) for op in numpy.unique(opcode).tolist()}
+
+        produced = numpy.zeros(len(self.variables), dtype=bool)
+        produced[self._out] = True
+        self._leaves = numpy.flatnonzero(~produced)
+        self._output_variables = [self.variables[j] for j in self._out.tolist()]
+        self._values = numpy.fromiter((bv.saved_output for bv in self.variables), dtype=float,
+                                      count=len(self.variables))
+
+        # The topological level of each block, one more than the levels of the blocks computing its operands.
+        variable_level = [0] * len(self.variables)
+        level = []
+        for a, b, out in zip(self._a.tolist(), self._b.tolist(), self._out.tolist()):
+            variable_level[out] = _max(variable_level[a], variable_level[b]) + 1
+            level.append(variable_level[out])
+        level = numpy.array(level, dtype=numpy.intp)
+        order = numpy.lexsort((opcode, level))
+        self._runs = self._build_runs(order, level[order], opcode[order], n)
+        self._lists = (self._a.tolist(), self._b.tolist(), self._out.tolist(), opcode.tolist())
+
+        self._partials = None
+        self._second_partials = None
+        self._adjoint = None
+        self._tlm = None
+        self._marked_nodes = None
+        self._masks = {}
+
+    def _build_runs(self, order, level, opcode, n):
+        """Split the blocks, sorted by level and operation, into vectorized groups and block by block runs."""
+        import numpy
+        if n == 0:
+            return []
+        bounds = numpy.flatnonzero((level[1:] != level[:-1]) | (opcode[1:] != opcode[:-1])) + 1
+        bounds = [0] + bounds.tolist() + [n]
+        runs = []
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            if stop - start >= self.min_width:
+                k = order[start:stop]
+                runs.append((True, k, self._a[k], self._b[k], self._out[k], int(opcode[start])))
+            elif runs and not runs[-1][0]:
+                runs[-1][1].extend(order[start:stop].tolist())
+            else:
+                runs.append((False, order[start:stop].tolist()))
+        return runs
+
+    def mark(self, nodes):
+        previous = self._marked_nodes
+        self._marked_nodes = nodes
+        return previous
+
+    def _marked(self, markings):
+        """Return the mask of the marked block variables, or None if all are relevant."""
+        import numpy
+        if not markings:
+            return None
+        nodes = self._marked_nodes
+        if nodes is None:
+            return numpy.fromiter((bv.marked_in_path for bv in self.variables), dtype=bool,
+                                  count=len(self.variables))
+        try:
+            return self._masks[nodes]
+        except KeyError:
+            mask = numpy.zeros(len(self.variables), dtype=bool)
+            mask[[self._position[bv] for bv in nodes if bv in self._position]] = True
+            self._masks[nodes] = mask
+            return mask
+
+    def _active(self, indices):
+        """Return the mask of the blocks with the given `indices`, or None if all blocks are included."""
+        import numpy
+        indices = numpy.fromiter(indices, dtype=numpy.intp)
+        if len(indices) == len(self.blocks):
+            return None
+        active = numpy.zeros(len(self.blocks), dtype=bool)
+        active[indices] = True
+        return active
+
+    def _read(self, name):
+        """Return the values of attribute `name` of the block variables, and the mask of those which are set."""
+        import numpy
+        from operator import attrgetter
+        values = numpy.array(list(map(attrgetter(name), self.variables)), dtype=object)
+        reached = numpy.not_equal(values, None)
+        x = numpy.zeros(len(values))
+        x[reached] = values[reached]
+        return x, reached
+
+    def _generation(self, kind):
+        """Return the current sweep generation of the values `kind` of the tape, or None if it is not known."""
+        return None if self._generations is None else getattr(self._generations, kind)
+
+    def _cached(self, state, kind, name):
+        """Return the values of a previous sweep if they are still current, or read them."""
+        if state is not None and state[0] is not None and state[0] == self._generation(kind):
+            return state[1], state[2]
+        return self._read(name)
+
+    def _derivatives(self):
+        import numpy
+        if self._partials is None:
+            a = self._values[self._a]
+            b = self._values[self._b]
+            pa = numpy.empty(len(self.blocks))
+            pb = numpy.empty(len(self.blocks))
+            with numpy.errstate(all="ignore"):
+                for op, k in self._op_blocks.items():
+                    pa[k], pb[k] = _first_derivatives(op, a[k], b[k])
+            self._partials = (pa, pb)
+        return self._partials
+
+    def _second_derivatives(self):
+        import numpy
+        if self._second_partials is None:
+            a = self._values[self._a]
+            b = self._values[self._b]
+            second = tuple(numpy.zeros(len(self.blocks)) for _ in range(3))
+            with numpy.errstate(all="ignore"):
+                for op, k in self._op_blocks.items():
+                    for array, value in zip(second, _second_derivatives(op, a[k], b[k])):
+                        array[k] = value
+            self._second_partials = second
+        return self._second_partials
+
+    def _operand_masks(self, active, marked):
+        """Return the masks of the operands which receive reverse contributions."""
+        import numpy
+        mask_a = numpy.ones(len(self.blocks), dtype=bool)
+        mask_b = self._has_b.copy()
+        if marked is not None:
+            mask_a &= marked[self._a]
+            mask_b &= marked[self._b]
+        if active is not None:
+            mask_a &= active
+            mask_b &= active
+        return mask_a, mask_b
+
+    def _reverse(self, x, reached, pa, pb, mask_a, mask_b, extra_a=None, extra_b=None):
+        """Propagate `x` from the outputs to the operands, in reverse.
+
+        Each operand receives the contribution ``p * x[out] + extra`` from the
+        blocks whose output is reached.
+        """
+        import numpy
+        lists = None
+        for run in reversed(self._runs):
+            if run[0]:
+                _, k, a, b, out, _ = run
+                r = reached[out]
+                if not r.any():
+                    continue
+                g = x[out]
+                with numpy.errstate(all="ignore"):
+                    for operand, p, mask, extra in ((a, pa, mask_a, extra_a), (b, pb, mask_b, extra_b)):
+                        select = r & mask[k]
+                        contribution = p[k] * g
+                        if extra is not None:
+                            contribution += extra[k]
+                        numpy.add.at(x, operand, numpy.where(select, contribution, 0.))
+                        reached[operand[select]] = True
+            else:
+                if lists is None:
+                    lists = (pa.tolist(), pb.tolist(), mask_a.tolist(), mask_b.tolist(),
+                             [0.] * len(pa) if extra_a is None else extra_a.tolist(),
+                             [0.] * len(pb) if extra_b is None else extra_b.tolist())
+                pa_, pb_, mask_a_, mask_b_, extra_a_, extra_b_ = lists
+                a_, b_, out_, _ = self._lists
+                for i in reversed(run[1]):
+                    out = out_[i]
+                    if not reached[out]:
+                        continue
+                    g = x.item(out)
+                    if mask_a_[i]:
+                        x[a_[i]] += pa_[i] * g + extra_a_[i]
+                        reached[a_[i]] = True
+                    if mask_b_[i]:
+                        x[b_[i]] += pb_[i] * g + extra_b_[i]
+                        reached[b_[i]] = True
+
+    def recompute(self, indices):
+        import numpy
+        active = self._active(indices)
+        values = self._values
+        values[self._leaves] = numpy.fromiter((self.variables[j].saved_output for j in self._leaves.tolist()),
+                                              dtype=float, count=len(self._leaves))
+        controls = numpy.fromiter((bv.is_control for bv in self._output_variables), dtype=bool,
+                                  count=len(self.blocks))
+        if controls.any():
+            for i in numpy.flatnonzero(controls).tolist():
+                values[self._out[i]] = self._output_variables[i].saved_output
+        compute = ~controls if active is None else active & ~controls
+
+        operators = None
+        lists = None
+        for run in self._runs:
+            if run[0]:
+                _, k, a, b, out, op = run
+                select = compute[k]
+                if operators is None:
+                    operators = _vectorized_operators()
+                with numpy.errstate(all="ignore"):
+                    if select.all():
+                        values[out] = operators[op](values[a], values[b])
+                    else:
+                        values[out[select]] = operators[op](values[a[select]], values[b[select]])
+            else:
+                if lists is None:
+                    lists = compute.tolist()
+                a_, b_, out_, op_ = self._lists
+                for i in run[1]:
+                    if lists[i]:
+                        values[out_[i]] = _OPERATORS[op_[i]](values.item(a_[i]), values.item(b_[i]))
+        self._partials = None
+        self._second_partials = None
+
+        recomputed = numpy.flatnonzero(compute)
+        for i, value in zip(recomputed.tolist(), values[self._out[recomputed]].tolist()):
+            self._output_variables[i].checkpoint = value
+
+    def evaluate_adj(self, indices, markings=False):
+        import numpy
+        active = self._active(indices)
+        x, reached = self._read("adj_value")
+        pa, pb = self._derivatives()
+        mask_a, mask_b = self._operand_masks(active, self._marked(markings))
+        self._reverse(x, reached, pa, pb, mask_a, mask_b)
+        self._adjoint = (self._generation("adjoint"), x, reached)
+        values = x.tolist()
+        for j in numpy.flatnonzero(reached).tolist():
+            self.variables[j].adj_value = values[j]
+
+    def evaluate_tlm(self, indices, markings=False):
+        import numpy
+        active = self._active(indices)
+        x, reached = self._read("tlm_value")
+        pa, pb = self._derivatives()
+        marked = self._marked(markings)
+        relevant = numpy.ones(len(self.blocks), dtype=bool) if marked is None else marked[self._out]
+        if active is not None:
+            relevant &= active
+        has_b = self._has_b
+        lists = None
+        for run in self._runs:
+            if run[0]:
+                _, k, a, b, out, _ = run
+                ra = reached[a]
+                rb = reached[b] & has_b[k]
+                select = relevant[k] & (ra | rb)
+                if not select.any():
+                    continue
+                with numpy.errstate(all="ignore"):
+                    t = numpy.where(ra, pa[k] * x[a], 0.) + numpy.where(rb, pb[k] * x[b], 0.)
+                x[out[select]] += t[select]
+                reached[out[select]] = True
+            else:
+                if lists is None:
+                    lists = (pa.tolist(), pb.tolist(), relevant.tolist(), has_b.tolist())
+                pa_, pb_, relevant_, has_b_ = lists
+                a_, b_, out_, _ = self._lists
+                for i in run[1]:
+                    if not relevant_[i]:
+                        continue
+                    ra = reached[a_[i]]
+                    rb = has_b_[i] and reached[b_[i]]
+                    if not (ra or rb):
+                        continue
+                    t = 0.
+                    if ra:
+                        t += pa_[i] * x.item(a_[i])
+                    if rb:
+                        t += pb_[i] * x.item(b_[i])
+                    x[out_[i]] += t
+                    reached[out_[i]] = True
+        self._tlm = (self._generation("tlm"), x, reached)
+        values = x.tolist()
+        for j in numpy.flatnonzero(reached).tolist():
+            self.variables[j].tlm_value = values[j]
+
+    def evaluate_hessian(self, indices, markings=False):
+        import numpy
+        active = self._active(indices)
+        x, reached = self._read("hessian_value")
+        adj, _ = self._cached(self._adjoint, "adjoint", "adj_value")
+        tlm, tlm_reached = self._cached(self._tlm, "tlm", "tlm_value")
+        pa, pb = self._derivatives()
+        paa, pab, pbb = self._second_derivatives()
+        mask_a, mask_b = self._operand_masks(active, self._marked(markings))
+
+        adj_out = adj[self._out]
+        with numpy.errstate(all="ignore"):
+            ta = numpy.where(tlm_reached[self._a], tlm[self._a], 0.)
+            tb = numpy.where(tlm_reached[self._b] & self._has_b, tlm[self._b], 0.)
+            extra_a = adj_out * (numpy.where(ta != 0., paa * ta, 0.) + numpy.where(tb != 0., pab * tb, 0.))
+            extra_b = adj_out * (numpy.where(ta != 0., pab * ta, 0.) + numpy.where(tb != 0., pbb * tb, 0.))
+        extra_a = numpy.where(adj_out != 0., extra_a, 0.)
+        extra_b = numpy.where(adj_out != 0., extra_b, 0.)
+        self._reverse(x, reached, pa, pb, mask_a, mask_b, extra_a, extra_b)
+        values = x.tolist()
+        for j in numpy.flatnonzero(reached).tolist():
+            self.variables[j].hessian_value = values[j]
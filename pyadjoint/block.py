@@ -1,5 +1,30 @@
 from .tape import no_annotations
 from html import escape
+from numbers import Number
+
+
+def _stack_batch(values):
+    """Stack the values of a batch, one value per direction or functional.
+
+    Numbers and arrays are stacked into a NumPy array whose first axis runs
+    over the batch, and missing (None) values are replaced by zeros. Values of
+    other types are kept in a list. The value of entry `j` of a batch is
+    ``batch[j]`` in both cases.
+
+    Args:
+        values (list): The values of the batch.
+
+    Returns:
+        numpy.ndarray|list|None: The batch, or None if all the values are None.
+    """
+    present = [value for value in values if value is not None]
+    if not present:
+        return None
+    if all(isinstance(value, Number) or hasattr(value, "__array_interface__") for value in present):
+        import numpy
+        zero = numpy.zeros_like(numpy.asarray(present[0]))
+        return numpy.stack([zero if value is None else numpy.asarray(value) for value in values])
+    return list(values)
 
 
 class Block(object):
@@ -12,8 +37,11 @@ class Block(object):
         :func:`evaluate_adj`
 
     """
-    __slots__ = ['_dependencies', '_outputs', 'block_helper']
+    __slots__ = ['_dependencies', '_outputs', 'block_helper', 'tag', '__weakref__']
     pop_kwargs_keys = []
+    # True if the outputs depend (piecewise) linearly on the dependencies, such that the block does not
+    # contribute second order terms. Used to detect the sparsity of Hessian matrices.
+    linear = False
 
     def __init__(self, ad_block_tag=None):
         self._dependencies = []
@@ -83,6 +111,29 @@ class Block(object):
         """
         return self._outputs
 
+    def sparsity_pattern(self, patterns):
+        """Returns the structural dependence of the entries of the outputs on the entries of the controls.
+
+        The pattern of a block variable is a list with, for each entry of its
+        flattened value, see :meth:`OverloadedType._ad_flat_view`, the set of
+        flattened control entries the entry may depend on, or a single set if
+        all its entries may depend on the same control entries. Used to detect
+        the sparsity of Jacobian and Hessian matrices.
+
+        The default implementation assumes that every entry of the outputs
+        depends on every entry of the dependencies.
+
+        Args:
+            patterns (list): The pattern of each dependency.
+
+        Returns:
+            :obj:`list`: The pattern of each output.
+
+        """
+        union = frozenset().union(*(pattern if isinstance(pattern, frozenset) else frozenset().union(*pattern)
+                                    for pattern in patterns))
+        return [union] * len(self._outputs)
+
     def reset_variables(self, types=None):
         """Resets all adjoint variables in the block dependencies and outputs.
 
@@ -175,6 +226,99 @@ class Block(object):
         """
         raise NotImplementedError(type(self))
 
+    @no_annotations
+    def evaluate_adj_batch(self, markings=False):
+        """Computes the adjoint action for a batch of adjoint values at once.
+
+        During a batched sweep the `adj_value` of each block variable holds one
+        adjoint value per functional, stacked like the tangent linear values of
+        `evaluate_tlm_batch`.
+
+        If the block overrides `evaluate_adj_batch_component`, this method calls it
+        for each dependency like `evaluate_adj` calls `evaluate_adj_component`.
+        Otherwise `evaluate_adj` is called once per functional.
+
+        Args:
+            markings (bool): If True, then each block_variable will have set `marked_in_path` attribute indicating
+                whether their adjoint components are relevant for computing the final target adjoint values.
+                Default is False.
+
+        """
+        if type(self).evaluate_adj_batch_component is Block.evaluate_adj_batch_component:
+            self._evaluate_adj_by_functional(markings)
+            return
+
+        outputs = self.get_outputs()
+        adj_inputs = [output.adj_value for output in outputs]
+        if all(adj_input is None for adj_input in adj_inputs):
+            return
+
+        deps = self.get_dependencies()
+        inputs = [bv.saved_output for bv in deps]
+        relevant_dependencies = [(i, bv) for i, bv in enumerate(deps) if bv.marked_in_path or not markings]
+
+        if len(relevant_dependencies) <= 0:
+            return
+
+        prepared = self.prepare_evaluate_adj(inputs, adj_inputs, relevant_dependencies)
+
+        for idx, dep in relevant_dependencies:
+            adj_output = self.evaluate_adj_batch_component(inputs, adj_inputs, dep, idx, prepared)
+            if adj_output is not None:
+                dep.add_adj_output(adj_output)
+
+    def _evaluate_adj_by_functional(self, markings):
+        """Evaluate a batched adjoint action by calling `evaluate_adj` for each functional."""
+        outputs = self.get_outputs()
+        batches = [output.adj_value for output in outputs]
+        sizes = [len(batch) for batch in batches if batch is not None]
+        if not sizes:
+            return
+
+        # A block variable can occur several times among the dependencies.
+        deps = list(dict.fromkeys(self.get_dependencies()))
+        previous = [dep.adj_value for dep in deps]
+        results = [[] for _ in deps]
+        try:
+            for j in range(sizes[0]):
+                for output, batch in zip(outputs, batches):
+                    output.adj_value = None if batch is None else batch[j]
+                for dep in deps:
+                    dep.adj_value = None
+                self.evaluate_adj(markings=markings)
+                for result, dep in zip(results, deps):
+                    result.append(dep.adj_value)
+        finally:
+            for output, batch in zip(outputs, batches):
+                output.adj_value = batch
+            for dep, value in zip(deps, previous):
+                dep.adj_value = value
+
+        for dep, result in zip(deps, results):
+            batch = _stack_batch(result)
+            if batch is not None:
+                dep.add_adj_output(batch)
+
+    def evaluate_adj_batch_component(self, inputs, adj_inputs, block_variable, idx, prepared=None):
+        """This method can be overridden to evaluate the adjoint of a batch of adjoint values at once.
+
+        It is the batched version of `evaluate_adj_component`: the entries of
+        `adj_inputs` are batches of adjoint values, see `evaluate_adj_batch`, and
+        the returned value should be the batch of adjoint values of the dependency.
+
+        Args:
+            inputs (list): A list of the saved input values, determined by the dependencies list.
+            adj_inputs (list): A list of the batched adjoint input values, determined by the outputs list.
+            block_variable (BlockVariable): The block variable of the dependency corresponding to index `idx`.
+            idx (int): The index of the component to compute.
+            prepared (object): Anything returned by the prepare_evaluate_adj method. Default is None.
+
+        Returns:
+            A batch of objects of a type consistent with the adj_value type of `block_variable`.
+
+        """
+        raise NotImplementedError(type(self))
+
     @no_annotations
     def evaluate_tlm(self, markings=False):
         """Computes the tangent linear action and stores the result in the `tlm_value` attribute of the outputs.
@@ -255,6 +399,101 @@ class Block(object):
         """
         raise NotImplementedError("evaluate_tlm_component is not implemented for Block-type: {}".format(type(self)))
 
+    @no_annotations
+    def evaluate_tlm_batch(self, markings=False):
+        """Computes the tangent linear action for a batch of directions at once.
+
+        During a batched sweep the `tlm_value` of each block variable holds one
+        tangent linear value per direction, as returned by ``_stack_batch``:
+        a NumPy array whose first axis runs over the directions for floats and
+        arrays, and a list otherwise.
+
+        If the block overrides `evaluate_tlm_batch_component`, this method calls it
+        for each output like `evaluate_tlm` calls `evaluate_tlm_component`.
+        Otherwise `evaluate_tlm` is called once per direction.
+
+        Args:
+            markings (bool): If True, then each block_variable will have set `marked_in_path` attribute indicating
+                whether their tlm components are relevant for computing the final target tlm values.
+                Default is False.
+
+        """
+        if type(self).evaluate_tlm_batch_component is Block.evaluate_tlm_batch_component:
+            self._evaluate_tlm_by_direction(markings)
+            return
+
+        deps = self.get_dependencies()
+        tlm_inputs = [dep.tlm_value for dep in deps]
+        if all(tlm_input is None for tlm_input in tlm_inputs):
+            return
+
+        outputs = self.get_outputs()
+        inputs = [bv.saved_output for bv in deps]
+        relevant_outputs = [(i, bv) for i, bv in enumerate(outputs) if bv.marked_in_path or not markings]
+
+        if len(relevant_outputs) <= 0:
+            return
+
+        prepared = self.prepare_evaluate_tlm(inputs, tlm_inputs, relevant_outputs)
+
+        for idx, out in relevant_outputs:
+            tlm_output = self.evaluate_tlm_batch_component(inputs, tlm_inputs, out, idx, prepared)
+            if tlm_output is not None:
+                out.add_tlm_output(tlm_output)
+
+    def _evaluate_tlm_by_direction(self, markings):
+        """Evaluate a batched tangent linear action by calling `evaluate_tlm` for each direction."""
+        deps = self.get_dependencies()
+        batches = [dep.tlm_value for dep in deps]
+        sizes = [len(batch) for batch in batches if batch is not None]
+        if not sizes:
+            return
+
+        outputs = self.get_outputs()
+        previous = [out.tlm_value for out in outputs]
+        results = [[] for _ in outputs]
+        try:
+            for j in range(sizes[0]):
+                for dep, batch in zip(deps, batches):
+                    dep.tlm_value = None if batch is None else batch[j]
+                for out in outputs:
+                    out.tlm_value = None
+                self.evaluate_tlm(markings=markings)
+                for result, out in zip(results, outputs):
+                    result.append(out.tlm_value)
+        finally:
+            for dep, batch in zip(deps, batches):
+                dep.tlm_value = batch
+            for out, value in zip(outputs, previous):
+                out.tlm_value = value
+
+        for out, result in zip(outputs, results):
+            batch = _stack_batch(result)
+            if batch is not None:
+                out.add_tlm_output(batch)
+
+    def evaluate_tlm_batch_component(self, inputs, tlm_inputs, block_variable, idx, prepared=None):
+        """This method can be overridden to evaluate the tangent linear model of a batch of directions at once.
+
+        It is the batched version of `evaluate_tlm_component`: the entries of
+        `tlm_inputs` are batches of tlm values, see `evaluate_tlm_batch`, and
+        the returned value should be the batch of tlm values of the output.
+        Blocks whose operations can be applied to all directions at once (e.g. as
+        a single matrix-matrix product) should override this method.
+
+        Args:
+            inputs (list): A list of the saved input values, determined by the dependencies list.
+            tlm_inputs (list): A list of the batched tlm input values, determined by the dependencies list.
+            block_variable (BlockVariable): The block variable of the output corresponding to index `idx`.
+            idx (int): The index of the component to compute.
+            prepared (object): Anything returned by the prepare_evaluate_tlm method. Default is None.
+
+        Returns:
+            A batch of objects of the same type as `block_variable.saved_output`: The resulting products.
+
+        """
+        raise NotImplementedError(type(self))
+
     @no_annotations
     def evaluate_hessian(self, markings=False):
         outputs = self.get_outputs()
@@ -1,39 +1,178 @@
-from .tape import no_annotations
+from .tape import no_annotations, _untaped_generations, _accumulation_locks
+from .checkpoint_storage import StoredCheckpoint
+
+
+class LazyAdjoint(object):
+    """Base class for adjoint contributions which are accumulated lazily.
+
+    A block can return an instance from `evaluate_adj_component` or
+    `evaluate_hessian_component` to avoid forming its contribution to the
+    adjoint of a dependency, e.g. when only a few entries of a large array are
+    nonzero. The contributions are accumulated by
+    :meth:`BlockVariable.add_adj_output` and
+    :meth:`BlockVariable.add_hessian_output` without evaluating them, and are
+    evaluated once when the adjoint or Hessian value is read.
+    """
+
+    def add(self, value):
+        """Return the sum of `self` and the contribution `value`, which may be lazy too.
+
+        `self` may be modified and returned.
+        """
+        raise NotImplementedError
+
+    def add_to(self, value):
+        """Return the sum of the evaluated contribution `value` and `self`.
+
+        `value` may be modified and returned.
+        """
+        raise NotImplementedError
+
+    def evaluate(self):
+        """Return the value of the accumulated contributions."""
+        raise NotImplementedError
+
+
+def _accumulate(value, contribution):
+    """Return the sum of the accumulated `value` and `contribution`, keeping lazy contributions unevaluated."""
+    if value is None:
+        return contribution
+    if isinstance(value, LazyAdjoint):
+        return value.add(contribution)
+    if isinstance(contribution, LazyAdjoint):
+        return contribution.add_to(value)
+    value += contribution
+    return value
 
 
 class BlockVariable(object):
     """References a block output variable.
 
     """
+    __slots__ = ["output", "_generations", "_adj_value", "_adj_generation", "_tlm_value", "_tlm_generation",
+                 "_hessian_value", "_hessian_generation", "_checkpoint", "is_control",
+                 "floating_type", "marked_in_path", "__weakref__"]
 
     def __init__(self, output):
         self.output = output
-        self.adj_value = None
-        self.tlm_value = None
-        self.hessian_value = None
+        # The adjoint, TLM and Hessian values, and the sweep generation in
+        # which they were set. Values from earlier generations of the tape the
+        # block variable follows read as None.
+        self._generations = _untaped_generations
+        self._adj_value = None
+        self._adj_generation = 0
+        self._tlm_value = None
+        self._tlm_generation = 0
+        self._hessian_value = None
+        self._hessian_generation = 0
         self._checkpoint = None
         self.is_control = False
         self.floating_type = False
         # Helper flag for use during tape traversals.
         self.marked_in_path = False
 
+    @property
+    def adj_value(self):
+        if self._adj_generation != self._generations.adjoint:
+            # Drop the stale value so that its memory can be released.
+            self._adj_value = None
+            return None
+        if isinstance(self._adj_value, LazyAdjoint):
+            self._adj_value = self._adj_value.evaluate()
+        return self._adj_value
+
+    @adj_value.setter
+    def adj_value(self, value):
+        self._adj_value = value
+        self._adj_generation = self._generations.adjoint
+
+    @property
+    def tlm_value(self):
+        if self._tlm_generation != self._generations.tlm:
+            self._tlm_value = None
+            return None
+        return self._tlm_value
+
+    @tlm_value.setter
+    def tlm_value(self, value):
+        self._tlm_value = value
+        self._tlm_generation = self._generations.tlm
+
+    @property
+    def hessian_value(self):
+        if self._hessian_generation != self._generations.hessian:
+            self._hessian_value = None
+            return None
+        if isinstance(self._hessian_value, LazyAdjoint):
+            self._hessian_value = self._hessian_value.evaluate()
+        return self._hessian_value
+
+    @hessian_value.setter
+    def hessian_value(self, value):
+        self._hessian_value = value
+        self._hessian_generation = self._generations.hessian
+
+    def _follow(self, generations):
+        """Follow the sweep generations of a tape, keeping the current values.
+
+        Args:
+            generations (tape._SweepGenerations): The generations of the tape.
+
+        Returns:
+            bool: False if the block variable already follows the generations of another tape.
+        """
+        current = self._generations
+        if current is generations:
+            return True
+        if current is not _untaped_generations:
+            return False
+        if self._adj_generation != current.adjoint:
+            self._adj_value = None
+        if self._tlm_generation != current.tlm:
+            self._tlm_value = None
+        if self._hessian_generation != current.hessian:
+            self._hessian_value = None
+        self._generations = generations
+        self._adj_generation = generations.adjoint
+        self._tlm_generation = generations.tlm
+        self._hessian_generation = generations.hessian
+        return True
+
     def add_adj_output(self, val):
-        if self.adj_value is None:
-            self.adj_value = val
+        if _accumulation_locks.active:
+            with _accumulation_locks.get(self):
+                self._add_adj_output(val)
         else:
-            self.adj_value += val
+            self._add_adj_output(val)
+
+    def _add_adj_output(self, val):
+        # Lazy contributions are only evaluated when the adjoint value is read.
+        current = self._adj_value if self._adj_generation == self._generations.adjoint else None
+        self.adj_value = _accumulate(current, val)
 
     def add_tlm_output(self, val):
+        if _accumulation_locks.active:
+            with _accumulation_locks.get(self):
+                self._add_tlm_output(val)
+        else:
+            self._add_tlm_output(val)
+
+    def _add_tlm_output(self, val):
         if self.tlm_value is None:
             self.tlm_value = val
         else:
             self.tlm_value += val
 
     def add_hessian_output(self, val):
-        if self.hessian_value is None:
-            self.hessian_value = val
+        if _accumulation_locks.active:
+            with _accumulation_locks.get(self):
+                self._add_hessian_output(val)
         else:
-            self.hessian_value += val
+            self._add_hessian_output(val)
+
+    def _add_hessian_output(self, val):
+        current = self._hessian_value if self._hessian_generation == self._generations.hessian else None
+        self.hessian_value = _accumulate(current, val)
 
     def reset_variables(self, types):
         if "adjoint" in types:
@@ -47,13 +186,14 @@ class BlockVariable(object):
 
     @no_annotations
     def save_output(self, overwrite=True):
-        if overwrite or self.checkpoint is None:
+        if overwrite or self._checkpoint is None:
             self._checkpoint = self.output._ad_create_checkpoint()
 
     @property
     def saved_output(self):
-        if self.checkpoint is not None:
-            return self.output._ad_restore_at_checkpoint(self.checkpoint)
+        checkpoint = self.checkpoint
+        if checkpoint is not None:
+            return self.output._ad_restore_at_checkpoint(checkpoint)
         else:
             return self.output
 
@@ -72,6 +212,8 @@ class BlockVariable(object):
 
     @property
     def checkpoint(self):
+        if isinstance(self._checkpoint, StoredCheckpoint):
+            return self._checkpoint.value
         return self._checkpoint
 
     @checkpoint.setter
@@ -0,0 +1,408 @@
+import lzma
+import struct
+import threading
+import weakref
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Future
+from itertools import count
+
+import numpy
+
+from .checkpoint_storage import StoredCheckpoint, RAM, COMPRESSED, _detach
+
+
+class CheckpointCodec(object):
+    """Base class for the encodings of checkpoints used by a :class:`CodecCheckpointStorage`.
+
+    A codec encodes floating point NumPy arrays to bytes with :meth:`encode`,
+    and decodes them with :meth:`decode`. A lossy codec also implements
+    :meth:`round`, which returns the array as it is decoded, so that a
+    checkpoint has the same value before and after it is encoded.
+    """
+
+    #: False if the decoded arrays differ from the encoded arrays.
+    lossless = True
+
+    def round(self, array):
+        """Return `array` as it is decoded after being encoded."""
+        return array
+
+    def encode(self, array):
+        """Return the contiguous array `array` encoded as bytes."""
+        raise NotImplementedError
+
+    def decode(self, data, dtype, shape):
+        """Return the array with `dtype` and `shape` encoded as the bytes `data`."""
+        raise NotImplementedError
+
+    def __repr__(self):
+        return "%s()" % type(self).__name__
+
+
+class ZlibCodec(CheckpointCodec):
+    """Lossless compression of the array data with :mod:`zlib`.
+
+    Args:
+        level (int): The zlib compression level. Default 1.
+    """
+
+    def __init__(self, level=1):
+        self.level = level
+
+    def encode(self, array):
+        return zlib.compress(array.tobytes(), self.level)
+
+    def decode(self, data, dtype, shape):
+        return numpy.frombuffer(zlib.decompress(data), dtype=dtype).reshape(shape)
+
+    def __repr__(self):
+        return "ZlibCodec(level=%d)" % self.level
+
+
+class LzmaCodec(CheckpointCodec):
+    """Lossless compression of the array data with :mod:`lzma`.
+
+    LZMA compresses better than zlib, but is considerably slower.
+
+    Args:
+        preset (int): The lzma compression preset. Default 0.
+    """
+
+    def __init__(self, preset=0):
+        self.preset = preset
+
+    def encode(self, array):
+        return lzma.compress(array.tobytes(), preset=self.preset)
+
+    def decode(self, data, dtype, shape):
+        return numpy.frombuffer(lzma.decompress(data), dtype=dtype).reshape(shape)
+
+    def __repr__(self):
+        return "LzmaCodec(preset=%d)" % self.preset
+
+
+class Float32Codec(CheckpointCodec):
+    """Lossy encoding of the array data in single precision.
+
+    The relative error of each value is at most about 6e-8. Arrays of at most
+    single precision are encoded losslessly.
+    """
+    lossless = False
+
+    def round(self, array):
+        return array.astype(numpy.float32).astype(array.dtype)
+
+    def encode(self, array):
+        return array.astype(numpy.float32).tobytes()
+
+    def decode(self, data, dtype, shape):
+        return numpy.frombuffer(data, dtype=numpy.float32).astype(dtype).reshape(shape)
+
+
+class QuantizeCodec(CheckpointCodec):
+    """Lossy encoding of the array data with an absolute error bound.
+
+    The values are rounded to the nearest multiple of twice `tolerance` above
+    the smallest value of the array, and the multiples are stored as the
+    smallest unsigned integers which can hold them, compressed with
+    :mod:`zlib`. Arrays with values which are not finite, or whose range is
+    too large for the tolerance, are encoded losslessly.
+
+    Args:
+        tolerance (float): The largest absolute error of a value.
+        level (int): The zlib compression level. Default 1.
+    """
+    lossless = False
+
+    # The header of the encoded data: the smallest value and the size of the integers,
+    # 0 if the data is not quantized.
+    _header = struct.Struct("<dB")
+
+    def __init__(self, tolerance, level=1):
+        if not tolerance > 0:
+            raise ValueError("The tolerance must be positive.")
+        self.tolerance = tolerance
+        self.level = level
+
+    def _quantize(self, array):
+        """Return the smallest value of `array` and its values as multiples of the step above it,
+        or None if `array` can not be quantized."""
+        values = numpy.asarray(array, dtype=numpy.float64)
+        if not values.size or not numpy.isfinite(values).all():
+            return None
+        low = values.min()
+        levels = numpy.rint((values - low) / (2 * self.tolerance))
+        # The levels must be exact integers in double precision.
+        if levels.max() >= 2 ** 53:
+            return None
+        return low, levels
+
+    def _dequantize(self, low, levels, dtype):
+        return (low + levels * (2 * self.tolerance)).astype(dtype, copy=False)
+
+    def round(self, array):
+        quantized = self._quantize(array)
+        if quantized is None:
+            return array
+        return self._dequantize(*quantized, array.dtype)
+
+    def encode(self, array):
+        quantized = self._quantize(array)
+        if quantized is None:
+            return self._header.pack(0., 0) + zlib.compress(array.tobytes(), self.level)
+        low, levels = quantized
+        itemsize = numpy.min_scalar_type(int(levels.max())).itemsize
+        data = levels.astype("<u%d" % itemsize).tobytes()
+        return self._header.pack(low, itemsize) + zlib.compress(data, self.level)
+
+    def decode(self, data, dtype, shape):
+        low, itemsize = self._header.unpack_from(data)
+        data = zlib.decompress(memoryview(data)[self._header.size:])
+        if not itemsize:
+            return numpy.frombuffer(data, dtype=dtype).reshape(shape)
+        levels = numpy.frombuffer(data, dtype="<u%d" % itemsize).astype(numpy.float64)
+        return self._dequantize(low, levels, dtype).reshape(shape)
+
+    def __repr__(self):
+        return "QuantizeCodec(tolerance=%g, level=%d)" % (self.tolerance, self.level)
+
+
+class _CodecEntry(object):
+    """The stored data of one checkpoint in a :class:`CodecCheckpointStorage`."""
+    __slots__ = ["key", "position", "tag", "codec", "tier", "data", "nbytes", "raw_nbytes",
+                 "cls", "dtype", "shape", "decoded"]
+
+    def __init__(self, key, position, tag, codec, value):
+        self.key = key
+        self.position = position
+        self.tag = tag
+        self.codec = codec
+        self.cls = type(value)
+        array = numpy.ascontiguousarray(value)
+        self.dtype = array.dtype
+        self.shape = array.shape
+        # The rounded array until it is encoded, and then the encoded bytes.
+        self.tier = RAM
+        self.data = codec.round(array)
+        self.nbytes = self.raw_nbytes = array.nbytes
+        # The decoded array, or the future decoding it, while it is cached.
+        self.decoded = None
+
+
+class CodecCheckpointStorage(object):
+    """Storage for the checkpoints of a tape encoded with a :class:`CheckpointCodec`.
+
+    The floating point NumPy array checkpoints of the blocks are encoded with
+    the codec for the tag of the block, given in `codecs`, or with `default`
+    for the other blocks. The codecs are the lossless :class:`ZlibCodec` and
+    :class:`LzmaCodec`, and the lossy :class:`Float32Codec` and
+    :class:`QuantizeCodec`. Checkpoints without a codec, checkpoints which are
+    not floating point arrays, and checkpoints which are the block variable
+    output itself are kept as they are.
+
+    Checkpoints are encoded by a pool of `workers` background threads, and
+    are held in RAM until they are encoded. During reverse sweeps, the
+    checkpoints of the next `prefetch` blocks are decoded in the background,
+    and the most recently decoded `cache_size` checkpoints are kept until the
+    sweep has passed the blocks which computed them.
+
+    A checkpoint stored with a lossy codec is rounded to its decoded value
+    when it is stored, so every block reading it, including the blocks
+    recomputed after it, sees the same value. Recomputed functionals and
+    their derivatives are then approximations, whose error can be checked
+    with :func:`pyadjoint.taylor_test`.
+
+    The storage is used with :meth:`Tape.set_checkpoint_storage`.
+
+    Args:
+        default (CheckpointCodec|None): The codec of the blocks whose tag is not in
+            `codecs`. If None, their checkpoints are kept as they are.
+        codecs (dict|None): The codec for each block tag. A codec of None keeps the
+            checkpoints of the blocks with that tag as they are.
+        workers (int): The number of threads encoding and decoding checkpoints.
+            If 0, checkpoints are encoded when they are stored and decoded when
+            they are loaded. Default 1.
+        prefetch (int): The number of blocks ahead of a reverse sweep whose
+            checkpoints are decoded in the background. Default 1.
+        cache_size (int): The largest number of decoded checkpoints kept in RAM. Default 16.
+    """
+
+    def __init__(self, default=None, codecs=None, workers=1, prefetch=1, cache_size=16):
+        self.default = default
+        self.codecs = dict(codecs or {})
+        self.workers = workers
+        self.prefetch_depth = int(prefetch) if workers else 0
+        self.cache_size = cache_size
+        self.cursor = None
+        self._entries = {}
+        self._refs = {}
+        self._keys = count()
+        self._bytes = {RAM: 0, COMPRESSED: 0}
+        self._cache = OrderedDict()
+        self._pending = set()
+        self._lock = threading.RLock()
+        self._executor = None
+
+    def codec(self, tag):
+        """Return the codec of the blocks with `tag`."""
+        return self.codecs.get(tag, self.default)
+
+    def store(self, block_variable, position=None, tag=None):
+        """Encode the checkpoint of `block_variable` with the codec of `tag`.
+
+        Args:
+            block_variable (BlockVariable): The block variable whose checkpoint to store.
+            position (int|None): The index on the tape of the block which computed the checkpoint.
+            tag (str|None): The tag of the block which computed the checkpoint.
+        """
+        codec = self.codec(tag)
+        if codec is None:
+            return
+        value = _detach(block_variable._checkpoint)
+        if value is None or isinstance(value, StoredCheckpoint) or value is block_variable.output:
+            return
+        if not isinstance(value, numpy.ndarray) or value.dtype.kind != "f":
+            return
+        entry = _CodecEntry(next(self._keys), position, tag, codec, value)
+        handle = StoredCheckpoint(self, entry)
+        with self._lock:
+            self._entries[entry.key] = entry
+            self._refs[entry.key] = weakref.ref(handle, self._callback(entry))
+            self._bytes[RAM] += entry.nbytes
+        block_variable._checkpoint = handle
+        if self.workers:
+            future = self._submit(self._encode, entry)
+            with self._lock:
+                self._pending.add(future)
+            future.add_done_callback(self._pending.discard)
+        else:
+            self._encode(entry)
+
+    def load(self, entry):
+        """Return the value of a stored checkpoint, decoding it if needed."""
+        with self._lock:
+            if entry.tier == RAM:
+                return self._view(entry, entry.data)
+            decoded = entry.decoded
+            if decoded is not None:
+                self._cache.move_to_end(entry.key)
+        if isinstance(decoded, Future):
+            decoded = decoded.result()
+        elif decoded is None:
+            decoded = self._decode(entry)
+            with self._lock:
+                if entry.key in self._entries and self.cursor is not None:
+                    self._cache_decoded(entry, decoded)
+        return self._view(entry, decoded)
+
+    def move_cursor(self, position, blocks):
+        """Update the position of the reverse sweep, decoding the checkpoints of the next blocks.
+
+        Args:
+            position (int|None): The index of the block being evaluated, or None at
+                the end of the sweep.
+            blocks (list[Block]): The blocks on the tape.
+        """
+        first = self.cursor is None
+        with self._lock:
+            self.cursor = position
+            # The checkpoints of the blocks behind the cursor are not needed again by this sweep.
+            for entry in list(self._cache.values()):
+                if position is None or entry.position is None or entry.position > position:
+                    self._uncache(entry)
+        if position is not None and self.prefetch_depth:
+            start = position - self.prefetch_depth
+            window = range(max(start, 0), position) if first else range(max(start, 0), max(start + 1, 0))
+            for i in window:
+                self._prefetch(blocks[i])
+
+    def wait(self):
+        """Wait until all stored checkpoints are encoded."""
+        with self._lock:
+            pending = list(self._pending)
+        for future in pending:
+            future.result()
+
+    def nbytes(self, tier=None):
+        """Return the number of bytes of the checkpoints waiting to be encoded in RAM, or of the
+        encoded checkpoints in COMPRESSED, or of both if `tier` is None."""
+        if tier is None:
+            return sum(self._bytes.values())
+        return self._bytes.get(tier, 0)
+
+    def compression_ratios(self):
+        """Return the ratio of the size of the checkpoints to their encoded size for each block tag.
+
+        The checkpoints waiting to be encoded are not included, see :meth:`wait`.
+
+        Returns:
+            dict: The compression ratio of the checkpoints of the blocks with each tag.
+        """
+        totals = {}
+        with self._lock:
+            for entry in self._entries.values():
+                if entry.tier == COMPRESSED:
+                    raw, encoded = totals.get(entry.tag, (0, 0))
+                    totals[entry.tag] = (raw + entry.raw_nbytes, encoded + entry.nbytes)
+        return {tag: raw / max(encoded, 1) for tag, (raw, encoded) in totals.items()}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _submit(self, function, *args):
+        if self._executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pyadjoint-codec")
+        return self._executor.submit(function, *args)
+
+    def _encode(self, entry):
+        with self._lock:
+            if entry.tier != RAM or entry.key not in self._entries:
+                return
+            array = entry.data
+        data = entry.codec.encode(array)
+        with self._lock:
+            if entry.key in self._entries:
+                self._bytes[RAM] -= entry.nbytes
+                entry.tier = COMPRESSED
+                entry.data = data
+                entry.nbytes = len(data)
+                self._bytes[COMPRESSED] += entry.nbytes
+
+    def _decode(self, entry):
+        return entry.codec.decode(entry.data, entry.dtype, entry.shape)
+
+    def _view(self, entry, array):
+        if entry.cls is not numpy.ndarray and type(array) is not entry.cls:
+            array = array.view(entry.cls)
+        return array
+
+    def _prefetch(self, block):
+        """Decode the checkpoints of the dependencies and outputs of `block` in the background."""
+        with self._lock:
+            for bv in block.get_dependencies() + block.get_outputs():
+                checkpoint = bv._checkpoint
+                if isinstance(checkpoint, StoredCheckpoint) and checkpoint.storage is self:
+                    entry = checkpoint.entry
+                    if entry.tier == COMPRESSED and entry.decoded is None:
+                        self._cache_decoded(entry, self._submit(self._decode, entry))
+
+    def _cache_decoded(self, entry, decoded):
+        entry.decoded = decoded
+        self._cache[entry.key] = entry
+        while len(self._cache) > self.cache_size:
+            self._uncache(next(iter(self._cache.values())))
+
+    def _uncache(self, entry):
+        self._cache.pop(entry.key, None)
+        entry.decoded = None
+
+    def _callback(self, entry):
+        def discard(ref):
+            with self._lock:
+                self._refs.pop(entry.key, None)
+                if self._entries.pop(entry.key, None) is not None:
+                    self._bytes[entry.tier] -= entry.nbytes
+                    self._uncache(entry)
+        return discard
@@ -0,0 +1,518 @@
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import threading
+import weakref
+import zlib
+from collections import OrderedDict
+from itertools import count
+
+
+RAM = "ram"
+COMPRESSED = "compressed"
+DISK = "disk"
+
+
+def _nbytes(value):
+    """Return an estimate of the memory held by a value, see :meth:`OverloadedType._ad_nbytes`."""
+    ad_nbytes = getattr(value, "_ad_nbytes", None)
+    nbytes = ad_nbytes() if ad_nbytes is not None else None
+    if nbytes is None:
+        nbytes = getattr(value, "nbytes", None)
+    if isinstance(nbytes, int):
+        return nbytes
+    return sys.getsizeof(value)
+
+
+def _detach(value):
+    """Return a checkpoint which shares no memory with its output, see
+    :class:`numpy_adjoint.array.CopyOnWriteCheckpoint`, or `value` if it holds its own memory."""
+    ad_detach = getattr(value, "_ad_detach", None)
+    return ad_detach() if ad_detach is not None else value
+
+
+class _Entry(object):
+    """The stored data of one checkpoint."""
+    __slots__ = ["key", "position", "tier", "data", "nbytes", "cls", "path", "pinned"]
+
+    def __init__(self, key, position, value):
+        self.key = key
+        self.position = position
+        self.tier = RAM
+        self.data = value
+        self.nbytes = _nbytes(value)
+        self.cls = type(value)
+        self.path = None
+        # True if the checkpoint can not be evicted from RAM.
+        self.pinned = False
+
+
+class StoredCheckpoint(object):
+    """A reference to a checkpoint held by a :class:`CheckpointStorage`.
+
+    Instances of this class are stored in place of the checkpoint value on a
+    :class:`BlockVariable`. The value is retrieved, from whichever tier it is
+    currently stored in, through the `value` property. The stored data is
+    released when the reference is garbage collected.
+    """
+    __slots__ = ["storage", "entry", "__weakref__"]
+
+    def __init__(self, storage, entry):
+        self.storage = storage
+        self.entry = entry
+
+    @property
+    def value(self):
+        return self.storage.load(self.entry)
+
+
+class CheckpointStorage(object):
+    """Tiered storage for the checkpoints of a tape.
+
+    Checkpoints are kept in RAM up to `memory_budget` bytes. When the budget
+    is exceeded, checkpoints are evicted to a compressed in-memory tier and,
+    when that tier exceeds `compressed_budget` bytes, to files in a temporary
+    directory. NumPy arrays on disk are memory-mapped copy-on-write when they
+    are read back. Checkpoints are moved back to RAM when they are accessed.
+
+    Checkpoints which are the block variable output itself (such as the
+    checkpoints of immutable types like :class:`AdjFloat`) and checkpoints
+    which can not be pickled are always kept in RAM.
+
+    Args:
+        memory_budget (int): The number of bytes of uncompressed checkpoints to
+            keep in RAM.
+        compressed_budget (int|None): The number of bytes of compressed
+            checkpoints to keep in RAM. Defaults to `memory_budget`. If 0, the
+            compressed tier is skipped.
+        policy (str): The eviction policy, either "lru" to evict the least
+            recently used checkpoints first, or "cursor" to evict the
+            checkpoints furthest from the current position of the reverse
+            sweep first. Outside of reverse sweeps "cursor" falls back to "lru".
+        disk (bool): If False, checkpoints are never written to disk and the
+            compressed tier is unbounded. Default True.
+        directory (str|None): The parent directory of the temporary directory
+            for the disk tier. Defaults to the system temporary directory.
+        prefetch (bool|int): If true, a background thread moves the checkpoints
+            of the next blocks of a reverse sweep back to RAM ahead of time. An
+            integer gives the number of blocks to prefetch. Default False.
+        compression_level (int): The zlib compression level. Default 1.
+    """
+
+    def __init__(self, memory_budget, compressed_budget=None, policy="lru", disk=True,
+                 directory=None, prefetch=False, compression_level=1):
+        if policy not in ("lru", "cursor"):
+            raise ValueError(f"Unknown eviction policy '{policy}'.")
+        self.memory_budget = memory_budget
+        self.compressed_budget = memory_budget if compressed_budget is None else compressed_budget
+        self.policy = policy
+        self.disk = disk
+        self.prefetch_depth = int(prefetch)
+        self.compression_level = compression_level
+        self.cursor = None
+        self._directory = directory
+        self._tmpdir = None
+        self._tiers = {RAM: OrderedDict(), COMPRESSED: OrderedDict(), DISK: OrderedDict()}
+        self._bytes = {RAM: 0, COMPRESSED: 0, DISK: 0}
+        self._refs = {}
+        self._keys = count()
+        self._lock = threading.RLock()
+        self._executor = None
+
+    def store(self, block_variable, position=None, tag=None):
+        """Move the checkpoint of `block_variable` into the storage.
+
+        Args:
+            block_variable (BlockVariable): The block variable whose checkpoint to store.
+            position (int|None): The index on the tape of the block which computed
+                the checkpoint. Used by the "cursor" eviction policy.
+            tag (str|None): The tag of the block which computed the checkpoint. Unused.
+        """
+        value = _detach(block_variable._checkpoint)
+        if value is None or isinstance(value, StoredCheckpoint) or value is block_variable.output:
+            return
+        with self._lock:
+            entry = _Entry(next(self._keys), position, value)
+            handle = StoredCheckpoint(self, entry)
+            self._refs[entry.key] = weakref.ref(handle, self._callback(entry))
+            self._add(entry, RAM)
+            self._evict(keep=entry)
+        block_variable._checkpoint = handle
+
+    def load(self, entry):
+        """Return the value of a stored checkpoint, moving it to RAM if needed."""
+        with self._lock:
+            if entry.tier == RAM:
+                self._tiers[RAM].move_to_end(entry.key)
+                return entry.data
+            value = self._decode(entry)
+            self._remove(entry)
+            entry.data = value
+            entry.nbytes = _nbytes(value)
+            self._add(entry, RAM)
+            self._evict(keep=entry)
+            return value
+
+    def move_cursor(self, position, blocks):
+        """Update the position of the reverse sweep.
+
+        Args:
+            position (int|None): The index of the block being evaluated, or None at
+                the end of the sweep.
+            blocks (list[Block]): The blocks on the tape.
+        """
+        first = self.cursor is None
+        self.cursor = position
+        if position is not None and self.prefetch_depth:
+            start = position - self.prefetch_depth
+            window = range(max(start, 0), position) if first else range(max(start, 0), max(start + 1, 0))
+            for i in window:
+                self._prefetch(blocks[i])
+
+    def _prefetch(self, block):
+        """Move the checkpoints of the dependencies and outputs of `block` to RAM in the background."""
+        entries = [bv._checkpoint.entry
+                   for bv in block.get_dependencies() + block.get_outputs()
+                   if isinstance(bv._checkpoint, StoredCheckpoint) and bv._checkpoint.entry.tier != RAM]
+        if entries:
+            if self._executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pyadjoint-prefetch")
+            for entry in entries:
+                self._executor.submit(self.load, entry)
+
+    def nbytes(self, tier=None):
+        """Return the number of bytes stored in a tier, or in all tiers if `tier` is None."""
+        if tier is None:
+            return sum(self._bytes.values())
+        return self._bytes[tier]
+
+    def __len__(self):
+        return len(self._refs)
+
+    def _callback(self, entry):
+        def discard(ref):
+            with self._lock:
+                self._refs.pop(entry.key, None)
+                self._remove(entry)
+        return discard
+
+    def _add(self, entry, tier):
+        entry.tier = tier
+        self._tiers[tier][entry.key] = entry
+        self._bytes[tier] += entry.nbytes
+
+    def _remove(self, entry):
+        if self._tiers[entry.tier].pop(entry.key, None) is not None:
+            self._bytes[entry.tier] -= entry.nbytes
+            if entry.path is not None:
+                os.remove(entry.path)
+                entry.path = None
+
+    def _victim(self, tier, keep):
+        entries = self._tiers[tier]
+        if self.policy == "cursor" and self.cursor is not None:
+            cursor = self.cursor
+
+            def distance(e):
+                position = e.position if e.position is not None else 0
+                # Checkpoints behind the cursor are not needed again by this sweep.
+                return float("inf") if position > cursor else cursor - position
+            candidates = [e for e in list(entries.values()) if e is not keep and not e.pinned]
+            return max(candidates, key=distance, default=None)
+        for e in list(entries.values()):
+            if e is not keep and not e.pinned:
+                return e
+        return None
+
+    def _evict(self, keep=None):
+        next_tier = COMPRESSED if self.compressed_budget > 0 or not self.disk else DISK
+        while self._bytes[RAM] > self.memory_budget:
+            entry = self._victim(RAM, keep)
+            if entry is None:
+                break
+            self._demote(entry, next_tier)
+        if self.disk:
+            while self._bytes[COMPRESSED] > self.compressed_budget:
+                entry = self._victim(COMPRESSED, keep)
+                if entry is None:
+                    break
+                self._demote(entry, DISK)
+
+    def _demote(self, entry, tier):
+        value = self._decode(entry)
+        try:
+            if tier == COMPRESSED:
+                data = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL),
+                                     self.compression_level)
+                nbytes = len(data)
+                path = None
+            else:
+                data, path = self._write(entry.key, value)
+                nbytes = entry.nbytes
+        except (pickle.PicklingError, TypeError, AttributeError):
+            # The checkpoint can not be serialised, so it stays in RAM.
+            entry.pinned = True
+            return
+        self._remove(entry)
+        entry.data = data
+        entry.path = path
+        entry.nbytes = nbytes
+        self._add(entry, tier)
+
+    def _write(self, key, value):
+        if self._tmpdir is None:
+            self._tmpdir = tempfile.mkdtemp(prefix="pyadjoint-", dir=self._directory)
+            weakref.finalize(self, shutil.rmtree, self._tmpdir, True)
+        import numpy
+        if isinstance(value, numpy.ndarray) and value.dtype != object:
+            path = os.path.join(self._tmpdir, f"{key}.npy")
+            numpy.save(path, numpy.asarray(value), allow_pickle=False)
+            return None, path
+        path = os.path.join(self._tmpdir, f"{key}.pickle")
+        with open(path, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return None, path
+
+    def _decode(self, entry):
+        if entry.tier == RAM:
+            return entry.data
+        elif entry.tier == COMPRESSED:
+            return pickle.loads(zlib.decompress(entry.data))
+        elif entry.path.endswith(".npy"):
+            import numpy
+            # A private mapping, whose pages are read when accessed and copied
+            # when written to. It keeps the data after the file is removed.
+            return numpy.load(entry.path, mmap_mode="c").view(entry.cls)
+        else:
+            with open(entry.path, "rb") as f:
+                return pickle.load(f)
+
+
+class _Arena(object):
+    """An append-only file of checkpoint data, memory-mapped for reading."""
+    __slots__ = ["path", "file", "size", "map"]
+
+    # The alignment of the data in the file, in bytes.
+    alignment = 64
+
+    def __init__(self, directory):
+        fd, self.path = tempfile.mkstemp(prefix="arena-", suffix=".bin", dir=directory)
+        self.file = os.fdopen(fd, "wb")
+        self.size = 0
+        self.map = None
+
+    def append(self, array):
+        """Write the data of a contiguous array at the end of the file, and return its offset."""
+        offset = -(-self.size // self.alignment) * self.alignment
+        if offset > self.size:
+            self.file.write(b"\0" * (offset - self.size))
+        self.file.write(array.data)
+        self.size = offset + array.nbytes
+        return offset
+
+    def read(self, offset, nbytes):
+        """Return a read-only memory-mapped view of `nbytes` bytes at `offset`."""
+        import numpy
+        if self.map is None or self.map.size < offset + nbytes:
+            # Views of the previous map remain valid.
+            self.file.flush()
+            self.map = numpy.memmap(self.path, dtype=numpy.uint8, mode="r", shape=(self.size,))
+        return self.map[offset:offset + nbytes]
+
+    def close(self):
+        """Delete the file. Existing views keep the data mapped until they are released."""
+        self.file.close()
+        self.map = None
+        os.remove(self.path)
+
+
+def _close_arenas(arenas, directory):
+    for arena in arenas:
+        arena.close()
+    shutil.rmtree(directory, True)
+
+
+class _ArenaEntry(object):
+    """The location of one checkpoint in an :class:`ArenaCheckpointStorage`."""
+    __slots__ = ["key", "position", "tier", "nbytes", "cls", "arena", "offset", "dtype", "shape", "index"]
+
+    def __init__(self, key, position, nbytes, cls):
+        self.key = key
+        self.position = position
+        self.tier = DISK
+        self.nbytes = nbytes
+        self.cls = cls
+        self.arena = None
+        self.offset = None
+        self.dtype = None
+        self.shape = None
+        # The index of a float checkpoint in the float column.
+        self.index = None
+
+
+class ArenaCheckpointStorage(object):
+    """Memory-mapped on-disk storage for the checkpoints of a tape.
+
+    NumPy array checkpoints are appended to a binary arena file without
+    pickling, and are read back as read-only views of a memory map of the
+    file, so restoring a checkpoint does not copy it and only the pages which
+    are accessed are read from disk. Float checkpoints, such as recomputed
+    :class:`AdjFloat` values, are batched into a float64 column, which is
+    appended to the arena `column_size` values at a time. Other checkpoints,
+    and checkpoints which are the block variable output itself, are kept as
+    they are.
+
+    The arena is append-only, so the views of a checkpoint stay valid when it
+    is released. Once more than half of the arena, and at least
+    `compaction_threshold` bytes, belong to released checkpoints, the live
+    checkpoints are copied to a new arena file and the old file is deleted.
+
+    The storage is used with :meth:`Tape.set_checkpoint_storage`.
+
+    Args:
+        directory (str|None): The parent directory of the temporary directory
+            holding the arena. Defaults to the system temporary directory.
+        column_size (int): The number of float checkpoints appended to the
+            arena at a time. Default 4096.
+        compaction_threshold (int): The minimum number of released bytes
+            before the arena is compacted. Default 64 MiB.
+    """
+
+    def __init__(self, directory=None, column_size=4096, compaction_threshold=2 ** 26):
+        self.column_size = column_size
+        self.compaction_threshold = compaction_threshold
+        self._tmpdir = tempfile.mkdtemp(prefix="pyadjoint-", dir=directory)
+        self._arenas = [_Arena(self._tmpdir)]
+        self._finalizer = weakref.finalize(self, _close_arenas, self._arenas, self._tmpdir)
+        self._entries = {}
+        self._refs = {}
+        self._keys = count()
+        self._lock = threading.RLock()
+        self._live = 0
+        self._released = 0
+        # The float column: the arena and offset of each appended chunk, the
+        # number of live checkpoints in each chunk, and the values, entries and
+        # number of live checkpoints not appended yet.
+        self._chunks = []
+        self._chunk_counts = []
+        self._column = []
+        self._column_entries = []
+        self._column_live = 0
+
+    @property
+    def _arena(self):
+        return self._arenas[-1]
+
+    def store(self, block_variable, position=None, tag=None):
+        """Move the checkpoint of `block_variable` into the arena.
+
+        Args:
+            block_variable (BlockVariable): The block variable whose checkpoint to store.
+            position (int|None): The index on the tape of the block which computed the checkpoint.
+            tag (str|None): The tag of the block which computed the checkpoint. Unused.
+        """
+        import numpy
+        value = _detach(block_variable._checkpoint)
+        if value is None or isinstance(value, StoredCheckpoint) or value is block_variable.output:
+            return
+        if not isinstance(value, float) and not (isinstance(value, numpy.ndarray) and value.dtype != object):
+            return
+        with self._lock:
+            if self._released > max(self._live, self.compaction_threshold):
+                self._compact()
+            if isinstance(value, float):
+                entry = _ArenaEntry(next(self._keys), position, 8, type(value))
+                self._append_float(entry, float(value))
+            else:
+                array = numpy.ascontiguousarray(value)
+                entry = _ArenaEntry(next(self._keys), position, array.nbytes, type(value))
+                entry.dtype = array.dtype
+                entry.shape = array.shape
+                entry.arena = self._arena
+                entry.offset = self._arena.append(array)
+            self._live += entry.nbytes
+            self._entries[entry.key] = entry
+            handle = StoredCheckpoint(self, entry)
+            self._refs[entry.key] = weakref.ref(handle, self._callback(entry))
+        block_variable._checkpoint = handle
+
+    def _append_float(self, entry, value):
+        entry.index = len(self._chunks) * self.column_size + len(self._column)
+        entry.tier = RAM
+        self._column.append(value)
+        self._column_entries.append(entry)
+        self._column_live += 1
+        if len(self._column) == self.column_size:
+            import numpy
+            arena = self._arena
+            self._chunks.append((arena, arena.append(numpy.array(self._column, dtype=numpy.float64))))
+            self._chunk_counts.append(self._column_live)
+            for e in self._column_entries:
+                e.tier = DISK
+            self._column = []
+            self._column_entries = []
+            self._column_live = 0
+
+    def load(self, entry):
+        """Return the value of a stored checkpoint, as a read-only view of the arena for arrays."""
+        import numpy
+        with self._lock:
+            if entry.index is not None:
+                chunk, i = divmod(entry.index, self.column_size)
+                if chunk == len(self._chunks):
+                    return self._column[i]
+                arena, offset = self._chunks[chunk]
+                return float(arena.read(offset + 8 * i, 8).view(numpy.float64)[0])
+            data = entry.arena.read(entry.offset, entry.nbytes)
+        value = data.view(entry.dtype).reshape(entry.shape)
+        if entry.cls not in (numpy.ndarray, numpy.memmap):
+            value = value.view(entry.cls)
+        return value
+
+    def move_cursor(self, position, blocks):
+        """The arena is not evicted, so the position of the reverse sweep is not used."""
+
+    def nbytes(self, tier=None):
+        """Return the number of bytes of live checkpoints in a tier, or in all tiers if `tier` is None."""
+        with self._lock:
+            ram = sum(e.nbytes for e in self._column_entries if e.key in self._entries)
+            return {None: self._live, RAM: ram, DISK: self._live - ram}.get(tier, 0)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _callback(self, entry):
+        def release(ref):
+            with self._lock:
+                self._refs.pop(entry.key, None)
+                if self._entries.pop(entry.key, None) is not None:
+                    self._live -= entry.nbytes
+                    self._released += entry.nbytes
+                    chunk = None if entry.index is None else entry.index // self.column_size
+                    if chunk is not None and chunk < len(self._chunk_counts):
+                        self._chunk_counts[chunk] -= 1
+                    elif chunk is not None:
+                        # The entry is in the column not appended yet.
+                        self._column_live -= 1
+        return release
+
+    def _compact(self):
+        """Copy the live checkpoints to a new arena, and delete the old arenas."""
+        old = list(self._arenas)
+        arena = _Arena(self._tmpdir)
+        for entry in self._entries.values():
+            if entry.index is None:
+                entry.offset = arena.append(entry.arena.read(entry.offset, entry.nbytes))
+                entry.arena = arena
+        for chunk, (chunk_arena, offset) in enumerate(self._chunks):
+            if chunk_arena is not None and self._chunk_counts[chunk] > 0:
+                self._chunks[chunk] = (arena, arena.append(chunk_arena.read(offset, 8 * self.column_size)))
+            else:
+                self._chunks[chunk] = (None, None)
+        self._arenas[:] = [arena]
+        for a in old:
+            a.close()
+        self._released = 0
@@ -0,0 +1,339 @@
+from abc import ABC, abstractmethod
+from collections import Counter
+from math import comb
+
+
+class Forward(object):
+    """Recompute the steps in ``range(n0, n1)``.
+
+    The state at step `n0` must be available. On completion, the state at
+    step `n1` is held in memory.
+    """
+    __slots__ = ["n0", "n1"]
+
+    def __init__(self, n0, n1):
+        self.n0 = n0
+        self.n1 = n1
+
+    def __repr__(self):
+        return f"Forward({self.n0}, {self.n1})"
+
+
+class Snapshot(object):
+    """Keep the current state at step `n` until the matching :class:`Free`."""
+    __slots__ = ["n"]
+
+    def __init__(self, n):
+        self.n = n
+
+    def __repr__(self):
+        return f"Snapshot({self.n})"
+
+
+class Free(object):
+    """Release the snapshot stored at step `n`."""
+    __slots__ = ["n"]
+
+    def __init__(self, n):
+        self.n = n
+
+    def __repr__(self):
+        return f"Free({self.n})"
+
+
+class Reverse(object):
+    """Recompute step `n` from its (available) state and run its reverse sweep."""
+    __slots__ = ["n"]
+
+    def __init__(self, n):
+        self.n = n
+
+    def __repr__(self):
+        return f"Reverse({self.n})"
+
+
+class CheckpointSchedule(ABC):
+    """Abstract base class for checkpointing schedules.
+
+    A checkpointing schedule decides which forward states are kept in memory
+    and which are recomputed when the tape is swept in reverse. It is
+    described by a sequence of actions (:class:`Forward`, :class:`Snapshot`,
+    :class:`Free` and :class:`Reverse`) which must end with the reverse sweep
+    of every step, from the last to the first.
+
+    The actions preceding the first :class:`Reverse` are executed during the
+    forward evaluation of the tape (e.g. in :meth:`ReducedFunctional.__call__`),
+    the remaining actions are executed during the reverse sweep.
+    """
+
+    @abstractmethod
+    def actions(self, n_steps):
+        """Return an iterable of the actions needed to reverse `n_steps` steps.
+
+        Args:
+            n_steps (int): The number of steps on the tape.
+
+        Returns:
+            iterable: The schedule actions.
+        """
+        pass
+
+
+class Revolve(CheckpointSchedule):
+    """Binomial checkpointing schedule.
+
+    Reverses the tape while holding at most `snapshots` intermediate states in
+    memory, using the binomial checkpoint placement of Griewank and Walther
+    (Algorithm 799: Revolve) to minimise the number of recomputed steps.
+
+    Args:
+        snapshots (int): The number of intermediate states which may be held
+            in memory at any time.
+    """
+
+    def __init__(self, snapshots):
+        if snapshots < 0:
+            raise ValueError("The number of snapshots must be non-negative.")
+        self.snapshots = snapshots
+
+    def actions(self, n_steps):
+        if n_steps > 0:
+            yield from self._revolve(0, n_steps, self.snapshots)
+
+    def _revolve(self, start, end, snapshots):
+        steps = end - start
+        if steps == 1:
+            yield Reverse(start)
+        elif snapshots == 0:
+            for n in range(end - 1, start - 1, -1):
+                if n > start:
+                    yield Forward(start, n)
+                yield Reverse(n)
+        else:
+            # With the initial state and `snapshots` snapshots held, at most
+            # beta(snapshots + 1, r) = comb(snapshots + 1 + r, r) steps can be reversed
+            # recomputing each step at most r times. Find the smallest such r.
+            held = snapshots + 1
+            repetitions = 1
+            while comb(held + repetitions, held) < steps:
+                repetitions += 1
+            # The largest position of the next snapshot which minimises the total
+            # number of recomputed steps.
+            mid = start + min(comb(held + repetitions - 1, held),
+                              steps - comb(held + repetitions - 2, held - 1))
+            yield Forward(start, mid)
+            yield Snapshot(mid)
+            yield from self._revolve(mid, end, snapshots - 1)
+            yield Free(mid)
+            yield from self._revolve(start, mid, snapshots)
+
+
+class CheckpointManager(object):
+    """Executes a :class:`CheckpointSchedule` on a tape.
+
+    The manager groups the blocks of the tape into steps, which are the
+    timesteps recorded with :meth:`Tape.end_timestep` or, if there are none,
+    the individual blocks. It tracks which block variables are needed to
+    restart the computation from each step.
+    Checkpoints which are not required by the schedule are dropped after the
+    forward evaluation and recomputed when needed by the reverse sweep.
+
+    Block variables which are not computed by a block on the tape (such as
+    controls) and block variables which are not used by any block on the tape
+    (such as the functional) are always kept.
+
+    Args:
+        tape (Tape): The tape to manage.
+        schedule (CheckpointSchedule): The schedule to execute.
+    """
+
+    def __init__(self, tape, schedule):
+        self.tape = tape
+        self.schedule = schedule
+        # True if all checkpoints on the tape are currently held.
+        self._complete = True
+        self.invalidate()
+
+    def invalidate(self):
+        """Discard the analysis of the tape structure.
+
+        Called when blocks are added to or removed from the tape.
+        """
+        self._steps = None
+        self._forward_actions = None
+        self._reverse_actions = None
+        self._free_after = None
+        self._transient = None
+        self._pins = Counter()
+        self._snapshots = {}
+        self._live = set()
+        # True if the forward actions of the schedule have been executed.
+        self._forward_done = False
+        self._recomputed_step = None
+        self._position = None
+
+    def _analyse(self):
+        if self._steps is not None:
+            return
+        blocks = self.tape.get_blocks()
+        if self.tape.latest_timestep > 0:
+            self._steps = [(r.start, r.stop) for r in self.tape.get_timesteps()]
+        else:
+            self._steps = [(i, i + 1) for i in range(len(blocks))]
+
+        producer = {}
+        last_use = {}
+        for n, (start, stop) in enumerate(self._steps):
+            for block in blocks[start:stop]:
+                for dep in block.get_dependencies():
+                    last_use[dep] = n
+                for output in block.get_outputs():
+                    producer[output] = n
+
+        # Outputs which are not used later on the tape are never released.
+        self._free_after = [[] for _ in self._steps]
+        self._transient = set()
+        for bv, n in producer.items():
+            if bv in last_use and last_use[bv] >= n:
+                self._free_after[last_use[bv]].append(bv)
+                self._transient.add(bv)
+
+        actions = list(self.schedule.actions(len(self._steps)))
+        for i, action in enumerate(actions):
+            if isinstance(action, Reverse):
+                break
+        else:
+            i = len(actions)
+        self._forward_actions = actions[:i]
+        self._reverse_actions = actions[i:]
+
+    def _release(self, bv):
+        if self._pins[bv] == 0:
+            bv._checkpoint = None
+
+    def _recompute_step(self, n, release=True, tlm=None, markings=False):
+        blocks = self.tape.get_blocks()
+        start, stop = self._steps[n]
+        for i in range(start, stop):
+            block = blocks[i]
+            with self.tape._record(i, "recompute"):
+                block.recompute()
+            self.tape._store_outputs(i)
+            if tlm is not None:
+                with self.tape._record(i, tlm):
+                    getattr(block, tlm)(markings=markings)
+            for output in block.get_outputs():
+                if output in self._transient:
+                    self._live.add(output)
+        if release:
+            for bv in self._free_after[n]:
+                self._live.discard(bv)
+                self._release(bv)
+
+    def _execute(self, action, sweep=None, tlm=None, markings=False):
+        if isinstance(action, Forward):
+            if action.n0 in self._snapshots:
+                self._live = set(self._snapshots[action.n0])
+            elif action.n0 == 0:
+                self._live = set()
+            for n in range(action.n0, action.n1):
+                self._recompute_step(n, tlm=tlm, markings=markings)
+            self._position = action.n1
+        elif isinstance(action, Snapshot):
+            snapshot = set(self._live)
+            for bv in snapshot:
+                self._pins[bv] += 1
+            self._snapshots[action.n] = snapshot
+        elif isinstance(action, Free):
+            for bv in self._snapshots.pop(action.n):
+                self._pins[bv] -= 1
+                if bv not in self._live:
+                    self._release(bv)
+        elif isinstance(action, Reverse):
+            if self._recomputed_step != action.n:
+                self._recompute_step(action.n, release=False)
+            self._recomputed_step = None
+            start, stop = self._steps[action.n]
+            blocks = self.tape.get_blocks()
+            storage = self.tape._checkpoint_storage
+            for i in range(stop - 1, start - 1, -1):
+                if storage is not None:
+                    storage.move_cursor(i, blocks)
+                with self.tape._record(i, sweep):
+                    getattr(blocks[i], sweep)(markings=markings)
+            for bv in self._live:
+                self._release(bv)
+            self._live = set()
+            self._position = None
+        else:
+            raise ValueError(f"Unknown checkpointing action {action}.")
+
+    def _forward(self, description, tlm=None, markings=False):
+        self._analyse()
+        n_steps = len(self._steps)
+        if n_steps == 0:
+            return
+        # Drop anything still held from a previous, unfinished, evaluation.
+        self._pins.clear()
+        for snapshot in self._snapshots.values():
+            for bv in snapshot:
+                self._release(bv)
+        for bv in self._live:
+            self._release(bv)
+        self._snapshots = {}
+        self._live = set()
+        self._position = 0
+        for action in self.tape._bar(description).iter(self._forward_actions):
+            self._execute(action, tlm=tlm, markings=markings)
+        # The last step is always computed so that the functional is available.
+        if self._position != n_steps - 1:
+            self._execute(Forward(self._position, n_steps - 1), tlm=tlm, markings=markings)
+        self._recompute_step(n_steps - 1, release=False, tlm=tlm, markings=markings)
+        self._recomputed_step = n_steps - 1
+        self._complete = False
+        self._forward_done = True
+
+    def recompute(self):
+        """Recompute the tape, keeping only the checkpoints required by the schedule."""
+        self._forward("Evaluating functional")
+
+    def evaluate_tlm(self, markings=False, sweep="evaluate_tlm"):
+        """Evaluate the tangent linear model alongside the forward recomputation.
+
+        Args:
+            sweep (str): The name of the block method to call, ``"evaluate_tlm"``
+                or ``"evaluate_tlm_batch"``.
+        """
+        if self._complete:
+            blocks = self.tape.get_blocks()
+            for i in self.tape._profiled(sweep, self.tape._bar("Evaluating TLM").iter(range(len(blocks)))):
+                getattr(blocks[i], sweep)(markings=markings)
+        else:
+            self._forward("Evaluating TLM", tlm=sweep, markings=markings)
+
+    def _reverse(self, sweep, description, markings=False):
+        blocks = self.tape.get_blocks()
+        if self._complete:
+            for i in self.tape._profiled(sweep, self.tape._reverse_sweep(description)):
+                getattr(blocks[i], sweep)(markings=markings)
+            return
+        if not self._forward_done:
+            self._forward("Evaluating functional")
+        for action in self.tape._bar(description).iter(self._reverse_actions):
+            self._execute(action, sweep=sweep, markings=markings)
+        if self.tape._checkpoint_storage is not None:
+            self.tape._checkpoint_storage.move_cursor(None, blocks)
+        self._forward_done = False
+
+    def evaluate_adj(self, markings=False, sweep="evaluate_adj"):
+        """Run the adjoint sweep according to the schedule.
+
+        Args:
+            sweep (str): The name of the block method to call, ``"evaluate_adj"``
+                or ``"evaluate_adj_batch"``.
+        """
+        self._reverse(sweep, "Evaluating adjoint", markings=markings)
+
+    def evaluate_hessian(self, markings=False):
+        """Run the Hessian sweep according to the schedule."""
+        self._reverse("evaluate_hessian", "Evaluating Hessian", markings=markings)
@@ -1,3 +1,6 @@
+import numpy
+
+from .block import _stack_batch
 from .enlisting import Enlist
 from .tape import get_working_tape, stop_annotating
 
@@ -7,22 +10,30 @@ def compute_gradient(J, m, options=None, tape=None, adj_value=1.0):
     Compute the gradient of J with respect to the initialisation value of m,
     that is the value of m at its creation.
 
+    If J is a list of functionals, the gradients of all of them are computed
+    with a single batched adjoint sweep, see :meth:`Block.evaluate_adj_batch`.
+
     Args:
-        J (AdjFloat):  The objective functional.
+        J (AdjFloat or list):  The objective functional, or a list of functionals.
         m (list or instance of Control): The (list of) controls.
         options (dict): A dictionary of options. To find a list of available options
             have a look at the specific control type.
         tape: The tape to use. Default is the current tape.
+        adj_value: The adjoint value of J, or a list of adjoint values, one for each
+            functional, if J is a list. Default is 1.0 for all functionals.
 
     Returns:
         OverloadedType: The derivative with respect to the control. Should be an instance of the same type as
-            the control.
+            the control. If J is a list, a list with the derivative of each functional.
     """
     options = options or {}
     tape = tape or get_working_tape()
     tape.reset_variables()
-    J.block_variable.adj_value = adj_value
     m = Enlist(m)
+    J = Enlist(J)
+    if J.listed:
+        return _compute_gradient_batch(J, m, options, tape, adj_value)
+    J[0].block_variable.adj_value = adj_value
 
     with stop_annotating():
         with tape.marked_nodes(m):
@@ -32,6 +43,27 @@ def compute_gradient(J, m, options=None, tape=None, adj_value=1.0):
     return m.delist(grads)
 
 
+def _compute_gradient_batch(J, m, options, tape, adj_value):
+    """Compute the gradients of the functionals in `J` with one batched adjoint sweep."""
+    seeds = adj_value if isinstance(adj_value, (list, tuple)) else [adj_value] * len(J)
+    for i, Ji in enumerate(J):
+        Ji.block_variable.add_adj_output(_stack_batch([seeds[i] if j == i else None for j in range(len(J))]))
+
+    with stop_annotating():
+        with tape.marked_nodes(m):
+            tape.evaluate_adj_batch(markings=True)
+
+    grads = [[] for _ in J]
+    for control in m:
+        batch = control.adj_value
+        for i, grad in enumerate(grads):
+            if batch is None or batch[i] is None:
+                grad.append(control.get_derivative(options=options))
+            else:
+                grad.append(control.control._ad_convert_type(batch[i], options=options))
+    return [m.delist(grad) for grad in grads]
+
+
 def compute_hessian(J, m, m_dot, options=None, tape=None):
     """
     Compute the Hessian of J in a direction m_dot at the current value of m
@@ -71,6 +103,38 @@ def compute_hessian(J, m, m_dot, options=None, tape=None):
     return m.delist(r)
 
 
+def compute_tlm_batch(J, m, m_dots, tape=None):
+    """
+    Compute the derivatives of J in a batch of directions m_dot with one tangent linear sweep.
+
+    All the directions are propagated through the tape together, see
+    :meth:`Block.evaluate_tlm_batch`, so that the tape is traversed only once.
+
+    Args:
+        J (OverloadedType or list): The (list of) functional(s).
+        m (list or instance of Control): The (list of) controls.
+        m_dots (list): The directions. Each direction is a (list of) instance(s) of the control type.
+        tape: The tape to use. Default is the current tape.
+
+    Returns:
+        numpy.ndarray or list: The derivatives of (each) J in the directions, stacked along the first axis
+            for floats and arrays. None if J does not depend on the controls.
+    """
+    tape = tape or get_working_tape()
+    tape.reset_tlm_values()
+
+    m = Enlist(m)
+    m_dots = [Enlist(m_dot) for m_dot in m_dots]
+    for i, control in enumerate(m):
+        control.tlm_value = _stack_batch([m_dot[i] for m_dot in m_dots])
+
+    with stop_annotating():
+        tape.evaluate_tlm_batch()
+
+    J = Enlist(J)
+    return J.delist([Ji.block_variable.tlm_value for Ji in J])
+
+
 def solve_adjoint(J, tape=None, adj_value=1.0):
     """
     Solve the adjoint problem for a functional J.
@@ -91,3 +155,222 @@ def solve_adjoint(J, tape=None, adj_value=1.0):
 
     with stop_annotating():
         tape.evaluate_adj(markings=False)
+
+
+def compute_jacobian(J, m, tape=None, sparse=True):
+    """
+    Compute the Jacobian matrix of a list of functionals with respect to the controls.
+
+    The structural sparsity of the Jacobian is detected from the tape, entry
+    by entry of the flattened controls, see :meth:`Block.sparsity_pattern`.
+    Columns (or rows) which have no structurally nonzero entry in common are
+    grouped by graph coloring, and all groups are evaluated with one batched
+    tangent linear sweep over the columns, see :func:`compute_tlm_batch`, or
+    one batched adjoint sweep over the rows, whichever needs fewer groups.
+
+    Args:
+        J (list): The functionals, instances of AdjFloat.
+        m (list or instance of Control): The (list of) controls.
+        tape: The tape to use. Default is the current tape.
+        sparse (bool): If True, return a scipy.sparse.csr_matrix, otherwise a dense numpy.ndarray.
+
+    Returns:
+        scipy.sparse.csr_matrix or numpy.ndarray: The Jacobian, with one row for each functional and one column
+            for each component of the controls.
+    """
+    tape = tape or get_working_tape()
+    J = Enlist(J)
+    m = Enlist(m)
+    offsets = _control_offsets(m)
+    n = int(offsets[-1])
+    patterns, _ = _sparsity_patterns(tape, [Ji.block_variable for Ji in J], m, offsets)
+    rows = [frozenset().union(*_entries(patterns.get(Ji.block_variable, frozenset()))) for Ji in J]
+    columns = [set() for _ in range(n)]
+    for i, row in enumerate(rows):
+        for column in row:
+            columns[column].add(i)
+
+    column_colors, n_column_colors = _color(rows, n)
+    row_colors, n_row_colors = _color(columns, len(J))
+    nonzeros = [(i, column) for i, row in enumerate(rows) for column in sorted(row)]
+    if n_column_colors <= n_row_colors:
+        colors = numpy.array([-1 if color is None else color for color in column_colors], dtype=int)
+        directions = [_assign(m, offsets, colors == k) for k in range(n_column_colors)]
+        tlm = Enlist(compute_tlm_batch(J, m, directions, tape=tape)) if directions else []
+        values = [numpy.asarray(tlm[i])[column_colors[column]] for i, column in nonzeros]
+    else:
+        tape.reset_variables()
+        for i, Ji in enumerate(J):
+            if row_colors[i] is not None:
+                seed = numpy.zeros(n_row_colors)
+                seed[row_colors[i]] = 1.0
+                Ji.block_variable.add_adj_output(seed)
+        with stop_annotating():
+            with tape.marked_nodes(m):
+                tape.evaluate_adj_batch(markings=True)
+        gradients = {}
+        values = []
+        for i, column in nonzeros:
+            c = int(numpy.searchsorted(offsets, column, side="right")) - 1
+            key = (row_colors[i], c)
+            if key not in gradients:
+                gradients[key] = numpy.asarray(m[c]._ad_to_list(m[c].adj_value[row_colors[i]]))
+            values.append(gradients[key][column - offsets[c]])
+    return _assemble(nonzeros, values, (len(J), n), sparse)
+
+
+def compute_hessian_matrix(J, m, options=None, tape=None, sparse=True):
+    """
+    Compute the Hessian matrix of J with respect to the controls.
+
+    The structural sparsity of the Hessian is detected from the tape, entry by
+    entry of the flattened controls: two entries interact if they both
+    influence an entry of the outputs of a block which is not linear, see
+    :attr:`Block.linear` and :meth:`Block.sparsity_pattern`. The columns which
+    have no structurally nonzero entry in common are grouped by graph
+    coloring, and one Hessian action is computed for each group, see
+    :func:`compute_hessian`.
+
+    Args:
+        J (AdjFloat): The objective functional.
+        m (list or instance of Control): The (list of) controls.
+        options (dict): A dictionary of options. To find a list of available options
+            have a look at the specific control type.
+        tape: The tape to use. Default is the current tape.
+        sparse (bool): If True, return a scipy.sparse.csr_matrix, otherwise a dense numpy.ndarray.
+
+    Returns:
+        scipy.sparse.csr_matrix or numpy.ndarray: The Hessian, with one row and one column for each component
+            of the controls.
+    """
+    tape = tape or get_working_tape()
+    m = Enlist(m)
+    offsets = _control_offsets(m)
+    n = int(offsets[-1])
+    pairs = _hessian_pattern(tape, J, m, offsets)
+    colors, n_colors = _color(pairs, n)
+
+    active = [c for c in range(len(m)) if any(pairs[offsets[c]:offsets[c + 1]])]
+    nonzeros = [(row, column) for column, rows in enumerate(pairs) for row in sorted(rows)]
+    values = []
+    if active:
+        controls = [m[c] for c in active]
+        compute_gradient(J, controls, options=options, tape=tape)
+        colors = numpy.array([-1 if color is None else color for color in colors], dtype=int)
+        actions = []
+        for k in range(n_colors):
+            direction = _assign(m, offsets, colors == k)
+            action = compute_hessian(J, controls, [direction[c] for c in active], options=options, tape=tape)
+            flat = numpy.zeros(n)
+            for c, value in zip(active, Enlist(action)):
+                flat[offsets[c]:offsets[c + 1]] = m[c]._ad_to_list(value)
+            actions.append(flat)
+        values = [actions[colors[column]][row] for row, column in nonzeros]
+    return _assemble(nonzeros, values, (n, n), sparse)
+
+
+def _control_offsets(m):
+    """Return the offsets of the components of each control in the flattened controls."""
+    return numpy.concatenate([[0], numpy.cumsum([control._ad_dim() for control in m], dtype=int)])
+
+
+def _assign(m, offsets, values):
+    """Return the values of the controls given by the flattened array `values`."""
+    values = numpy.asarray(values, dtype=float)
+    return [control.assign_numpy(control.copy_data(), values, offset)[0]
+            for control, offset in zip(m, offsets[:-1].tolist())]
+
+
+def _color(pattern, n):
+    """Color the columns of a sparse matrix for compressed evaluation.
+
+    The columns are colored greedily, such that no two columns of the same
+    color have a structurally nonzero entry in the same row.
+
+    Args:
+        pattern (list[set[int]]): The columns with structurally nonzero entries in each row.
+        n (int): The number of columns.
+
+    Returns:
+        tuple(list[int], int): The color of each column, None if the column has no structurally
+            nonzero entries, and the number of colors.
+    """
+    conflicts = [set() for _ in range(n)]
+    for row in pattern:
+        for column in row:
+            conflicts[column].update(row)
+    colors = [None] * n
+    n_colors = 0
+    for column in range(n):
+        if not conflicts[column]:
+            continue
+        used = {colors[other] for other in conflicts[column]}
+        color = 0
+        while color in used:
+            color += 1
+        colors[column] = color
+        n_colors = max(n_colors, color + 1)
+    return colors, n_colors
+
+
+def _entries(pattern):
+    """Return the sets of control entries of each entry of a sparsity pattern, see :meth:`Block.sparsity_pattern`."""
+    return [pattern] if isinstance(pattern, frozenset) else pattern
+
+
+def _sparsity_patterns(tape, outputs, m, offsets):
+    """Return the sparsity patterns of the block variables computing `outputs` from the controls.
+
+    Returns:
+        tuple(dict, list): The pattern of each block variable depending on the controls, see
+            :meth:`Block.sparsity_pattern`, and the blocks computing `outputs` with the patterns of their outputs.
+    """
+    controls = {control.block_variable: c for c, control in enumerate(m)}
+    blocks = []
+    needed = set(outputs)
+    for block in reversed(tape.get_blocks()):
+        if any(output in needed for output in block.get_outputs()):
+            blocks.append(block)
+            needed.update(block.get_dependencies())
+
+    patterns = {bv: [frozenset([column]) for column in range(offsets[c], offsets[c + 1])]
+                for bv, c in controls.items()}
+    computed = []
+    for block in reversed(blocks):
+        dependencies = [patterns.get(dep, frozenset()) for dep in block.get_dependencies()]
+        if any(dependencies):
+            output_patterns = block.sparsity_pattern(dependencies)
+        else:
+            output_patterns = [frozenset()] * len(block.get_outputs())
+        computed.append((block, output_patterns))
+        for output, pattern in zip(block.get_outputs(), output_patterns):
+            if output not in controls:
+                patterns[output] = pattern
+    return patterns, computed
+
+
+def _hessian_pattern(tape, J, m, offsets):
+    """Return the flattened control entries which may have a nonzero second derivative of J with each entry."""
+    _, blocks = _sparsity_patterns(tape, [J.block_variable], m, offsets)
+    pairs = [set() for _ in range(offsets[-1])]
+    for block, output_patterns in blocks:
+        if not block.linear:
+            for pattern in output_patterns:
+                for entries in set(_entries(pattern)):
+                    for entry in entries:
+                        pairs[entry].update(entries)
+    return pairs
+
+
+def _assemble(nonzeros, values, shape, sparse):
+    """Assemble a matrix from its nonzero entries, given as (row, column) tuples and values."""
+    rows = numpy.array([row for row, _ in nonzeros], dtype=int)
+    columns = numpy.array([column for _, column in nonzeros], dtype=int)
+    values = numpy.array(values, dtype=float)
+    if not sparse:
+        matrix = numpy.zeros(shape)
+        matrix[rows, columns] = values
+        return matrix
+
+    from scipy.sparse import coo_matrix
+    return coo_matrix((values, (rows, columns)), shape=shape).tocsr()
@@ -0,0 +1,325 @@
+import os
+import traceback
+import weakref
+
+import numpy
+
+from .enlisting import Enlist
+
+
+class _Member(object):
+    """The tape and numpy reduced functional of one ensemble member in a worker process."""
+    __slots__ = ["tape", "rf_np", "weight"]
+
+    def __init__(self, model, member, weight):
+        from .tape import Tape, set_working_tape, continue_annotation, pause_annotation
+        from .reduced_functional import ReducedFunctional
+        from .reduced_functional_numpy import ReducedFunctionalNumPy
+
+        self.tape = Tape()
+        set_working_tape(self.tape)
+        continue_annotation()
+        try:
+            J, controls = model(member)
+        finally:
+            pause_annotation()
+        self.rf_np = ReducedFunctionalNumPy(ReducedFunctional(J, controls, tape=self.tape))
+        self.weight = weight
+
+    def activate(self):
+        """Make the tape of the member the working tape, and return its numpy reduced functional."""
+        from .tape import set_working_tape
+        set_working_tape(self.tape)
+        return self.rf_np
+
+    def layout(self):
+        """Return the current control values and the size of each control."""
+        rf_np = self.activate()
+        return rf_np.get_controls(), [rf_np.get_global(control).size for control in rf_np.controls]
+
+
+def _worker(connection, model, members, weights, rank):
+    """Evaluate the ensemble members assigned to one worker process on request of the parent."""
+    from multiprocessing.shared_memory import SharedMemory
+    try:
+        members = [_Member(model, member, weight) for member, weight in zip(members, weights)]
+        connection.send((True, [member.layout() for member in members]))
+    except Exception:
+        connection.send((False, traceback.format_exc()))
+        return
+
+    layout = connection.recv()
+    if layout is None:
+        # Another worker failed to record its members.
+        return
+    names, size, processes = layout
+    buffers = [SharedMemory(name=name) for name in names]
+    try:
+        _serve(connection, members, buffers, size, processes, rank)
+    finally:
+        for shm in buffers:
+            shm.close()
+
+
+def _serve(connection, members, buffers, size, processes, rank):
+    """Answer the commands of the parent until it sends None."""
+    m = numpy.ndarray((size,), dtype=numpy.float64, buffer=buffers[0].buf)
+    m_dot = numpy.ndarray((size,), dtype=numpy.float64, buffer=buffers[1].buf)
+    out = numpy.ndarray((processes, size), dtype=numpy.float64, buffer=buffers[2].buf)[rank]
+
+    def call():
+        return sum(member.weight * member.activate()(m) for member in members)
+
+    def derivative():
+        out[:] = sum(member.weight * member.activate().derivative() for member in members)
+
+    def value_and_gradient():
+        value = 0.
+        out[:] = 0.
+        for member in members:
+            value_i, gradient = member.activate().value_and_gradient(m)
+            value += member.weight * value_i
+            out[:] += member.weight * gradient
+        return value
+
+    def hessian():
+        out[:] = sum(member.weight * member.activate().hessian(None, m_dot) for member in members)
+
+    commands = {"call": call, "derivative": derivative,
+                "value_and_gradient": value_and_gradient, "hessian": hessian}
+    while True:
+        command = connection.recv()
+        if command is None:
+            break
+        try:
+            connection.send((True, commands[command]()))
+        except Exception:
+            connection.send((False, traceback.format_exc()))
+
+
+def _shutdown(processes, connections, buffers):
+    """Stop the worker processes and release the shared memory."""
+    for connection in connections:
+        try:
+            connection.send(None)
+        except (OSError, ValueError):
+            pass
+    for process in processes:
+        process.join(timeout=5)
+        if process.is_alive():
+            process.terminate()
+    for connection in connections:
+        connection.close()
+    for shm in buffers:
+        shm.close()
+        shm.unlink()
+
+
+class EnsembleControl(object):
+    """The values of one control of an :class:`EnsembleReducedFunctional`, in the parent process.
+
+    The controls of the ensemble members live in the worker processes. This
+    class gives the optimization drivers access to the current values of a
+    control as a numpy array.
+    """
+
+    def __init__(self, ensemble, offset, size):
+        self.ensemble = ensemble
+        self.offset = offset
+        self.size = size
+
+    def tape_value(self):
+        return self.ensemble.get_controls()[self.offset:self.offset + self.size]
+
+
+class EnsembleReducedFunctional(object):
+    """The weighted sum of the reduced functionals of the members of an ensemble.
+
+    Every ensemble member is recorded on its own tape in a worker process.
+    Evaluations of the functional, its derivative and Hessian action are
+    fanned out to the workers, which each reduce over their own members, and
+    the partial sums are reduced in the parent process. The control values,
+    directions and partial derivatives are exchanged through shared memory, so
+    only the commands and functional values are sent through pipes.
+
+    The class has the interface of
+    :class:`pyadjoint.reduced_functional_numpy.ReducedFunctionalNumPy`, and can
+    be passed to :func:`pyadjoint.minimize`. All members must have controls of
+    the same types and sizes, and share the control values.
+
+    Args:
+        model (function): Called as ``model(member)`` in a worker process with
+            annotation enabled, to record one member on the working tape. Must
+            return the functional as an AdjFloat and its Control or list of
+            Controls. With the "spawn" or "forkserver" start methods `model`
+            and `members` must be picklable, i.e. `model` must be a module
+            level function.
+        members (list): The argument to `model` for each member.
+        weights (list): The weight of each member in the sum. Defaults to 1.
+        processes (int): The number of worker processes. Defaults to the
+            number of CPUs, and is at most the number of members.
+        context (multiprocessing.context.BaseContext): The multiprocessing
+            context used to start the workers. Defaults to the default context.
+
+    The worker processes are stopped by :meth:`close`, by leaving a ``with``
+    block, or when the object is garbage collected.
+    """
+
+    def __init__(self, model, members, weights=None, processes=None, context=None):
+        import multiprocessing
+        from multiprocessing import resource_tracker
+        from multiprocessing.shared_memory import SharedMemory
+
+        members = list(members)
+        if not members:
+            raise ValueError("The ensemble must have at least one member.")
+        weights = [1.] * len(members) if weights is None else list(weights)
+        if len(weights) != len(members):
+            raise ValueError("Got %d weights for %d members." % (len(weights), len(members)))
+        processes = min(processes or os.cpu_count() or 1, len(members))
+        context = context or multiprocessing.get_context()
+        # Start the resource tracker before the workers, so that they share it
+        # with the parent and the shared memory attached to in the workers is
+        # not reported as leaked, or unlinked, when a worker exits.
+        resource_tracker.ensure_running()
+
+        self.scale = 1.0
+        self._processes = []
+        self._connections = []
+        self._buffers = []
+        self._finalizer = weakref.finalize(self, _shutdown, self._processes, self._connections, self._buffers)
+        for rank in range(processes):
+            parent, child = context.Pipe()
+            process = context.Process(target=_worker, name="pyadjoint-ensemble-%d" % rank, daemon=True,
+                                      args=(child, model, members[rank::processes], weights[rank::processes], rank))
+            process.start()
+            child.close()
+            self._processes.append(process)
+            self._connections.append(parent)
+
+        try:
+            layouts = [layout for replies in self._gather() for layout in replies]
+        except RuntimeError:
+            self.close()
+            raise
+        self._initial, sizes = layouts[0]
+        if any(layout[1] != sizes for layout in layouts):
+            self.close()
+            raise ValueError("The controls of the ensemble members have different sizes.")
+        size = self._initial.size
+        if not size:
+            self.close()
+            raise ValueError("The ensemble members have no controls.")
+
+        # The shared control values, direction, and partial sums of the workers.
+        self._shapes = [(size,), (size,), (processes, size)]
+        for shape in self._shapes:
+            nbytes = int(numpy.prod(shape)) * numpy.dtype(numpy.float64).itemsize
+            self._buffers.append(SharedMemory(create=True, size=nbytes))
+        for connection in self._connections:
+            connection.send(([shm.name for shm in self._buffers], size, processes))
+        # The control values at which the members were last evaluated.
+        self._point = None
+        self.controls = []
+        offset = 0
+        for size in sizes:
+            self.controls.append(EnsembleControl(self, offset, size))
+            offset += size
+
+    def close(self):
+        """Stop the worker processes and release the shared memory."""
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _gather(self):
+        """Return the replies of all workers, raising the first error."""
+        replies = [connection.recv() for connection in self._connections]
+        for ok, reply in replies:
+            if not ok:
+                raise RuntimeError("An ensemble worker failed:\n%s" % reply)
+        return [reply for _, reply in replies]
+
+    def _broadcast(self, command):
+        """Run `command` on all workers, and return their replies."""
+        if not self._finalizer.alive:
+            raise RuntimeError("The ensemble has been closed.")
+        for connection in self._connections:
+            connection.send(command)
+        return self._gather()
+
+    def _shared(self, i):
+        """Return a view of shared array `i`.
+
+        No views are kept, since the shared memory can not be released while they exist.
+        """
+        return numpy.ndarray(self._shapes[i], dtype=numpy.float64, buffer=self._buffers[i].buf)
+
+    def _evaluate_at(self, m_array):
+        """Evaluate the members at `m_array`, unless that is where they were last evaluated."""
+        if m_array is None:
+            if self._point is not None:
+                return
+            m_array = self._initial
+        if self._point is None or not numpy.array_equal(m_array, self._point):
+            self.__call__(m_array)
+
+    def __call__(self, m_array):
+        """Evaluate the functional at the controls given as an array of scalars."""
+        self._point = numpy.array(m_array, dtype=numpy.float64)
+        self._shared(0)[:] = self._point
+        return self.scale * sum(self._broadcast("call"))
+
+    def derivative(self, m_array=None, forget=True, project=False):
+        """Evaluate the derivative of the functional at the controls given as an array of scalars.
+
+        If no control values are given, the derivative is evaluated at the
+        latest evaluation of the functional.
+        """
+        self._evaluate_at(m_array)
+        self._broadcast("derivative")
+        return self.scale * self._shared(2).sum(axis=0)
+
+    def value_and_gradient(self, m_array, forget=True, project=False):
+        """Evaluate the functional and its derivative at the controls given as an array of scalars.
+
+        Returns:
+            tuple: The value of the functional and its derivative as an array of scalars.
+        """
+        self._point = numpy.array(m_array, dtype=numpy.float64)
+        self._shared(0)[:] = self._point
+        value = sum(self._broadcast("value_and_gradient"))
+        return self.scale * value, self.scale * self._shared(2).sum(axis=0)
+
+    def hessian(self, m_array, m_dot_array):
+        """Evaluate the Hessian action of the functional in the direction `m_dot_array`.
+
+        If `m_array` is None, the Hessian action at the latest evaluation of the functional is returned.
+        """
+        self._evaluate_at(m_array)
+        self._shared(1)[:] = m_dot_array
+        self._broadcast("hessian")
+        return self.scale * self._shared(2).sum(axis=0)
+
+    def get_global(self, m):
+        views = []
+        for v in Enlist(m):
+            if isinstance(v, EnsembleControl):
+                v = v.tape_value()
+            views.append(numpy.ravel(numpy.asarray(v, dtype=numpy.float64)))
+        return numpy.concatenate(views)
+
+    def obj_to_array(self, obj):
+        return self.get_global(obj)
+
+    def get_controls(self):
+        return (self._initial if self._point is None else self._point).copy()
+
+    def set_controls(self, array):
+        """Evaluate the members at `array`, and return the values of each control."""
+        self._evaluate_at(numpy.asarray(array, dtype=numpy.float64))
+        return [self._point[c.offset:c.offset + c.size].copy() for c in self.controls]
@@ -0,0 +1,265 @@
+from operator import attrgetter
+
+import numpy
+
+from .block import Block
+
+_saved_output = attrgetter("saved_output")
+_adj_value = attrgetter("adj_value")
+_tlm_value = attrgetter("tlm_value")
+_hessian_value = attrgetter("hessian_value")
+
+
+class _Marking(object):
+    """The relevant dependencies and outputs of each block for one set of marked nodes."""
+    __slots__ = ["dependencies", "outputs"]
+
+    def __init__(self, dependencies, outputs):
+        self.dependencies = dependencies
+        self.outputs = outputs
+
+
+class FrozenTape(object):
+    """An array-backed representation of the blocks on a tape whose structure is fixed.
+
+    The dependencies and outputs of the blocks are compiled into CSR-style
+    integer arrays indexing the distinct block variables on the tape, and the
+    argument lists passed to the block methods are allocated once and refilled
+    in place by the sweeps, so that the sweeps do not construct lists. The
+    argument lists are only valid during the call they are passed to. The relevant dependencies and outputs of
+    each block are precomputed for every set of marked nodes the tape is
+    swept with.
+
+    Blocks which override :meth:`Block.evaluate_adj`, :meth:`Block.evaluate_tlm`,
+    :meth:`Block.evaluate_hessian` or :meth:`Block.recompute` are evaluated
+    through their own method.
+
+    Use :meth:`Tape.freeze` to create the frozen representation of a tape.
+
+    Args:
+        blocks (list[Block]): The blocks on the tape.
+
+    Attributes:
+        variables (list[BlockVariable]): The distinct block variables on the tape.
+        dep_ptr (numpy.ndarray): The dependencies of block `i` are the variables
+            with indices ``dep_idx[dep_ptr[i]:dep_ptr[i + 1]]``.
+        dep_idx (numpy.ndarray): The variable indices of the dependencies.
+        out_ptr (numpy.ndarray): The outputs of block `i` are the variables
+            with indices ``out_idx[out_ptr[i]:out_ptr[i + 1]]``.
+        out_idx (numpy.ndarray): The variable indices of the outputs.
+    """
+
+    # True if the blocks can be evaluated one at a time, e.g. by a parallel sweep.
+    per_block = True
+
+    def __init__(self, blocks):
+        self._index_variables(blocks)
+
+        # The argument lists of each block, refilled in place by the sweeps.
+        self._inputs = [[None] * len(deps) for deps in self._deps]
+        self._dep_values = [[None] * len(deps) for deps in self._deps]
+        self._output_values = [[None] * len(outputs) for outputs in self._outputs]
+        self._output_adj_values = [[None] * len(outputs) for outputs in self._outputs]
+
+        self._unmarked = _Marking([list(enumerate(deps)) for deps in self._deps],
+                                  [list(enumerate(outputs)) for outputs in self._outputs])
+        self._markings = {}
+        self._marking = None
+
+        def uses_default(name):
+            return [getattr(type(block), name) is getattr(Block, name) for block in self.blocks]
+        self._default_adj = uses_default("evaluate_adj")
+        self._default_tlm = uses_default("evaluate_tlm")
+        self._default_hessian = uses_default("evaluate_hessian")
+        self._default_recompute = uses_default("recompute")
+
+    def _index_variables(self, blocks):
+        """Build the table of block variables and the CSR arrays of the blocks."""
+        self.blocks = list(blocks)
+        self.variables = []
+        position = {}
+
+        def variable_indices(bvs):
+            indices = []
+            for bv in bvs:
+                if bv not in position:
+                    position[bv] = len(self.variables)
+                    self.variables.append(bv)
+                indices.append(position[bv])
+            return indices
+
+        self._deps = []
+        self._outputs = []
+        dep_idx = []
+        out_idx = []
+        dep_ptr = [0]
+        out_ptr = [0]
+        for block in self.blocks:
+            deps = tuple(block.get_dependencies())
+            outputs = tuple(block.get_outputs())
+            self._deps.append(deps)
+            self._outputs.append(outputs)
+            dep_idx.extend(variable_indices(deps))
+            out_idx.extend(variable_indices(outputs))
+            dep_ptr.append(len(dep_idx))
+            out_ptr.append(len(out_idx))
+        self._position = position
+        self.dep_ptr = numpy.array(dep_ptr, dtype=numpy.intp)
+        self.dep_idx = numpy.array(dep_idx, dtype=numpy.intp)
+        self.out_ptr = numpy.array(out_ptr, dtype=numpy.intp)
+        self.out_idx = numpy.array(out_idx, dtype=numpy.intp)
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def mark(self, nodes):
+        """Select the precomputed relevant dependencies for the marked `nodes`.
+
+        Args:
+            nodes (frozenset[BlockVariable]|None): The block variables whose
+                `marked_in_path` flag is set, or None if the marked nodes are unknown.
+
+        Returns:
+            frozenset[BlockVariable]|None: The previously marked nodes.
+        """
+        previous = None if self._marking is None else self._marking[0]
+        if nodes is None:
+            self._marking = None
+            return previous
+        try:
+            marking = self._markings[nodes]
+        except KeyError:
+            mask = numpy.zeros(len(self.variables), dtype=bool)
+            mask[[self._position[bv] for bv in nodes if bv in self._position]] = True
+            marking = _Marking(
+                self._select(self._unmarked.dependencies, self.dep_ptr, mask[self.dep_idx]),
+                self._select(self._unmarked.outputs, self.out_ptr, mask[self.out_idx])
+            )
+            self._markings[nodes] = marking
+        self._marking = (nodes, marking)
+        return previous
+
+    @staticmethod
+    def _select(enumerated, ptr, mask):
+        """Return the entries of `enumerated` for which `mask` is set, per block."""
+        sizes = numpy.diff(ptr)
+        counts = numpy.bincount(numpy.repeat(numpy.arange(len(sizes)), sizes),
+                                weights=mask, minlength=len(sizes))
+        empty = []
+        selected = []
+        mask = mask.tolist()
+        for pairs, start, count, size in zip(enumerated, ptr.tolist(), counts.tolist(), sizes.tolist()):
+            if count == size:
+                selected.append(pairs)
+            elif count == 0:
+                selected.append(empty)
+            else:
+                selected.append([pair for k, pair in enumerate(pairs) if mask[start + k]])
+        return selected
+
+    def _relevant(self, markings):
+        if not markings:
+            return self._unmarked
+        if self._marking is not None:
+            return self._marking[1]
+        # The marked nodes are unknown, so the flags are inspected.
+        return _Marking(
+            [[(k, bv) for k, bv in enumerate(deps) if bv.marked_in_path] for deps in self._deps],
+            [[(k, bv) for k, bv in enumerate(outputs) if bv.marked_in_path] for outputs in self._outputs]
+        )
+
+    def evaluate_adj(self, indices, markings=False):
+        """Run the adjoint sweep of the blocks with the given `indices`, in the given order."""
+        relevant = self._relevant(markings).dependencies
+        for i in indices:
+            block = self.blocks[i]
+            if not self._default_adj[i]:
+                block.evaluate_adj(markings=markings)
+                continue
+            relevant_dependencies = relevant[i]
+            if not relevant_dependencies:
+                continue
+            adj_inputs = self._output_values[i]
+            adj_inputs[:] = map(_adj_value, self._outputs[i])
+            if adj_inputs.count(None) == len(adj_inputs):
+                continue
+            inputs = self._inputs[i]
+            inputs[:] = map(_saved_output, self._deps[i])
+            prepared = block.prepare_evaluate_adj(inputs, adj_inputs, relevant_dependencies)
+            for idx, dep in relevant_dependencies:
+                adj_output = block.evaluate_adj_component(inputs, adj_inputs, dep, idx, prepared)
+                if adj_output is not None:
+                    dep.add_adj_output(adj_output)
+
+    def evaluate_tlm(self, indices, markings=False):
+        """Run the tangent linear sweep of the blocks with the given `indices`, in the given order."""
+        relevant = self._relevant(markings).outputs
+        for i in indices:
+            block = self.blocks[i]
+            if not self._default_tlm[i]:
+                block.evaluate_tlm(markings=markings)
+                continue
+            relevant_outputs = relevant[i]
+            if not relevant_outputs:
+                continue
+            deps = self._deps[i]
+            tlm_inputs = self._dep_values[i]
+            tlm_inputs[:] = map(_tlm_value, deps)
+            if tlm_inputs.count(None) == len(tlm_inputs):
+                continue
+            inputs = self._inputs[i]
+            inputs[:] = map(_saved_output, deps)
+            prepared = block.prepare_evaluate_tlm(inputs, tlm_inputs, relevant_outputs)
+            for idx, out in relevant_outputs:
+                tlm_output = block.evaluate_tlm_component(inputs, tlm_inputs, out, idx, prepared)
+                if tlm_output is not None:
+                    out.add_tlm_output(tlm_output)
+
+    def evaluate_hessian(self, indices, markings=False):
+        """Run the Hessian sweep of the blocks with the given `indices`, in the given order."""
+        relevant = self._relevant(markings).dependencies
+        for i in indices:
+            block = self.blocks[i]
+            if not self._default_hessian[i]:
+                block.evaluate_hessian(markings=markings)
+                continue
+            relevant_dependencies = relevant[i]
+            if not relevant_dependencies:
+                continue
+            outputs = self._outputs[i]
+            hessian_inputs = self._output_values[i]
+            hessian_inputs[:] = map(_hessian_value, outputs)
+            if hessian_inputs.count(None) == len(hessian_inputs):
+                continue
+            adj_inputs = self._output_adj_values[i]
+            adj_inputs[:] = map(_adj_value, outputs)
+            inputs = self._inputs[i]
+            inputs[:] = map(_saved_output, self._deps[i])
+            prepared = block.prepare_evaluate_hessian(inputs, hessian_inputs, adj_inputs, relevant_dependencies)
+            for idx, dep in relevant_dependencies:
+                hessian_output = block.evaluate_hessian_component(inputs, hessian_inputs, adj_inputs, dep, idx,
+                                                                  relevant_dependencies, prepared)
+                if hessian_output is not None:
+                    dep.add_hessian_output(hessian_output)
+
+    def recompute(self, indices):
+        """Recompute the blocks with the given `indices`, in the given order."""
+        relevant = self._unmarked.outputs
+        for i in indices:
+            block = self.blocks[i]
+            if not self._default_recompute[i]:
+                block.recompute()
+                continue
+            outputs = self._outputs[i]
+            if any(out.is_control for out in outputs):
+                continue
+            relevant_outputs = relevant[i]
+            if not relevant_outputs:
+                continue
+            inputs = self._inputs[i]
+            inputs[:] = map(_saved_output, self._deps[i])
+            prepared = block.prepare_recompute_component(inputs, relevant_outputs)
+            for idx, out in relevant_outputs:
+                output = block.recompute_component(inputs, out, idx, prepared)
+                if output is not None:
+                    out.checkpoint = output
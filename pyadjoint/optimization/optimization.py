@@ -36,6 +36,12 @@ def serialise_bounds(rf_np, bounds):
 def minimize_scipy_generic(rf_np, method, bounds=None, **kwargs):
     """Interface to the generic minimize method in scipy
 
+    If the keyword argument `value_and_gradient` is True, scipy is given a single
+    function returning both the functional value and its derivative (``jac=True``),
+    see :meth:`ReducedFunctionalNumPy.value_and_gradient`. Each point is then
+    evaluated with one recomputation of the tape and one adjoint sweep, also
+    when scipy only needs the value.
+
     """
     try:
         from scipy.optimize import minimize as scipy_minimize
@@ -57,6 +63,7 @@ def minimize_scipy_generic(rf_np, method, bounds=None, **kwargs):
         forget = False
 
     project = kwargs.pop("project", False)
+    value_and_gradient = kwargs.pop("value_and_gradient", False)
 
     m = [p.tape_value() for p in rf_np.controls]
     m_global = rf_np.obj_to_array(m)
@@ -84,6 +91,9 @@ def minimize_scipy_generic(rf_np, method, bounds=None, **kwargs):
 
     # For gradient-based methods add the derivative function to the argument list
     if method not in ["COBYLA", "Nelder-Mead", "Anneal", "Powell"]:
+        if value_and_gradient:
+            J = lambda m: rf_np.value_and_gradient(m, forget=forget, project=project)
+            dJ = True
         kwargs["jac"] = dJ
 
     # For Hessian-based methods add the Hessian action function to the argument list
@@ -285,6 +285,48 @@ class OverloadedType(object):
         """
         raise NotImplementedError
 
+    @staticmethod
+    def _ad_flat_view(m):
+        """This method can be overridden.
+
+        The method should return the data of `m` as a contiguous one-dimensional
+        numpy array of float64, sharing the memory of `m` where possible. As for
+        :meth:`_ad_to_list`, `m` is not necessarily an OverloadedType. The numpy
+        reduced functional falls back to :meth:`_ad_to_list` if this is not implemented.
+
+        Args:
+            m (obj): The object to be viewed as an array.
+
+        Returns:
+            numpy.ndarray: A flat float64 array with the data of `m`.
+
+        """
+        raise NotImplementedError
+
+    def _ad_from_flat_view(self, src, offset):
+        """This method can be overridden.
+
+        The method should return an object of the same type as `self` holding the
+        values of the contiguous float64 array `src` starting at `offset`,
+        sharing the memory of `src` where possible. Unlike :meth:`_ad_assign_numpy`
+        `self` is not modified, and is only used for its type and dimensions.
+        The numpy reduced functional falls back to :meth:`_ad_assign_numpy` on a copy
+        of the control if this is not implemented.
+
+        Args:
+            src (numpy.ndarray): The flat array to read from.
+            offset (int): Start reading `src` from `offset`.
+
+        Returns:
+            tuple:
+
+                obj: An object of the type of `self` with the values of `src`.
+
+                int: The new offset.
+
+        """
+        raise NotImplementedError
+
     def _ad_copy(self):
         """This method must be overridden.
 
@@ -296,6 +338,20 @@ class OverloadedType(object):
         """
         raise NotImplementedError
 
+    def _ad_nbytes(self):
+        """This method can be overridden.
+
+        The method should return an estimate of the memory in bytes held by
+        `self`, for :meth:`Tape.memory_report` and the memory budgets of the
+        checkpoint storage and the evaluation cache of :class:`ReducedFunctional`.
+
+        Returns:
+            int|None: The number of bytes, or None to use the `nbytes` attribute
+                of `self` if it has one, and :func:`sys.getsizeof` otherwise.
+
+        """
+        return None
+
     def _ad_dim(self):
         """This method must be overridden.
 
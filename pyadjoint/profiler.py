@@ -0,0 +1,247 @@
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+
+# The sweep recorded for each of the block methods evaluated by the tape.
+SWEEPS = {"recompute": "recompute",
+          "evaluate_adj": "adjoint", "evaluate_adj_batch": "adjoint",
+          "evaluate_tlm": "tlm", "evaluate_tlm_batch": "tlm",
+          "evaluate_hessian": "hessian"}
+
+ProfileEvent = namedtuple("ProfileEvent", ["name", "tag", "sweep", "start", "duration", "nbytes", "thread"])
+ProfileEvent.__doc__ = """The evaluation of one block in one sweep.
+
+The `start` time and `duration` are in seconds, and `start` is relative to the
+creation of the profiler. `nbytes` is the peak memory allocated during the
+evaluation, or None if memory is not traced.
+"""
+
+ProfileSummary = namedtuple("ProfileSummary", ["name", "tag", "sweep", "calls", "time", "nbytes"])
+ProfileSummary.__doc__ = """The total time, number of calls and peak memory allocated for a group of events."""
+
+MemoryUsage = namedtuple("MemoryUsage", ["name", "tag", "category", "count", "nbytes"])
+MemoryUsage.__doc__ = """The number of values and the bytes they hold for a group of a :class:`MemoryReport`."""
+
+
+def _format_table(header, lines):
+    """Return the rows `lines` below `header` as a text table with aligned columns."""
+    widths = [max(len(line[k]) for line in [header] + lines) for k in range(len(header))]
+    text = ["  ".join(cell.ljust(width) for cell, width in zip(line, widths)).rstrip()
+            for line in [header] + lines]
+    text.insert(1, "  ".join("-" * width for width in widths))
+    return "\n".join(text)
+
+
+class Profiler(object):
+    """Records the time spent evaluating each block of a tape.
+
+    The profiler is enabled with :meth:`Tape.set_profiler`. Each evaluation
+    of a block in a recomputation, adjoint, TLM or Hessian sweep is then
+    recorded as a :class:`ProfileEvent`, with the name of the block class, the
+    block tag and the sweep. The events can be summarised with
+    :meth:`summary` and :meth:`table`, or exported to the Chrome trace event
+    format with :meth:`export_chrome_trace`, for viewing in e.g.
+    ``chrome://tracing`` or Perfetto.
+
+    A frozen tape which is not evaluated block by block, such as a
+    :class:`~pyadjoint.adjfloat.VectorizedFloatTape`, is recorded as a single
+    event per sweep named after the frozen tape class.
+
+    Args:
+        memory (bool): If True, record the peak memory allocated by each block
+            with :mod:`tracemalloc`, which is started if it is not already
+            tracing. This slows down the evaluation considerably. The memory
+            of blocks evaluated concurrently by a parallel sweep is not
+            separated. Default False.
+
+    Attributes:
+        events (list[ProfileEvent]): The recorded events.
+        high_water_mark (int): If `memory` is True, the highest memory traced by
+            :mod:`tracemalloc` during the sweeps, in bytes.
+        high_water_event (ProfileEvent|None): The event during which the high
+            water mark was reached.
+    """
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.events = []
+        # The highest memory traced during an event, and that event.
+        self.high_water_mark = 0
+        self.high_water_event = None
+        self._origin = time.perf_counter()
+
+    def clear(self):
+        """Discard the recorded events and reset the high water mark."""
+        self.events = []
+        self.high_water_mark = 0
+        self.high_water_event = None
+
+    @contextmanager
+    def record(self, name, tag, sweep):
+        """Record the evaluation within the context manager as an event.
+
+        Args:
+            name (str): The name of the evaluated block class.
+            tag (str|None): The tag of the block.
+            sweep (str): The evaluated block method, see `SWEEPS`, or the name of the sweep.
+        """
+        sweep = SWEEPS.get(sweep, sweep)
+        if self.memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1] if self.memory else None
+            event = ProfileEvent(name, tag, sweep, start - self._origin, duration,
+                                 None if peak is None else max(peak - before, 0), threading.get_ident())
+            self.events.append(event)
+            if peak is not None and peak > self.high_water_mark:
+                self.high_water_mark = peak
+                self.high_water_event = event
+
+    def record_block(self, block, sweep):
+        """Record the evaluation of `block` within the context manager as an event."""
+        return self.record(type(block).__name__, block.tag, sweep)
+
+    def profile(self, blocks, indices, sweep):
+        """Iterate over `indices`, recording each block as an event until the next index is requested."""
+        for i in indices:
+            with self.record_block(blocks[i], sweep):
+                yield i
+
+    def summary(self, by=("name", "tag", "sweep")):
+        """Return the total time, number of calls and peak memory of the events grouped by their fields.
+
+        Args:
+            by (tuple[str]): The fields of :class:`ProfileEvent` to group by,
+                any of "name", "tag" and "sweep". The fields not grouped by are None
+                in the summary.
+
+        Returns:
+            list[ProfileSummary]: The groups, by decreasing total time.
+        """
+        groups = {}
+        for event in self.events:
+            key = tuple(getattr(event, field) if field in by else None for field in ("name", "tag", "sweep"))
+            calls, total, nbytes = groups.get(key, (0, 0., None))
+            if event.nbytes is not None:
+                nbytes = max(event.nbytes, nbytes or 0)
+            groups[key] = (calls + 1, total + event.duration, nbytes)
+        rows = [ProfileSummary(*key, *value) for key, value in groups.items()]
+        return sorted(rows, key=lambda row: row.time, reverse=True)
+
+    def table(self, by=("name", "tag", "sweep"), limit=None):
+        """Return the summary as a text table.
+
+        Args:
+            by (tuple[str]): The fields to group the events by, see :meth:`summary`.
+            limit (int|None): The maximum number of rows.
+
+        Returns:
+            str: The table.
+        """
+        rows = self.summary(by)[:limit]
+        total = sum(event.duration for event in self.events) or 1.
+        header = [field for field in ("name", "tag", "sweep") if field in by] + ["calls", "time [s]", "%",
+                                                                                 "per call [s]", "peak bytes"]
+        lines = [[str(getattr(row, field)) for field in ("name", "tag", "sweep") if field in by]
+                 + [str(row.calls), "%.6f" % row.time, "%.1f" % (100 * row.time / total),
+                    "%.3e" % (row.time / row.calls), "-" if row.nbytes is None else str(row.nbytes)]
+                 for row in rows]
+        return _format_table(header, lines)
+
+    def __str__(self):
+        return self.table()
+
+    def chrome_trace(self):
+        """Return the events in the Chrome trace event format.
+
+        Returns:
+            dict: The trace, which can be serialised with :func:`json.dump`.
+        """
+        pid = os.getpid()
+        threads = {}
+        events = []
+        for event in self.events:
+            args = {"tag": event.tag if event.tag is None else str(event.tag)}
+            if event.nbytes is not None:
+                args["bytes"] = event.nbytes
+            events.append({"name": event.name, "cat": event.sweep, "ph": "X", "pid": pid,
+                           "tid": threads.setdefault(event.thread, len(threads)),
+                           "ts": 1e6 * event.start, "dur": 1e6 * event.duration, "args": args})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, filename):
+        """Write the events to `filename` in the Chrome trace event format, see :meth:`chrome_trace`."""
+        with open(filename, "w") as f:
+            json.dump(self.chrome_trace(), f)
+
+
+class MemoryReport(object):
+    """The memory held by a tape, see :meth:`Tape.memory_report`.
+
+    The memory is grouped by the name of the block class which computed the
+    values, the block tag and the category of the values: "output",
+    "checkpoint", "adjoint", "tlm" or "hessian" for the values referenced by
+    the block variables, "disk" for checkpoints moved to disk by a
+    :class:`~pyadjoint.checkpoint_storage.CheckpointStorage`, and
+    "package_data" for the data stored on the tape by other packages.
+    The values which are not computed by a block on the tape are reported
+    under the name "Input".
+    """
+
+    def __init__(self):
+        self._usage = {}
+
+    def add(self, name, tag, category, nbytes):
+        """Add a value of `nbytes` bytes to a group."""
+        count, total = self._usage.get((name, tag, category), (0, 0))
+        self._usage[(name, tag, category)] = (count + 1, total + nbytes)
+
+    @property
+    def nbytes(self):
+        """The total number of bytes held in memory, excluding checkpoints on disk."""
+        return sum(nbytes for (_, _, category), (_, nbytes) in self._usage.items() if category != "disk")
+
+    def summary(self, by=("name", "tag", "category")):
+        """Return the number of values and the bytes they hold, grouped by their fields.
+
+        Args:
+            by (tuple[str]): The fields of :class:`MemoryUsage` to group by, any of
+                "name", "tag" and "category". The fields not grouped by are None in
+                the summary.
+
+        Returns:
+            list[MemoryUsage]: The groups, by decreasing number of bytes.
+        """
+        groups = {}
+        for key, (count, nbytes) in self._usage.items():
+            key = tuple(value if field in by else None for field, value in zip(("name", "tag", "category"), key))
+            total_count, total = groups.get(key, (0, 0))
+            groups[key] = (total_count + count, total + nbytes)
+        rows = [MemoryUsage(*key, *value) for key, value in groups.items()]
+        return sorted(rows, key=lambda row: row.nbytes, reverse=True)
+
+    def table(self, by=("name", "tag", "category"), limit=None):
+        """Return the summary as a text table, see :meth:`summary`."""
+        rows = self.summary(by)[:limit]
+        fields = [field for field in ("name", "tag", "category") if field in by]
+        total = self.nbytes or 1
+        lines = [[str(getattr(row, field)) for field in fields]
+                 + [str(row.count), str(row.nbytes),
+                    "-" if row.category == "disk" else "%.1f" % (100 * row.nbytes / total)]
+                 for row in rows]
+        return _format_table(fields + ["count", "bytes", "%"], lines)
+
+    def __str__(self):
+        return self.table()
@@ -1,3 +1,6 @@
+from collections import OrderedDict
+
+from .checkpoint_storage import _nbytes
 from .drivers import compute_gradient, compute_hessian
 from .enlisting import Enlist
 from .tape import get_working_tape, stop_annotating, no_annotations
@@ -36,6 +39,115 @@ def _get_pack_derivative_components(controls, derivative_components):
     return pack_derivative_components
 
 
+def _tape_value(control):
+    """Return the value of `control` on the tape, or None if it has no checkpoint.
+
+    The value is restored from the checkpoint, which may be a wrapper of the
+    value, see :meth:`OverloadedType._ad_restore_at_checkpoint`.
+    """
+    block_variable = control.block_variable
+    return None if block_variable.checkpoint is None else block_variable.saved_output
+
+
+def _control_value_unchanged(control, value):
+    """Return True if `value` is known to be equal to the value of `control` on the tape."""
+    import numpy
+    try:
+        current = control.fetch_numpy(_tape_value(control))
+        new = control.fetch_numpy(value)
+    except NotImplementedError:
+        return False
+    return numpy.array_equal(current, new)
+
+
+def _flat(overloaded, value):
+    """Return `value` as a flat float64 array, using the flat view hook of `overloaded` if implemented."""
+    import numpy
+    try:
+        data = overloaded._ad_flat_view(value)
+    except NotImplementedError:
+        data = overloaded._ad_to_list(value)
+    return numpy.asarray(data, dtype=numpy.float64)
+
+
+def _values_key(controls, values):
+    """Return a hash of the control values, or None if a control type can not be converted to an array."""
+    import hashlib
+    import numpy
+    digest = hashlib.blake2b(digest_size=16)
+    for control, value in zip(controls, values):
+        try:
+            data = _flat(control.control, value)
+        except (NotImplementedError, TypeError, ValueError):
+            return None
+        digest.update(numpy.int64(data.size).tobytes())
+        digest.update(data.tobytes())
+    return digest.digest()
+
+
+def _copy(value):
+    """Return a copy of a derivative, so that the cached value can not be modified."""
+    import copy
+    if isinstance(value, OverloadedType):
+        return value._ad_copy()
+    return copy.copy(value)
+
+
+class _CacheEntry(object):
+    """The tape state and derivatives of a reduced functional at one set of control values."""
+    __slots__ = ["state", "derivatives", "nbytes"]
+
+    def __init__(self, state):
+        self.state = state
+        self.derivatives = {}
+        self.nbytes = sum(_nbytes(v) for k, v in state.items() if k != "package_data")
+
+
+class _EvaluationCache(object):
+    """A least recently used cache of the evaluations of a reduced functional.
+
+    Args:
+        size (int): The maximum number of entries.
+        memory (int|None): The maximum estimated memory in bytes of the tape
+            states held by the entries, or None for no limit.
+    """
+
+    def __init__(self, size, memory=None):
+        self.size = size
+        self.memory = memory
+        self._entries = OrderedDict()
+        self._nbytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the entry for `key`, marking it as most recently used, or None."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        """Add an entry, evicting the least recently used entries to stay within the bounds."""
+        self.discard(key)
+        self._entries[key] = entry
+        self._nbytes += entry.nbytes
+        while self._entries and (len(self._entries) > self.size
+                                 or self.memory is not None and self._nbytes > self.memory):
+            _, evicted = self._entries.popitem(last=False)
+            self._nbytes -= evicted.nbytes
+
+    def discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._nbytes -= entry.nbytes
+
+    def clear(self):
+        self._entries.clear()
+        self._nbytes = 0
+
+
 class ReducedFunctional(object):
     """Class representing the reduced functional.
 
@@ -63,6 +175,25 @@ class ReducedFunctional(object):
             list of functional derivatives, list of functional values.
             Should return a list of derivatives (usually the same
             list as the input) to be returned from self.derivative.
+        incremental_recompute (bool): If True, :meth:`__call__` only recomputes
+            the blocks which depend on the controls whose value changed since the
+            last evaluation, and reuses the checkpoints of all other blocks. This
+            assumes that the tape only changes through the controls, so it must not
+            be used together with :class:`~pyadjoint.placeholder.Placeholder` or
+            values modified outside of the tape. Controls whose type does not
+            implement `_ad_to_list` are always considered changed. Default False.
+        cache_size (int): The number of evaluations to memoize. Each evaluation
+            stores the functional value, the derivatives computed at that point and
+            a snapshot of the checkpoints of the tape (see
+            :meth:`Tape.checkpoint_block_vars`), keyed on a hash of the control
+            values. Evaluating the reduced functional at a memoized point restores
+            the snapshot instead of recomputing the tape, and the derivative at a
+            memoized point is returned without an adjoint sweep. Like
+            `incremental_recompute`, this assumes that the tape only changes
+            through the controls. The least recently used evaluations are
+            discarded first. Default 0, which disables the cache.
+        cache_memory (int): The maximum estimated memory in bytes of the memoized
+            tape snapshots. Default None, for no limit other than `cache_size`.
     """
 
     def __init__(self, functional, controls,
@@ -73,7 +204,10 @@ class ReducedFunctional(object):
                  derivative_cb_pre=lambda controls: controls,
                  derivative_cb_post=lambda checkpoint, derivative_components, controls: derivative_components,
                  hessian_cb_pre=lambda *args: None,
-                 hessian_cb_post=lambda *args: None):
+                 hessian_cb_post=lambda *args: None,
+                 incremental_recompute=False,
+                 cache_size=0,
+                 cache_memory=None):
         if not isinstance(functional, OverloadedType):
             raise TypeError("Functional must be an OverloadedType.")
         self.functional = functional
@@ -87,6 +221,10 @@ class ReducedFunctional(object):
         self.derivative_cb_post = derivative_cb_post
         self.hessian_cb_pre = hessian_cb_pre
         self.hessian_cb_post = hessian_cb_post
+        self.incremental_recompute = incremental_recompute
+        self._cache = _EvaluationCache(cache_size, cache_memory) if cache_size > 0 else None
+        # The key of the control values for which the adjoint values on the tape were computed.
+        self._adjoint_key = None
 
         if self.derivative_components:
             # pre callback
@@ -127,11 +265,26 @@ class ReducedFunctional(object):
             adj_input = create_overloaded_object(adj_input)
             adj_value = adj_input._ad_mul(self.scale)
 
-        derivatives = compute_gradient(self.functional,
-                                       controls,
-                                       options=options,
-                                       tape=self.tape,
-                                       adj_value=adj_value)
+        derivatives = None
+        key = entry = derivative_key = None
+        if self._cache is not None:
+            key = self._current_key()
+            entry = None if key is None else self._cache.get(key)
+            derivative_key = self._derivative_key(adj_input, options, controls)
+            if entry is not None and derivative_key in entry.derivatives:
+                derivatives = [_copy(d) for d in entry.derivatives[derivative_key]]
+
+        if derivatives is None:
+            # Controls are marked so that checkpointed sweeps do not overwrite them.
+            with self.marked_controls():
+                derivatives = compute_gradient(self.functional,
+                                               controls,
+                                               options=options,
+                                               tape=self.tape,
+                                               adj_value=adj_value)
+            self._adjoint_key = key
+            if entry is not None and derivative_key is not None:
+                entry.derivatives[derivative_key] = [_copy(d) for d in derivatives]
 
         # Call callback
         derivatives = self.derivative_cb_post(
@@ -168,7 +321,16 @@ class ReducedFunctional(object):
         values = [c.tape_value() for c in self.controls]
         self.hessian_cb_pre(self.controls.delist(values))
 
-        r = compute_hessian(self.functional, self.controls, m_dot, options=options, tape=self.tape)
+        if self._cache is not None:
+            key = self._current_key()
+            if key is not None and key != self._adjoint_key:
+                # The last derivative was taken from the cache, so the adjoint values are not on the tape.
+                with self.marked_controls():
+                    compute_gradient(self.functional, self.controls, tape=self.tape, adj_value=self.scale)
+                self._adjoint_key = key
+
+        with self.marked_controls():
+            r = compute_hessian(self.functional, self.controls, m_dot, options=options, tape=self.tape)
 
         # Call callback
         self.hessian_cb_post(self.functional.block_variable.checkpoint,
@@ -199,17 +361,17 @@ class ReducedFunctional(object):
         # Call callback.
         self.eval_cb_pre(self.controls.delist(values))
 
-        for i, value in enumerate(values):
-            self.controls[i].update(value)
+        key = entry = None
+        if self._cache is not None:
+            key = _values_key(self.controls, values)
+            entry = None if key is None else self._cache.get(key)
 
-        self.tape.reset_blocks()
-        blocks = self.tape.get_blocks()
-        with self.marked_controls():
-            with stop_annotating():
-                for i in self.tape._bar("Evaluating functional").iter(
-                    range(len(blocks))
-                ):
-                    blocks[i].recompute()
+        if entry is not None:
+            self.tape.restore_block_vars(entry.state)
+        else:
+            self._recompute(values)
+            if key is not None:
+                self._cache.put(key, _CacheEntry(self.tape.checkpoint_block_vars(self.controls)))
 
         # ReducedFunctional can result in a scalar or an assembled 1-form
         func_value = self.functional.block_variable.saved_output
@@ -221,6 +383,38 @@ class ReducedFunctional(object):
 
         return func_value
 
+    def _recompute(self, values):
+        changed = None
+        if self.incremental_recompute and self.tape._checkpoint_manager is None:
+            changed = [control for control, value in zip(self.controls, values)
+                       if not _control_value_unchanged(control, value)]
+
+        for i, value in enumerate(values):
+            self.controls[i].update(value)
+
+        self.tape.reset_blocks()
+        with self.marked_controls():
+            with stop_annotating():
+                if changed is None:
+                    self.tape.recompute()
+                elif changed:
+                    self.tape.recompute(controls=changed)
+
+    def _current_key(self):
+        """Return the hash of the control values on the tape."""
+        return _values_key(self.controls, [_tape_value(c) for c in self.controls])
+
+    def _derivative_key(self, adj_input, options, controls):
+        """Return the key of a derivative in a cache entry, or None if it can not be memoized."""
+        if not isinstance(adj_input, (int, float)) or not isinstance(self.scale, (int, float)):
+            return None
+        key = (float(adj_input), float(self.scale), tuple(sorted(options.items())), tuple(id(c) for c in controls))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
     def optimize_tape(self):
         self.tape.optimize(
             controls=self.controls,
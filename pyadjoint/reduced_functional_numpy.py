@@ -1,5 +1,5 @@
 from __future__ import print_function
-from .reduced_functional import ReducedFunctional
+from .reduced_functional import ReducedFunctional, _flat
 from .tape import no_annotations, get_working_tape
 from .enlisting import Enlist
 from .control import Control
@@ -32,27 +32,39 @@ class ReducedFunctionalNumPy(ReducedFunctional):
             that accepts the control values as an array of scalars
 
         """
-        m_copies = [control.copy_data() for control in self.controls]
-        return self.rf.__call__(self.set_local(m_copies, m_array))
+        return self.rf.__call__(self.set_local([None] * len(self.controls), m_array))
 
     def set_local(self, m, m_array):
+        """Set the entries of `m` to the values in `m_array`.
+
+        Controls implementing `_ad_from_flat_view` are replaced by views into
+        one copy of `m_array`, so that they do not change when the optimizer
+        reuses `m_array`. Other entries of `m` are assigned to, and a copy of
+        the control data is made for the entries that are None.
+        """
+        m_array = numpy.array(m_array, dtype=numpy.float64)
         offset = 0
         for i, control in enumerate(self.controls):
-            m[i], offset = control.assign_numpy(m[i], m_array, offset)
+            try:
+                m[i], offset = control.control._ad_from_flat_view(m_array, offset)
+            except NotImplementedError:
+                if m[i] is None:
+                    m[i] = control.copy_data()
+                m[i], offset = control.assign_numpy(m[i], m_array, offset)
 
         return m
 
     def get_global(self, m):
-        m_global = []
+        views = []
         for i, v in enumerate(Enlist(m)):
             if isinstance(v, Control):
                 # TODO: Consider if you want this design.
-                m_global += v.fetch_numpy(v.control)
+                views.append(_flat(v.control, v.control))
             elif hasattr(v, "_ad_to_list"):
-                m_global += v._ad_to_list(v)
+                views.append(_flat(v, v))
             else:
-                m_global += self.controls[i].control._ad_to_list(v)
-        return numpy.array(m_global, dtype="d")
+                views.append(_flat(self.controls[i].control, v))
+        return _pack(views)
 
     @no_annotations
     def derivative(self, m_array=None, forget=True, project=False):
@@ -64,19 +76,27 @@ class ReducedFunctionalNumPy(ReducedFunctional):
         # In the case that the control values have changed since the last forward run,
         # we first need to rerun the forward model with the new controls to have the
         # correct forward solutions
-        # TODO: No good way to check. Is it ok to always assume `m_array` is the same as used last in __call__?
-        # if m_array is not None:
-        #    self.__call__(m_array)
+        if m_array is not None and not numpy.array_equal(m_array, self.get_controls()):
+            self.__call__(m_array)
         dJdm = self.rf.derivative()
         dJdm = Enlist(dJdm)
 
-        m_global = []
-        for i, control in enumerate(self.controls):
-            # This is a little ugly, but we need to go through the control to get to the OverloadedType.
-            # There is no guarantee that dJdm[i] is an OverloadedType and not a backend type.
-            m_global += control.fetch_numpy(dJdm[i])
+        # This is a little ugly, but we need to go through the control to get to the OverloadedType.
+        # There is no guarantee that dJdm[i] is an OverloadedType and not a backend type.
+        return _pack([_flat(control.control, dJdm[i]) for i, control in enumerate(self.controls)])
 
-        return numpy.array(m_global, dtype="d")
+    @no_annotations
+    def value_and_gradient(self, m_array, forget=True, project=False):
+        """Evaluate the reduced functional and its derivative at the controls given as an array of scalars.
+
+        The tape is recomputed once, and the derivative is computed from that
+        recomputation with one adjoint sweep.
+
+        Returns:
+            tuple: The value of the functional and its derivative as an array of scalars.
+        """
+        value = self.__call__(m_array)
+        return value, self.derivative(forget=forget, project=project)
 
     @no_annotations
     def hessian(self, m_array, m_dot_array):
@@ -84,21 +104,18 @@ class ReducedFunctionalNumPy(ReducedFunctional):
             that accepts the controls as an array of scalars. If m_array is None,
             the Hessian action at the latest forward run is returned. """
         # Calling derivative is needed, see i.e. examples/stokes-shape-opt
-        self.derivative()
-        m_copies = [control.copy_data() for control in self.controls]
-        Hm = self.rf.hessian(self.set_local(m_copies, m_dot_array))
+        self.derivative(m_array)
+        Hm = self.rf.hessian(self.set_local([None] * len(self.controls), m_dot_array))
         Hm = Enlist(Hm)
 
-        m_global = []
-        for i, control in enumerate(self.controls):
-            # This is a little ugly, but we need to go through the control to get to the OverloadedType.
-            # There is no guarantee that dJdm[i] is an OverloadedType and not a backend type.
-            m_global += control.fetch_numpy(Hm[i])
+        # This is a little ugly, but we need to go through the control to get to the OverloadedType.
+        # There is no guarantee that Hm[i] is an OverloadedType and not a backend type.
+        m_global = _pack([_flat(control.control, Hm[i]) for i, control in enumerate(self.controls)])
 
         tape = get_working_tape()
         tape.reset_variables()
 
-        return numpy.array(m_global, dtype="d")
+        return m_global
 
     def obj_to_array(self, obj):
         return self.get_global(obj)
@@ -115,6 +132,16 @@ class ReducedFunctionalNumPy(ReducedFunctional):
         return m
 
 
+def _pack(views):
+    """Copy the flat arrays `views` into consecutive slices of one preallocated float64 array."""
+    m_global = numpy.empty(sum(view.size for view in views), dtype=numpy.float64)
+    offset = 0
+    for view in views:
+        m_global[offset:offset + view.size] = view
+        offset += view.size
+    return m_global
+
+
 def set_local(coeffs, m_array):
     offset = 0
     for m in Enlist(coeffs):
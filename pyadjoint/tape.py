@@ -1,30 +1,134 @@
 # Type dependencies
+import contextvars
 import os
 import re
 import threading
-from contextlib import contextmanager
+import warnings
+from contextlib import contextmanager, nullcontext
 from functools import wraps
-from itertools import chain
+from itertools import chain, count
 from abc import ABC, abstractmethod
 
 
-_working_tape = None
-_annotation_enabled = False
+# The working tape and annotation flag are process-wide, and shared by all
+# threads. Each can be overridden in the current context, see
+# :mod:`contextvars`, by ``with set_working_tape(...)`` and by
+# :class:`stop_annotating`, so that threads and asyncio tasks can record
+# independent tapes concurrently. A new thread starts without overrides, and an
+# asyncio task starts with a copy of the overrides of the context it was
+# created in.
+_UNSET = object()
+
+
+class _ProcessState(object):
+    """The working tape and annotation flag used where the context sets no override."""
+    __slots__ = ["tape", "annotate"]
+
+    def __init__(self):
+        self.tape = None
+        self.annotate = False
+
+
+_process_state = _ProcessState()
+_working_tape = contextvars.ContextVar("pyadjoint_working_tape", default=_UNSET)
+_annotation_enabled = contextvars.ContextVar("pyadjoint_annotation_enabled", default=_UNSET)
+_state_attributes = {_working_tape: "tape", _annotation_enabled: "annotate"}
+
+
+def _get(variable):
+    """Return the value of `variable` in the current context, or the process-wide value if it is not overridden."""
+    value = variable.get()
+    return getattr(_process_state, _state_attributes[variable]) if value is _UNSET else value
+
+
+def _set(variable, value):
+    """Set the value of `variable` in the current context if it is overridden, and process-wide otherwise."""
+    if variable.get() is _UNSET:
+        setattr(_process_state, _state_attributes[variable], value)
+    else:
+        variable.set(value)
+
+
+class _SweepGenerations(object):
+    """The current generation of the adjoint, TLM and Hessian values of the block variables of a tape.
+
+    A value stored on a :class:`BlockVariable` is only valid while the
+    generation it was stored in is current for the tape the block variable
+    follows, see :meth:`BlockVariable._follow`, so starting a new generation
+    resets the values of all block variables of the tape at once.
+    """
+    __slots__ = ["adjoint", "tlm", "hessian"]
+
+    def __init__(self):
+        self.adjoint = 0
+        self.tlm = 0
+        self.hessian = 0
+
+    def new(self, types):
+        """Start a new generation for each of the value `types` ("adjoint", "tlm" and "hessian")."""
+        for kind in ("adjoint", "tlm", "hessian"):
+            if kind in types:
+                setattr(self, kind, next(_generation_counter))
+
+
+# Generation numbers are drawn from a single counter so that they are never reused.
+_generation_counter = count(1)
+# The generations followed by the block variables which are not on a tape, which never change.
+_untaped_generations = _SweepGenerations()
+
+
+class _AccumulationLocks(object):
+    """Striped locks which serialise the accumulation of values into block variables.
+
+    The locks are only taken while a parallel sweep is running in the
+    current context, see :meth:`Tape.enable_parallel_adjoint`.
+    """
+    __slots__ = ["_active", "_locks"]
+
+    def __init__(self, n_locks=64):
+        self._active = contextvars.ContextVar("pyadjoint_parallel_sweep", default=False)
+        self._locks = [threading.Lock() for _ in range(n_locks)]
+
+    @property
+    def active(self):
+        return self._active.get()
+
+    @contextmanager
+    def enabled(self):
+        """Take the locks in the current context, and the contexts copied from it, within this context manager."""
+        token = self._active.set(True)
+        try:
+            yield
+        finally:
+            self._active.reset(token)
+
+    def get(self, obj):
+        """Return the lock guarding `obj`."""
+        return self._locks[(id(obj) >> 4) % len(self._locks)]
+
+
+_accumulation_locks = _AccumulationLocks()
 
 
 def get_working_tape():
-    return _working_tape
+    return _get(_working_tape)
 
 
 def pause_annotation():
-    global _annotation_enabled
-    _annotation_enabled = False
+    _set(_annotation_enabled, False)
 
 
 def continue_annotation():
-    global _annotation_enabled
-    _annotation_enabled = True
-    return _annotation_enabled
+    _set(_annotation_enabled, True)
+    return True
+
+
+def _reset(variable, token, value):
+    """Restore a context variable set with `token`, or set it to `value` if `token` is from another context."""
+    try:
+        variable.reset(token)
+    except (ValueError, RuntimeError):
+        variable.set(value)
 
 
 class set_working_tape(object):
@@ -47,24 +151,36 @@ class set_working_tape(object):
 
                 with set_working_tape() as tape:
                     ...
+
+       Used imperatively, the tape is set for all threads, unless the current
+       context is inside a ``with set_working_tape(...)`` block. Used as a
+       context manager, the tape is set in the current context only, see
+       :mod:`contextvars`, and the previous working tape is restored on exit.
     """
 
     def __init__(self, tape=None, **tape_kwargs):
-        # Get working tape
-        global _working_tape
         # Store current tape
-        self.old_tape = _working_tape
+        self.old_tape = _working_tape.get()
+        self._old_process_tape = _process_state.tape
         # Set new tape
         self.tape = tape or Tape(**tape_kwargs)
-        _working_tape = self.tape
+        self._token = None
+        if self.old_tape is _UNSET:
+            _process_state.tape = self.tape
+        else:
+            self._token = _working_tape.set(self.tape)
 
     def __enter__(self):
+        if self._token is None:
+            # Override the tape in the current context instead of for all threads.
+            if _process_state.tape is self.tape:
+                _process_state.tape = self._old_process_tape
+            self._token = _working_tape.set(self.tape)
         return self.tape
 
     def __exit__(self, *args):
         # Re-establish the original tape
-        global _working_tape
-        _working_tape = self.old_tape
+        _reset(_working_tape, self._token, self.old_tape)
 
 
 class stop_annotating(object):
@@ -78,20 +194,22 @@ class stop_annotating(object):
     The `modifies` argument is intended to be used by user code which
     changes the value of inputs to the adjoint calculation such as time varying
     forcings. Its effect is to create a new block variable for each of the
-    modified variables at the end of the context manager. """
+    modified variables at the end of the context manager.
+
+    Annotation is stopped in the current context only, see :mod:`contextvars`,
+    and the annotation state on entry is restored on exit, also when the same
+    instance is entered more than once. Other threads keep annotating. """
 
     def __init__(self, modifies=None):
-        global _annotation_enabled
         self.modifies = modifies
-        self._orig_annotation_enabled = _annotation_enabled
+        self._entered = []
 
     def __enter__(self):
-        global _annotation_enabled
-        _annotation_enabled = False
+        self._entered.append((_annotation_enabled.get(), _annotation_enabled.set(False)))
 
     def __exit__(self, *args):
-        global _annotation_enabled
-        _annotation_enabled = self._orig_annotation_enabled
+        enabled, token = self._entered.pop()
+        _reset(_annotation_enabled, token, enabled)
         if self.modifies is not None:
             try:
                 self.modifies.create_block_variable()
@@ -129,27 +247,21 @@ def annotate_tape(kwargs=None):
 
     # TODO: Consider if there is any scenario where one would want the keyword to have
     # precedence over the global flag.
-    if not _annotation_enabled:
+    if not _get(_annotation_enabled):
+        return False
+
+    if annotate and get_working_tape() is None:
+        warnings.warn("Annotation is enabled, but there is no working tape, so nothing is annotated. "
+                      "Set one with set_working_tape.", stacklevel=2)
         return False
 
     return annotate
 
 
 def _find_relevant_nodes(tape, controls):
-    # This function is just a stripped down Block.optimize_for_controls
-    blocks = tape.get_blocks()
-    nodes = set([control.block_variable for control in controls])
-
-    for block in blocks:
-        depends_on_control = False
-        for dep in block.get_dependencies():
-            if dep in nodes:
-                depends_on_control = True
-
-        if depends_on_control:
-            for output in block.get_outputs():
-                nodes.add(output)
-    return nodes
+    # The block variables which depend on the controls, looked up in the tape's dependency index.
+    return tape._get_index().forward_cone(
+        frozenset(control.block_variable for control in controls)).nodes
 
 
 class Tape(object):
@@ -160,7 +272,9 @@ class Tape(object):
 
     """
     __slots__ = ["_blocks", "_tf_tensors", "_tf_added_blocks", "_nodes",
-                 "_tf_registered_blocks", "_bar", "_package_data"]
+                 "_tf_registered_blocks", "_bar", "_package_data", "_checkpoint_manager",
+                 "_checkpoint_storage", "_stored_blocks", "_timestep_ends", "_index", "_frozen", "_executor",
+                 "_profiler", "_generations", "_followed_blocks", "_shared_variables"]
 
     def __init__(self, blocks=None, package_data=None):
         # Initialize the list of blocks on the tape.
@@ -174,10 +288,35 @@ class Tape(object):
         # Hook location for packages which need to store additional data on the
         # tape. Packages should store the data under a "packagename" key.
         self._package_data = package_data or {}
+        # Manager for the checkpointing schedule, if checkpointing is enabled.
+        self._checkpoint_manager = None
+        # Tiered storage for the checkpoints, and the number of blocks whose
+        # outputs have been moved into it.
+        self._checkpoint_storage = None
+        self._stored_blocks = 0
+        # The index of the first block after each completed timestep.
+        self._timestep_ends = []
+        # Dependency index of the blocks, built when needed, see _get_index.
+        self._index = None
+        # Array-backed representation of the blocks, see freeze.
+        self._frozen = None
+        # Executor for the parallel reverse sweeps, see enable_parallel_adjoint.
+        self._executor = None
+        # Profiler recording the evaluation of the blocks, see set_profiler.
+        self._profiler = None
+        # The sweep generations of the block variables following the tape, the
+        # number of blocks whose variables have been made to follow it, and the
+        # block variables following another tape, which are reset explicitly.
+        self._generations = _SweepGenerations()
+        self._followed_blocks = 0
+        self._shared_variables = set()
 
     def clear_tape(self):
         self.reset_variables()
         self._blocks = []
+        self._stored_blocks = 0
+        self._timestep_ends = []
+        self._structure_changed()
         for data in self._package_data.values():
             data.clear()
 
@@ -195,7 +334,11 @@ class Tape(object):
         """
         Adds a block to the tape and returns the index.
         """
+        if self._checkpoint_storage is not None:
+            # The outputs of earlier blocks are complete once a new block is added.
+            self._store_checkpoints()
         self._blocks.append(block)
+        self._structure_changed(appended=True)
 
         # len() is computed in constant time, so this should be fine.
         return len(self._blocks) - 1
@@ -225,35 +368,535 @@ class Tape(object):
                 tags.append(block.tag)
         return tags
 
-    def evaluate_adj(self, last_block=0, markings=False):
-        for i in self._bar("Evaluating adjoint").iter(
-            range(len(self._blocks) - 1, last_block - 1, -1)
+    def end_timestep(self):
+        """Mark the end of a timestep.
+
+        All blocks added to the tape since the previous call (or since the
+        tape was created) form one timestep. When timesteps are recorded, the
+        checkpointing schedule operates on timesteps instead of on individual
+        blocks, and the sweeps can be restricted to a single timestep.
+        """
+        self._timestep_ends.append(len(self._blocks))
+        self._structure_changed(appended=True)
+
+    def timestepper(self, iterable):
+        """Iterate over `iterable`, marking the end of a timestep after each iteration.
+
+        Example usage:
+
+            .. highlight:: python
+            .. code-block:: python
+
+                for t in tape.timestepper(times):
+                    u_new = step(u, t)
+                    ...
+
+        Args:
+            iterable (iterable): The time levels, or any other iterable.
+
+        Yields:
+            The items of `iterable`.
+        """
+        for item in iterable:
+            yield item
+            self.end_timestep()
+
+    @property
+    def latest_timestep(self):
+        """The number of completed timesteps on the tape."""
+        return len(self._timestep_ends)
+
+    def get_timesteps(self):
+        """Returns the blocks of each timestep as ranges of block indices.
+
+        Blocks added after the last completed timestep form a final timestep.
+        If no timesteps have been recorded, the whole tape is one timestep.
+
+        Returns:
+            list[range]: The ranges of the block indices of each timestep.
+        """
+        starts = [0] + self._timestep_ends
+        ends = self._timestep_ends[:]
+        if not ends or ends[-1] < len(self._blocks):
+            ends.append(len(self._blocks))
+        return [range(start, end) for start, end in zip(starts, ends)]
+
+    def get_timestep_blocks(self, timestep):
+        """Returns the list of blocks in a timestep.
+
+        Args:
+            timestep (int): The index of the timestep.
+
+        Returns:
+            list[block.Block]: The blocks of the timestep.
+        """
+        start, stop = self._timestep_range(timestep)
+        return self._blocks[start:stop]
+
+    def _timestep_range(self, timestep):
+        """Return the first and one past the last block index of a timestep, or of the whole tape if None."""
+        if timestep is None:
+            return 0, len(self._blocks)
+        n = len(self._timestep_ends)
+        if timestep < 0 or timestep > n:
+            raise IndexError(f"Timestep {timestep} is not on the tape.")
+        start = 0 if timestep == 0 else self._timestep_ends[timestep - 1]
+        stop = self._timestep_ends[timestep] if timestep < n else len(self._blocks)
+        return start, stop
+
+    def enable_checkpointing(self, schedule):
+        """Enable checkpointing of the forward states according to a schedule.
+
+        With checkpointing enabled, :meth:`recompute` only keeps the
+        checkpoints that the schedule requires, and the reverse sweeps
+        recompute the remaining ones when they are needed. This trades extra
+        forward computation for a bounded memory footprint.
+
+        Args:
+            schedule (checkpointing.CheckpointSchedule|None): The schedule to use,
+                e.g. :class:`pyadjoint.checkpointing.Revolve`. If None, checkpointing
+                is disabled and all checkpoints are kept in memory.
+
+        """
+        if schedule is None:
+            self._checkpoint_manager = None
+        else:
+            from .checkpointing import CheckpointManager
+            self._checkpoint_manager = CheckpointManager(self, schedule)
+
+    def enable_parallel_adjoint(self, workers):
+        """Evaluate the independent blocks of the reverse sweeps concurrently.
+
+        The blocks are grouped into levels such that no block in a level
+        depends on the output of another block in the same level, or of a
+        block in a later level, where the levels are ordered from the end of
+        the tape. :meth:`evaluate_adj` and :meth:`evaluate_hessian` then
+        evaluate the levels in turn, running the blocks of each level in the
+        executor. Contributions to the same block variable are accumulated
+        under a lock.
+
+        This speeds up the sweeps of tapes with independent branches (e.g.
+        separate functional terms, or ensemble members recorded on one tape)
+        when the blocks release the GIL, as NumPy operations and PETSc solves
+        do. The blocks must not share mutable state other than the values
+        accumulated through :meth:`BlockVariable.add_adj_output` and
+        :meth:`BlockVariable.add_hessian_output`.
+
+        Args:
+            workers (int|concurrent.futures.Executor|None): The number of threads
+                to use, or the executor to run the blocks in. If None, the
+                sweeps are sequential.
+
+        """
+        if isinstance(workers, int):
+            from concurrent.futures import ThreadPoolExecutor
+            workers = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pyadjoint-sweep")
+        self._executor = workers
+
+    def _parallel_sweep(self, description, sweep, evaluate, start, stop):
+        """Evaluate the blocks in ``range(start, stop)`` in reverse level order with the executor.
+
+        `sweep` is the name of the block method evaluated, for the profiler.
+        The cursor of the checkpoint storage is moved to the smallest block
+        index of each level before the level is evaluated.
+        """
+        storage = self._checkpoint_storage
+        if storage is not None:
+            self._store_checkpoints()
+        levels = self._get_index().reverse_levels(start, stop)
+        executor = self._executor
+        if self._profiler is not None:
+            untimed = evaluate
+
+            def evaluate(i):
+                with self._record(i, sweep):
+                    untimed(i)
+        with _accumulation_locks.enabled(), stop_annotating():
+            # The blocks run in copies of the current context, which share its
+            # working tape and the accumulation locks.
+            context = contextvars.copy_context()
+            for level in self._bar(description).iter(levels):
+                if storage is not None:
+                    storage.move_cursor(level[-1], self._blocks)
+                if len(level) == 1:
+                    evaluate(level[0])
+                else:
+                    for future in [executor.submit(context.copy().run, evaluate, i) for i in level]:
+                        future.result()
+        if storage is not None:
+            storage.move_cursor(None, self._blocks)
+
+    def set_profiler(self, profiler):
+        """Record the evaluation of each block in the sweeps over the tape.
+
+        Args:
+            profiler (profiler.Profiler|None): The profiler to record the
+                evaluations with, see :class:`pyadjoint.profiler.Profiler`.
+                If None, profiling is disabled.
+
+        """
+        self._profiler = profiler
+
+    def memory_report(self):
+        """Return the memory held by the block variables and package data of the tape.
+
+        The outputs, checkpoints and adjoint, TLM and Hessian values of the
+        block variables are reported by the class and tag of the block computing
+        them, using :meth:`OverloadedType._ad_nbytes` to estimate their size.
+        Objects shared between block variables, or used both as output and
+        checkpoint, are counted once. Values from earlier
+        sweeps, which are released when next accessed, are included. To find the
+        peak memory used during the sweeps, use a
+        :class:`~pyadjoint.profiler.Profiler` with ``memory=True``.
+
+        Returns:
+            profiler.MemoryReport: The memory by block class, tag and category.
+        """
+        from .checkpoint_storage import StoredCheckpoint, _nbytes, COMPRESSED, DISK
+        from .profiler import MemoryReport
+        report = MemoryReport()
+        seen = set()
+
+        def add(name, tag, category, value):
+            if value is not None and id(value) not in seen:
+                seen.add(id(value))
+                report.add(name, tag, category, _nbytes(value))
+
+        def add_variable(name, tag, bv):
+            add(name, tag, "output", bv.output)
+            checkpoint = bv._checkpoint
+            if isinstance(checkpoint, StoredCheckpoint):
+                entry = checkpoint.entry
+                if entry.tier == DISK:
+                    report.add(name, tag, "disk", entry.nbytes)
+                else:
+                    report.add(name, tag, "checkpoint", len(entry.data) if entry.tier == COMPRESSED else entry.nbytes)
+            else:
+                add(name, tag, "checkpoint", checkpoint)
+            add(name, tag, "adjoint", bv._adj_value)
+            add(name, tag, "tlm", bv._tlm_value)
+            add(name, tag, "hessian", bv._hessian_value)
+
+        variables = set()
+        for block in self._blocks:
+            for bv in block.get_dependencies():
+                if bv not in variables:
+                    variables.add(bv)
+                    add_variable("Input", None, bv)
+            for bv in block.get_outputs():
+                if bv not in variables:
+                    variables.add(bv)
+                    add_variable(type(block).__name__, block.tag, bv)
+        for package, data in self._package_data.items():
+            report.add(package, None, "package_data", _nbytes(data))
+        return report
+
+    def _profiled(self, sweep, indices):
+        """Iterate over the block `indices` of a sweep, recording each block with the profiler if enabled."""
+        if self._profiler is None or (self._frozen is not None and not self._frozen.per_block):
+            return indices
+        return self._profiler.profile(self._blocks, indices, sweep)
+
+    def _record(self, i, sweep):
+        """Return a context manager recording the evaluation of block `i` with the profiler if enabled."""
+        if self._profiler is None:
+            return nullcontext()
+        return self._profiler.record_block(self._blocks[i], sweep)
+
+    def _record_frozen(self, sweep):
+        """Return a context manager recording a sweep of a frozen tape which is not evaluated block by block."""
+        if self._profiler is None or self._frozen.per_block:
+            return nullcontext()
+        return self._profiler.record(type(self._frozen).__name__, None, sweep)
+
+    def _parallel(self):
+        """Return True if the reverse sweeps should be run by the executor."""
+        return self._executor is not None and (self._frozen is None or self._frozen.per_block)
+
+    def set_checkpoint_storage(self, storage):
+        """Keep the checkpoints of the block outputs in a tiered storage.
+
+        The storage moves checkpoints between RAM, compressed RAM and disk to
+        fit within a memory budget, see
+        :class:`pyadjoint.checkpoint_storage.CheckpointStorage`, keeps them in
+        a memory-mapped file, see
+        :class:`pyadjoint.checkpoint_storage.ArenaCheckpointStorage`, or encodes
+        them with a codec selected by the block tag, see
+        :class:`pyadjoint.checkpoint_codecs.CodecCheckpointStorage`.
+
+        Args:
+            storage (checkpoint_storage.CheckpointStorage|checkpoint_storage.ArenaCheckpointStorage|
+                checkpoint_codecs.CodecCheckpointStorage|None):
+                The storage to use. If None, checkpoints are kept as they are.
+
+        """
+        self._checkpoint_storage = storage
+        self._stored_blocks = 0
+        if storage is not None:
+            self._store_checkpoints()
+
+    def _store_checkpoints(self):
+        """Move the checkpoints of the outputs of all blocks into the checkpoint storage."""
+        for i in range(self._stored_blocks, len(self._blocks)):
+            self._store_outputs(i)
+        self._stored_blocks = len(self._blocks)
+
+    def _store_outputs(self, i):
+        """Move the checkpoints of the outputs of block `i` into the checkpoint storage."""
+        if self._checkpoint_storage is not None:
+            block = self._blocks[i]
+            for output in block.get_outputs():
+                self._checkpoint_storage.store(output, i, block.tag)
+
+    def _reverse_sweep(self, description, last_block=0, stop=None):
+        """Iterate over the block indices in reverse, keeping the checkpoint storage informed."""
+        storage = self._checkpoint_storage
+        if storage is not None:
+            self._store_checkpoints()
+        stop = len(self._blocks) if stop is None else stop
+        for i in self._bar(description).iter(
+            range(stop - 1, last_block - 1, -1)
         ):
+            if storage is not None:
+                storage.move_cursor(i, self._blocks)
+            yield i
+        if storage is not None:
+            storage.move_cursor(None, self._blocks)
+
+    def _structure_changed(self, appended=False):
+        """Invalidate any cached information about the blocks on the tape.
+
+        Args:
+            appended (bool): True if the only change is that blocks were appended
+                to the tape, in which case the dependency index is extended
+                rather than rebuilt.
+        """
+        if self._checkpoint_manager is not None:
+            self._checkpoint_manager.invalidate()
+        self._frozen = None
+        if not appended:
+            self._followed_blocks = 0
+            self._shared_variables = set()
+        if self._index is not None:
+            if appended:
+                self._index.clear_cache()
+            else:
+                self._index = None
+
+    def freeze(self, vectorize=False):
+        """Compile the blocks on the tape into a :class:`FrozenTape`.
+
+        Once the structure of the tape is fixed, e.g. after
+        :meth:`ReducedFunctional.optimize_tape`, freezing the tape speeds up
+        repeated sweeps: :meth:`recompute`, :meth:`evaluate_adj`,
+        :meth:`evaluate_tlm` and :meth:`evaluate_hessian` then iterate over
+        precomputed arrays instead of rebuilding the block argument lists.
+        The tape is unfrozen when blocks are added to or removed from it.
+
+        Args:
+            vectorize (bool): If True, the tape must consist of :class:`AdjFloat`
+                operations only, and is compiled into a
+                :class:`~pyadjoint.adjfloat.VectorizedFloatTape` which evaluates
+                the sweeps with NumPy. Default False.
+
+        Returns:
+            FrozenTape: The frozen representation of the tape.
+        """
+        if vectorize:
+            from .adjfloat import VectorizedFloatTape
+            self._follow_variables()
+            self._frozen = VectorizedFloatTape(self._blocks, generations=self._generations)
+        else:
+            from .frozen_tape import FrozenTape
+            self._frozen = FrozenTape(self._blocks)
+        return self._frozen
+
+    def unfreeze(self):
+        """Discard the frozen representation of the tape, see :meth:`freeze`."""
+        self._frozen = None
+
+    def _get_index(self):
+        """Return the up to date :class:`TapeIndex` of the blocks on the tape."""
+        if self._index is None:
+            self._index = TapeIndex(self._blocks)
+        self._index.update()
+        return self._index
+
+    def _check_manager(self, timestep=None, last_block=0, controls=None):
+        """Return the checkpoint manager if the sweep should be delegated to it."""
+        if self._checkpoint_manager is not None:
+            if timestep is not None or last_block != 0 or controls is not None:
+                raise ValueError("Sweeps over part of the tape are not supported when checkpointing is enabled.")
+        return self._checkpoint_manager
+
+    def recompute(self, timestep=None, controls=None):
+        """Recompute the blocks on the tape from the current values of their inputs.
+
+        Args:
+            timestep (int|None): If given, only recompute the blocks of this timestep.
+            controls (list[Control]|None): If given, only recompute the blocks which
+                depend on these controls. The outputs of all other blocks are
+                assumed to be up to date.
+        """
+        manager = self._check_manager(timestep, controls=controls)
+        if manager is not None:
+            return manager.recompute()
+        start, stop = self._timestep_range(timestep)
+        if controls is None:
+            indices = range(start, stop)
+        else:
+            cone = self._get_index().forward_cone(frozenset(c.block_variable for c in controls))
+            indices = [i for i in cone.blocks if start <= i < stop]
+        sweep = self._profiled("recompute", self._bar("Evaluating functional").iter(indices))
+        if self._frozen is not None:
+            if self._checkpoint_storage is not None:
+                sweep = self._storing(sweep)
+            with self._record_frozen("recompute"):
+                self._frozen.recompute(sweep)
+            return
+        for i in sweep:
+            self._blocks[i].recompute()
+            self._store_outputs(i)
+
+    def _storing(self, indices):
+        """Iterate over `indices`, storing the outputs of each block once the next one is requested."""
+        for i in indices:
+            yield i
+            self._store_outputs(i)
+
+    def evaluate_adj(self, last_block=0, markings=False, timestep=None):
+        manager = self._check_manager(timestep, last_block)
+        if manager is not None:
+            return manager.evaluate_adj(markings=markings)
+        if timestep is not None:
+            last_block, stop = self._timestep_range(timestep)
+        else:
+            stop = None
+        if self._parallel():
+            frozen = self._frozen
+            if frozen is None:
+                def evaluate(i):
+                    self._blocks[i].evaluate_adj(markings=markings)
+            else:
+                def evaluate(i):
+                    frozen.evaluate_adj((i,), markings=markings)
+            return self._parallel_sweep("Evaluating adjoint", "evaluate_adj", evaluate, last_block,
+                                        len(self._blocks) if stop is None else stop)
+        sweep = self._profiled("evaluate_adj", self._reverse_sweep("Evaluating adjoint", last_block, stop))
+        if self._frozen is not None:
+            with stop_annotating(), self._record_frozen("evaluate_adj"):
+                self._frozen.evaluate_adj(sweep, markings=markings)
+            return
+        for i in sweep:
             self._blocks[i].evaluate_adj(markings=markings)
 
-    def evaluate_tlm(self):
-        for i in self._bar("Evaluating TLM").iter(
-            range(len(self._blocks))
-        ):
+    def evaluate_adj_batch(self, last_block=0, markings=False, timestep=None):
+        """Run the adjoint sweep for a batch of adjoint values at once.
+
+        The `adj_value` of each block variable holds a batch of adjoint values,
+        see :meth:`Block.evaluate_adj_batch`. The blocks are evaluated through
+        their own methods, also if the tape is frozen.
+        """
+        manager = self._check_manager(timestep, last_block)
+        if manager is not None:
+            return manager.evaluate_adj(markings=markings, sweep="evaluate_adj_batch")
+        if timestep is not None:
+            last_block, stop = self._timestep_range(timestep)
+        else:
+            stop = None
+        if self._parallel():
+            def evaluate(i):
+                self._blocks[i].evaluate_adj_batch(markings=markings)
+            return self._parallel_sweep("Evaluating adjoint", "evaluate_adj_batch", evaluate, last_block,
+                                        len(self._blocks) if stop is None else stop)
+        for i in self._profiled("evaluate_adj_batch", self._reverse_sweep("Evaluating adjoint", last_block, stop)):
+            self._blocks[i].evaluate_adj_batch(markings=markings)
+
+    def evaluate_tlm(self, timestep=None):
+        manager = self._check_manager(timestep)
+        if manager is not None:
+            return manager.evaluate_tlm()
+        start, stop = self._timestep_range(timestep)
+        sweep = self._profiled("evaluate_tlm", self._bar("Evaluating TLM").iter(range(start, stop)))
+        if self._frozen is not None:
+            with stop_annotating(), self._record_frozen("evaluate_tlm"):
+                self._frozen.evaluate_tlm(sweep)
+            return
+        for i in sweep:
             self._blocks[i].evaluate_tlm()
 
-    def evaluate_hessian(self, markings=False):
-        for i in self._bar("Evaluating Hessian").iter(
-            range(len(self._blocks) - 1, -1, -1)
-        ):
+    def evaluate_tlm_batch(self, markings=False, timestep=None):
+        """Run the tangent linear sweep for a batch of directions at once.
+
+        The `tlm_value` of each block variable holds a batch of tangent linear
+        values, see :meth:`Block.evaluate_tlm_batch`. The blocks are evaluated
+        through their own methods, also if the tape is frozen.
+        """
+        manager = self._check_manager(timestep)
+        if manager is not None:
+            return manager.evaluate_tlm(markings=markings, sweep="evaluate_tlm_batch")
+        start, stop = self._timestep_range(timestep)
+        for i in self._profiled("evaluate_tlm_batch", self._bar("Evaluating TLM").iter(range(start, stop))):
+            self._blocks[i].evaluate_tlm_batch(markings=markings)
+
+    def evaluate_hessian(self, markings=False, timestep=None):
+        manager = self._check_manager(timestep)
+        if manager is not None:
+            return manager.evaluate_hessian(markings=markings)
+        start, stop = self._timestep_range(timestep)
+        if self._parallel():
+            frozen = self._frozen
+            if frozen is None:
+                def evaluate(i):
+                    self._blocks[i].evaluate_hessian(markings=markings)
+            else:
+                def evaluate(i):
+                    frozen.evaluate_hessian((i,), markings=markings)
+            return self._parallel_sweep("Evaluating Hessian", "evaluate_hessian", evaluate, start, stop)
+        sweep = self._profiled("evaluate_hessian", self._reverse_sweep("Evaluating Hessian", start, stop))
+        if self._frozen is not None:
+            with stop_annotating(), self._record_frozen("evaluate_hessian"):
+                self._frozen.evaluate_hessian(sweep, markings=markings)
+            return
+        for i in sweep:
             self._blocks[i].evaluate_hessian(markings=markings)
 
     def reset_variables(self, types=None):
-        for i in range(len(self._blocks) - 1, -1, -1):
-            self._blocks[i].reset_variables(types)
+        """Reset the adjoint values of the block variables.
+
+        The reset starts a new sweep generation of the tape, after which the
+        values stored in earlier generations read as None. Only the block
+        variables which are also on another tape, and follow the generations
+        of that tape, are reset one by one.
+
+        Args:
+            types (tuple[str]|None): The values to reset, any of "adjoint", "tlm"
+                and "hessian". Defaults to the adjoint values.
+        """
+        types = ("adjoint",) if types is None else types
+        self._follow_variables()
+        self._generations.new(types)
+        for bv in self._shared_variables:
+            bv.reset_variables(types)
 
     def reset_hessian_values(self):
-        for i in range(len(self._blocks) - 1, -1, -1):
-            self._blocks[i].reset_variables(types=("hessian"))
+        """Reset the Hessian values of the block variables, see :meth:`reset_variables`."""
+        self.reset_variables(("hessian",))
 
     def reset_tlm_values(self):
-        for i in range(len(self._blocks) - 1, -1, -1):
-            self._blocks[i].reset_variables(types=("tlm"))
+        """Reset the TLM values of the block variables, see :meth:`reset_variables`."""
+        self.reset_variables(("tlm",))
+
+    def _follow_variables(self):
+        """Make the block variables of the blocks added since the last call follow the sweep generations."""
+        blocks = self._blocks
+        for i in range(self._followed_blocks, len(blocks)):
+            block = blocks[i]
+            for bv in chain(block.get_dependencies(), block.get_outputs()):
+                if not bv._follow(self._generations):
+                    self._shared_variables.add(bv)
+        # Outputs may still be added to the last block.
+        self._followed_blocks = max(len(blocks) - 1, 0)
 
     def copy(self):
         """Returns a shallow copy of the tape.
@@ -263,10 +906,12 @@ class Tape(object):
 
         """
         # TODO: Offer deepcopying. But is it feasible memory wise to copy all checkpoints?
-        return Tape(
+        tape = Tape(
             blocks=self._blocks[:],
             package_data={k: v.copy() for k, v in self._package_data.items()}
         )
+        tape._timestep_ends = self._timestep_ends[:]
+        return tape
 
     def checkpoint_block_vars(self, controls=[], tag=None):
         """Returns an object to checkpoint the current state of all block variables on the tape.
@@ -335,7 +980,7 @@ class Tape(object):
                         raise RuntimeError("Control depends on another control.")
                     nodes.add(output)
                 valid_blocks.append(block)
-        self._blocks = valid_blocks
+        self._remove_blocks(valid_blocks)
 
     def optimize_for_functionals(self, functionals):
         blocks = self.get_blocks()
@@ -352,16 +997,44 @@ class Tape(object):
                 for dep in block.get_dependencies():
                     nodes.add(dep)
                 valid_blocks.append(block)
-        self._blocks = list(reversed(valid_blocks))
+        self._remove_blocks(list(reversed(valid_blocks)))
+
+    def _remove_blocks(self, valid_blocks):
+        """Replace the blocks on the tape by the subsequence `valid_blocks`, keeping the timesteps."""
+        if self._timestep_ends:
+            # Timesteps from which all blocks were removed are kept, but empty.
+            valid = set(valid_blocks)
+            ends = iter(self._timestep_ends)
+            end = next(ends, None)
+            new_ends = []
+            kept = 0
+            for i, block in enumerate(self._blocks):
+                while end is not None and end <= i:
+                    new_ends.append(kept)
+                    end = next(ends, None)
+                if block in valid:
+                    kept += 1
+            while end is not None:
+                new_ends.append(kept)
+                end = next(ends, None)
+            self._timestep_ends = new_ends
+        self._blocks = valid_blocks
+        self._stored_blocks = 0
+        self._structure_changed()
 
     @contextmanager
     def marked_nodes(self, controls):
         nodes = _find_relevant_nodes(self, controls)
         for node in nodes:
             node.marked_in_path = True
+        frozen = self._frozen
+        if frozen is not None:
+            previous = frozen.mark(nodes)
         yield
         for node in nodes:
             node.marked_in_path = False
+        if frozen is not None:
+            frozen.mark(previous)
 
     def _valid_tf_scope_name(self, name):
         """Return a valid TensorFlow scope name"""
@@ -580,6 +1253,136 @@ class Tape(object):
         self._bar = bar
 
 
+class Cone(object):
+    """The part of the tape which depends on a set of block variables.
+
+    Attributes:
+        blocks (list[int]): The sorted indices of the blocks which depend on the
+            block variables.
+        nodes (frozenset[BlockVariable]): The block variables themselves and the
+            outputs of these blocks.
+    """
+    __slots__ = ["blocks", "nodes"]
+
+    def __init__(self, blocks, nodes):
+        self.blocks = blocks
+        self.nodes = nodes
+
+
+class TapeIndex(object):
+    """Adjacency index of the blocks on a tape.
+
+    The index maps each block variable to the block which computes it and to
+    the blocks which depend on it, and memoizes the forward cones of sets of
+    block variables. The tape keeps it up to date: blocks appended to the tape
+    are indexed incrementally, while removing blocks discards the index.
+
+    Args:
+        blocks (list[Block]): The list of blocks on the tape.
+    """
+    __slots__ = ["blocks", "producer", "consumers", "n_indexed", "_cones", "_levels"]
+
+    def __init__(self, blocks):
+        self.blocks = blocks
+        # Map from block variable to the index of the block which computes it.
+        self.producer = {}
+        # Map from block variable to the indices of the blocks which depend on it.
+        self.consumers = {}
+        self.n_indexed = 0
+        self._cones = {}
+        self._levels = {}
+
+    def update(self):
+        """Index the blocks appended since the last update, and the outputs added to the last indexed block."""
+        # Outputs may still have been added to the last indexed block.
+        for i in range(max(self.n_indexed - 1, 0), len(self.blocks)):
+            block = self.blocks[i]
+            for dep in block.get_dependencies():
+                consumers = self.consumers.setdefault(dep, [])
+                if not consumers or consumers[-1] != i:
+                    consumers.append(i)
+            for output in block.get_outputs():
+                if self.producer.get(output) != i:
+                    self.producer[output] = i
+                    if i < self.n_indexed:
+                        self.clear_cache()
+        self.n_indexed = len(self.blocks)
+
+    def clear_cache(self):
+        """Forget the memoized cones and levels."""
+        if self._cones:
+            self._cones = {}
+        if self._levels:
+            self._levels = {}
+
+    def block_consumers(self, i):
+        """Return the sorted indices of the blocks which depend on an output of block `i`."""
+        return sorted({j for output in self.blocks[i].get_outputs()
+                       for j in self.consumers.get(output, ())})
+
+    def reverse_levels(self, start, stop):
+        """Group the blocks in ``range(start, stop)`` into levels for a reverse sweep.
+
+        The first level consists of the blocks whose outputs are not used by
+        any other block in the range, and each following level of the blocks
+        whose outputs are only used by blocks in earlier levels. The blocks of
+        a level can therefore be evaluated in any order, or concurrently.
+        The result is memoized until blocks are added to or removed from the tape.
+
+        Returns:
+            list[list[int]]: The block indices of each level, in descending order.
+        """
+        try:
+            return self._levels[start, stop]
+        except KeyError:
+            pass
+        level = {}
+        levels = []
+        for i in range(stop - 1, start - 1, -1):
+            n = 0
+            for output in self.blocks[i].get_outputs():
+                for j in self.consumers.get(output, ()):
+                    if i < j < stop:
+                        n = max(n, level[j] + 1)
+            level[i] = n
+            if n == len(levels):
+                levels.append([])
+            levels[n].append(i)
+        self._levels[start, stop] = levels
+        return levels
+
+    def forward_cone(self, block_variables):
+        """Return the :class:`Cone` of the blocks which depend on `block_variables`.
+
+        Only the dependent part of the tape is visited, and the result is
+        memoized until blocks are added to or removed from the tape.
+
+        Args:
+            block_variables (frozenset[BlockVariable]): The block variables.
+
+        Returns:
+            Cone: The dependent blocks and block variables.
+        """
+        try:
+            return self._cones[block_variables]
+        except KeyError:
+            pass
+        nodes = set(block_variables)
+        blocks = set()
+        stack = list(block_variables)
+        while stack:
+            for i in self.consumers.get(stack.pop(), ()):
+                if i not in blocks:
+                    blocks.add(i)
+                    for output in self.blocks[i].get_outputs():
+                        if output not in nodes:
+                            nodes.add(output)
+                            stack.append(output)
+        cone = Cone(sorted(blocks), frozenset(nodes))
+        self._cones[block_variables] = cone
+        return cone
+
+
 class _NullProgressBar:
     """A placeholder class with the same interface as a progress bar."""
 
@@ -0,0 +1,27 @@
+"""This script reports the memory used per block by a tape of AdjFloat operations.
+
+Usage:
+    python scripts/tape_memory_benchmark.py [number of blocks]
+
+"""
+import sys
+import tracemalloc
+
+from pyadjoint import AdjFloat, Tape, set_working_tape, continue_annotation
+
+n_blocks = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+continue_annotation()
+
+tape = Tape()
+with set_working_tape(tape):
+    c = AdjFloat(0.5)
+    tracemalloc.start()
+    x = AdjFloat(1.0)
+    for _ in range(n_blocks):
+        x = x * c
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+assert len(tape.get_blocks()) == n_blocks
+print(f"{n_blocks} blocks: {current / n_blocks:.0f} bytes per block, "
+      f"{peak / n_blocks:.0f} bytes per block at peak")
@@ -0,0 +1,223 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+
+from pyadjoint import *
+from pyadjoint.checkpoint_storage import CheckpointStorage, ArenaCheckpointStorage, StoredCheckpoint, \
+    RAM, COMPRESSED, DISK
+from pyadjoint.checkpoint_codecs import CodecCheckpointStorage, ZlibCodec, LzmaCodec, Float32Codec, QuantizeCodec
+from pyadjoint.checkpointing import Revolve
+from pyadjoint.overloaded_function import overload_function
+from numpy_adjoint import ndarray
+
+
+class ScaleBlock(Block):
+    def __init__(self, x, c):
+        super().__init__()
+        self.add_dependency(x)
+        self.add_dependency(c)
+
+    def evaluate_adj_component(self, inputs, adj_inputs, block_variable, idx, prepared=None):
+        if idx == 0:
+            return adj_inputs[0] * np.cos(inputs[0]) * inputs[1]
+        return AdjFloat(np.dot(adj_inputs[0], np.sin(inputs[0])))
+
+    def recompute_component(self, inputs, block_variable, idx, prepared):
+        return np.sin(inputs[0]) * inputs[1]
+
+
+scale = overload_function(lambda x, c: np.sin(x) * c, ScaleBlock)
+
+
+def model(c, n_steps=30, size=1000):
+    x = create_overloaded_object(np.linspace(0., 1., size))
+    for _ in range(n_steps):
+        x = scale(x, c)
+    return x[size // 2]
+
+
+@pytest.mark.parametrize("options", [
+    dict(memory_budget=20000, policy="lru"),
+    dict(memory_budget=20000, compressed_budget=0, policy="cursor", prefetch=2),
+    dict(memory_budget=0, disk=False),
+])
+def test_checkpoint_storage(options):
+    c = AdjFloat(1.1)
+    J = model(c)
+    Jhat = ReducedFunctional(J, Control(c))
+    expected = (Jhat(AdjFloat(1.2)), Jhat.derivative())
+
+    tape = Tape()
+    with set_working_tape(tape):
+        c = AdjFloat(1.1)
+        storage = CheckpointStorage(**options)
+        tape.set_checkpoint_storage(storage)
+        J = model(c)
+    Jhat = ReducedFunctional(J, Control(c), tape=tape)
+    # The most recently stored checkpoint is always kept in RAM.
+    assert storage.nbytes(RAM) <= options["memory_budget"] + 8000
+    if options.get("disk", True):
+        assert storage.nbytes(DISK) > 0
+        # Arrays on disk are restored as copy-on-write memory maps of their files.
+        block_variable = tape.get_blocks()[0].get_outputs()[0]
+        assert block_variable._checkpoint.entry.tier == DISK
+        value = block_variable.saved_output
+        assert isinstance(value, ndarray) and isinstance(value.base, np.memmap)
+        assert value.flags.writeable
+    else:
+        assert storage.nbytes(COMPRESSED) > 0
+
+    assert_allclose(Jhat(AdjFloat(1.2)), expected[0])
+    assert_allclose(Jhat.derivative(), expected[1])
+    assert storage.nbytes(RAM) <= options["memory_budget"] + 8000
+    assert isinstance(tape.get_blocks()[0].get_outputs()[0]._checkpoint, StoredCheckpoint)
+
+
+def test_checkpoint_storage_with_schedule():
+    c = AdjFloat(1.1)
+    J = model(c)
+    Jhat = ReducedFunctional(J, Control(c))
+    expected = (Jhat(AdjFloat(1.2)), Jhat.derivative())
+
+    tape = Tape()
+    with set_working_tape(tape):
+        c = AdjFloat(1.1)
+        J = model(c)
+    storage = CheckpointStorage(memory_budget=20000)
+    tape.set_checkpoint_storage(storage)
+    tape.enable_checkpointing(Revolve(4))
+    Jhat = ReducedFunctional(J, Control(c), tape=tape)
+    n_stored = len(storage)
+
+    assert_allclose(Jhat(AdjFloat(1.2)), expected[0])
+    # Checkpoints dropped by the schedule are released from the storage.
+    assert len(storage) < n_stored
+    assert_allclose(Jhat.derivative(), expected[1])
+    assert all(not isinstance(block.get_outputs()[0]._checkpoint, np.ndarray)
+               for block in tape.get_blocks()[:-1])
+
+
+def test_parallel_sweep_moves_cursor():
+    class RecordingStorage(CheckpointStorage):
+        positions = []
+
+        def move_cursor(self, position, blocks):
+            self.positions.append(position)
+            super().move_cursor(position, blocks)
+
+    tape = Tape()
+    with set_working_tape(tape):
+        c = AdjFloat(1.1)
+        storage = RecordingStorage(memory_budget=20000, policy="cursor", prefetch=2)
+        tape.set_checkpoint_storage(storage)
+        J = model(c, n_steps=10) + model(c, n_steps=10, size=500)
+    Jhat = ReducedFunctional(J, Control(c), tape=tape)
+    expected = Jhat.derivative()
+
+    tape.enable_parallel_adjoint(2)
+    storage.positions = []
+    assert_allclose(Jhat.derivative(), expected)
+    # The cursor is moved to the smallest block index of each level, and reset at the end.
+    levels = tape._get_index().reverse_levels(0, len(tape.get_blocks()))
+    assert storage.positions == [min(level) for level in levels] + [None]
+    assert storage.cursor is None
+    tape.enable_parallel_adjoint(None)
+
+
+def test_arena_checkpoint_storage():
+    def record(storage=None):
+        tape = Tape()
+        with set_working_tape(tape):
+            c = AdjFloat(1.1)
+            if storage is not None:
+                tape.set_checkpoint_storage(storage)
+            J = model(c, n_steps=10)
+            for _ in range(10):
+                J = J * c
+        return ReducedFunctional(J, Control(c), tape=tape), tape
+
+    Jhat, _ = record()
+    expected = [(Jhat(AdjFloat(c)), Jhat.derivative()) for c in (1.2, 1.3, 1.4)]
+
+    storage = ArenaCheckpointStorage(column_size=4, compaction_threshold=0)
+    Jhat, tape = record(storage)
+    assert storage.nbytes(DISK) == 10 * 8000
+    # Checkpoints are restored as read-only views of the memory-mapped arena.
+    value = tape.get_blocks()[0].get_outputs()[0].saved_output
+    assert isinstance(value, ndarray)
+    assert not value.flags.writeable
+    assert isinstance(value.base, np.memmap)
+
+    for c, (J, dJdc) in zip((1.2, 1.3, 1.4), expected):
+        assert_allclose(Jhat(AdjFloat(c)), J)
+        assert_allclose(Jhat.derivative(), dJdc)
+    # The recomputed floats are stored in the float column, of which at most
+    # one chunk is held in RAM.
+    assert len(storage) == 10 + 10 + 1
+    assert storage.nbytes(RAM) < 8 * 4
+    # The checkpoints of earlier evaluations are compacted away.
+    assert storage._arena.size < 2 * storage.nbytes()
+
+
+def test_arena_float_release_before_flush():
+    storage = ArenaCheckpointStorage(column_size=4, compaction_threshold=0)
+
+    def store(value):
+        block_variable = AdjFloat(value).create_block_variable()
+        block_variable._checkpoint = float(value)
+        storage.store(block_variable)
+        return block_variable
+
+    block_variables = [store(1.0), store(2.0)]
+    # A float checkpoint released before its chunk is appended to the arena.
+    block_variables.pop()._checkpoint = None
+    block_variables += [store(3.0), store(4.0), store(5.0)]
+    assert len(storage._chunks) == 1
+    assert storage._chunk_counts == [3]
+    assert [bv.saved_output for bv in block_variables] == [1.0, 3.0, 4.0, 5.0]
+
+    # Once its remaining checkpoints are released, compaction reclaims the chunk.
+    for bv in block_variables[:3]:
+        bv._checkpoint = None
+    assert storage._chunk_counts == [0]
+    store(6.0)
+    assert storage._chunks == [(None, None)]
+    assert storage._arena.size == 0
+    assert block_variables[3].saved_output == 5.0
+
+
+@pytest.mark.parametrize("codec, rtol, ratio", [
+    (ZlibCodec(), 1e-12, 1.0),
+    (LzmaCodec(), 1e-12, 1.0),
+    (Float32Codec(), 1e-5, 2.0),
+    (QuantizeCodec(1e-8), 1e-5, 2.0),
+])
+@pytest.mark.parametrize("workers", [0, 2])
+def test_codec_checkpoint_storage(codec, rtol, ratio, workers):
+    c = AdjFloat(1.1)
+    J = model(c)
+    Jhat = ReducedFunctional(J, Control(c))
+    expected = (Jhat(AdjFloat(1.2)), Jhat.derivative())
+
+    tape = Tape()
+    with set_working_tape(tape):
+        c = AdjFloat(1.1)
+        J = model(c)
+    # The blocks tagged "exact" are not encoded.
+    for block in tape.get_blocks()[::3]:
+        block.tag = "exact"
+    storage = CodecCheckpointStorage(codec, codecs={"exact": None}, workers=workers)
+    tape.set_checkpoint_storage(storage)
+    Jhat = ReducedFunctional(J, Control(c), tape=tape)
+
+    assert_allclose(Jhat(AdjFloat(1.2)), expected[0], rtol=rtol)
+    assert_allclose(Jhat.derivative(), expected[1], rtol=rtol)
+    storage.wait()
+    assert len(storage) == 20
+    assert storage.nbytes(RAM) == 0
+    ratios = storage.compression_ratios()
+    assert list(ratios) == [None]
+    assert ratios[None] >= ratio
+    assert not isinstance(tape.get_blocks()[0].get_outputs()[0]._checkpoint, StoredCheckpoint)
+    assert isinstance(tape.get_blocks()[1].get_outputs()[0].saved_output, ndarray)
+    assert min(taylor_test(Jhat, AdjFloat(1.2), AdjFloat(1.0)), 2.0) > 1.9
@@ -0,0 +1,155 @@
+import pytest
+
+from numpy.testing import assert_allclose
+from pyadjoint import *
+from pyadjoint.checkpointing import Revolve, Forward, Reverse, Snapshot, Free
+
+
+def model(c, n_steps=20):
+    x = AdjFloat(1.0)
+    for _ in range(n_steps):
+        x = x + 0.1 * (c - x * x)
+    return x ** 2
+
+
+def held_checkpoints(tape):
+    return sum(output._checkpoint is not None
+               for block in tape.get_blocks()
+               for output in block.get_outputs())
+
+
+@pytest.mark.parametrize("snapshots", [0, 1, 3, 10])
+def test_revolve_gradient(snapshots):
+    c = AdjFloat(2.0)
+    J = model(c)
+    Jhat = ReducedFunctional(J, Control(c))
+    expected = (Jhat(AdjFloat(3.0)), Jhat.derivative(), Jhat.hessian(AdjFloat(1.0)))
+
+    tape = Tape()
+    with set_working_tape(tape):
+        c = AdjFloat(2.0)
+        J = model(c)
+    tape.enable_checkpointing(Revolve(snapshots))
+    Jhat = ReducedFunctional(J, Control(c), tape=tape)
+    n_outputs = held_checkpoints(tape)
+
+    assert_allclose(Jhat(AdjFloat(3.0)), expected[0])
+    assert held_checkpoints(tape) < n_outputs / 2
+    assert_allclose(Jhat.derivative(), expected[1])
+    assert_allclose(Jhat.derivative(), expected[1])
+    assert_allclose(Jhat.hessian(AdjFloat(1.0)), expected[2])
+
+    assert_allclose(Jhat(AdjFloat(2.0)), J)
+    assert taylor_test(Jhat, c, AdjFloat(1.0)) > 1.9
+
+
+def optimal_recomputations(n_steps, snapshots, cache={}):
+    """Return the smallest total number of recomputed steps to reverse `n_steps` steps."""
+    if n_steps == 1:
+        return 0
+    if snapshots == 0:
+        return n_steps * (n_steps - 1) // 2
+    if (n_steps, snapshots) not in cache:
+        cache[(n_steps, snapshots)] = min(
+            m + optimal_recomputations(n_steps - m, snapshots - 1) + optimal_recomputations(m, snapshots)
+            for m in range(1, n_steps))
+    return cache[(n_steps, snapshots)]
+
+
+def test_revolve_schedule():
+    snapshots = 2
+    n_steps = 10
+    actions = list(Revolve(snapshots).actions(n_steps))
+
+    reversed_steps = [a.n for a in actions if isinstance(a, Reverse)]
+    assert reversed_steps == list(range(n_steps - 1, -1, -1))
+
+    # The binomial schedule reverses 10 steps with 2 snapshots using at most
+    # 3 recomputations of each step.
+    counts = [0] * n_steps
+    for a in actions:
+        if isinstance(a, Forward):
+            for n in range(a.n0, a.n1):
+                counts[n] += 1
+    assert max(counts) <= 3
+
+
+@pytest.mark.parametrize("snapshots", [0, 1, 2, 3, 5])
+@pytest.mark.parametrize("n_steps", [1, 2, 5, 10, 23, 40])
+def test_revolve_optimal(snapshots, n_steps):
+    live = set()
+    peak = 0
+    recomputed = 0
+    for a in Revolve(snapshots).actions(n_steps):
+        if isinstance(a, Forward):
+            assert a.n0 == 0 or a.n0 in live
+            recomputed += a.n1 - a.n0
+        elif isinstance(a, Snapshot):
+            live.add(a.n)
+            peak = max(peak, len(live))
+        elif isinstance(a, Free):
+            live.remove(a.n)
+    assert not live
+    assert peak <= snapshots
+    assert recomputed == optimal_recomputations(n_steps, snapshots)
+    # E.g. 10 steps take 45 recomputed steps without snapshots, 20 with one
+    # and 15 with two.
+    if n_steps == 10 and snapshots <= 2:
+        assert recomputed == [45, 20, 15][snapshots]
+
+
+def timestepping_model(tape, c, n_steps=20):
+    x = AdjFloat(1.0)
+    y = AdjFloat(0.0)
+    for _ in tape.timestepper(range(n_steps)):
+        x_new = x + 0.1 * (c - x * y)
+        y = y + 0.1 * x
+        x = x_new
+    return x ** 2 + y
+
+
+def test_timesteps():
+    tape = get_working_tape()
+    c = AdjFloat(2.0)
+    J = timestepping_model(tape, c, n_steps=5)
+
+    assert tape.latest_timestep == 5
+    timesteps = tape.get_timesteps()
+    assert len(timesteps) == 6
+    assert [len(r) for r in timesteps] == [6, 6, 6, 6, 6, 2]
+    assert tape.get_timestep_blocks(1) == tape.get_blocks()[6:12]
+
+    # Sweeping the timesteps one by one is equivalent to sweeping the tape.
+    tape.reset_variables()
+    J.block_variable.adj_value = 1.0
+    for n in reversed(range(len(timesteps))):
+        tape.evaluate_adj(timestep=n)
+    dJdc = Control(c).get_derivative()
+    assert_allclose(dJdc, compute_gradient(J, Control(c)))
+
+    Jhat = ReducedFunctional(J, Control(c))
+    Jhat.optimize_tape()
+    assert tape.latest_timestep == 5
+    assert sum(len(r) for r in tape.get_timesteps()) == len(tape.get_blocks())
+    assert_allclose(Jhat.derivative(), dJdc)
+
+
+def test_revolve_timesteps():
+    c = AdjFloat(2.0)
+    J = timestepping_model(get_working_tape(), c)
+    Jhat = ReducedFunctional(J, Control(c))
+    expected = (Jhat(AdjFloat(3.0)), Jhat.derivative())
+
+    tape = Tape()
+    with set_working_tape(tape):
+        c = AdjFloat(2.0)
+        J = timestepping_model(tape, c)
+    tape.enable_checkpointing(Revolve(2))
+    Jhat = ReducedFunctional(J, Control(c), tape=tape)
+    n_outputs = held_checkpoints(tape)
+
+    assert_allclose(Jhat(AdjFloat(3.0)), expected[0])
+    assert held_checkpoints(tape) < n_outputs / 4
+    assert_allclose(Jhat.derivative(), expected[1])
+    with pytest.raises(ValueError):
+        tape.evaluate_adj(timestep=0)
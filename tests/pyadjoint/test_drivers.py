@@ -0,0 +1,81 @@
+import numpy
+from numpy.testing import assert_allclose
+
+from pyadjoint import *
+from pyadjoint import drivers
+from pyadjoint.drivers import _color
+
+
+def test_color():
+    # Columns 0 and 1 share row 0, column 2 only shares rows with itself.
+    colors, n_colors = _color([{0, 1}, {1}, {2}], 3)
+    assert colors == [0, 1, 0]
+    assert n_colors == 2
+    assert _color([set(), {1}], 2) == ([None, 0], 1)
+
+
+def test_compute_jacobian():
+    x = [AdjFloat(float(i + 1)) for i in range(6)]
+    J = [x[0] * x[1], x[1] + x[2] ** 2, x[3] * x[4], x[5] / x[0]]
+    controls = [Control(xi) for xi in x]
+    expected = numpy.array([compute_gradient(Ji, controls) for Ji in J], dtype=float)
+
+    jacobian = compute_jacobian(J, controls)
+    assert jacobian.nnz == 8
+    assert_allclose(jacobian.toarray(), expected)
+    assert_allclose(compute_jacobian(J, controls, sparse=False), expected)
+    # More functionals than controls are evaluated in forward mode.
+    assert_allclose(compute_jacobian(J, controls[:2], sparse=False), expected[:, :2])
+
+
+def test_compute_hessian_matrix():
+    x = [AdjFloat(float(i + 1)) for i in range(5)]
+    J = x[0] ** 2 * x[1] + x[2] * x[3] + x[4] ** 3 + (x[4] - x[0])
+    controls = [Control(xi) for xi in x]
+
+    hessian = compute_hessian_matrix(J, controls)
+    expected = numpy.zeros((5, 5))
+    expected[0, 0] = 2 * 2.0
+    expected[0, 1] = expected[1, 0] = 2 * 1.0
+    expected[2, 3] = expected[3, 2] = 1.0
+    expected[4, 4] = 6 * 5.0
+    # The pattern is structural: the diagonal entries of x[1], x[2] and x[3] are stored.
+    assert hessian.nnz == 9
+    assert_allclose(hessian.toarray(), expected)
+    assert_allclose(compute_hessian_matrix(J, controls[2:], sparse=False), expected[2:, 2:])
+
+
+def test_compute_jacobian_array_control(monkeypatch):
+    import numpy_adjoint  # noqa: F401
+
+    n = 20
+    xs = numpy.linspace(1.0, 2.0, n)
+    x = create_overloaded_object(xs)
+    y = x[:-2] - 2.0 * x[1:-1] + x[2:] ** 2
+    J = [y[i] for i in range(n - 2)]
+    control = Control(x)
+    expected = numpy.array([compute_gradient(Ji, control) for Ji in J])
+
+    # The banded Jacobian of the single array control needs one direction per
+    # diagonal, not one per entry.
+    widths = []
+    compute_tlm_batch = drivers.compute_tlm_batch
+    monkeypatch.setattr(drivers, "compute_tlm_batch",
+                        lambda J, m, directions, tape=None: widths.append(len(directions))
+                        or compute_tlm_batch(J, m, directions, tape=tape))
+    jacobian = compute_jacobian(J, control)
+    assert widths == [3]
+    assert jacobian.nnz == 3 * (n - 2)
+    assert_allclose(jacobian.toarray(), expected)
+
+    # The tridiagonal Hessian needs three Hessian actions.
+    H = numpy.sum(x ** 3) + numpy.sum(x[:-1] * x[1:])
+    actions = []
+    compute_hessian = drivers.compute_hessian
+    monkeypatch.setattr(drivers, "compute_hessian",
+                        lambda *args, **kwargs: actions.append(args) or compute_hessian(*args, **kwargs))
+    hessian = compute_hessian_matrix(H, control)
+    assert len(actions) == 3
+    expected = numpy.diag(6 * xs) + numpy.diag(numpy.ones(n - 1), 1) + numpy.diag(numpy.ones(n - 1), -1)
+    assert hessian.nnz == 3 * n - 2
+    assert_allclose(hessian.toarray(), expected)
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+
+from pyadjoint import *
+import numpy_adjoint  # noqa: F401
+
+
+def scenario(member):
+    # Each member fits the controls to its own observation.
+    target, weight = member
+    x = create_overloaded_object(np.array([1.0, 2.0]))
+    c = AdjFloat(0.5)
+    r0 = x[0] - target
+    r1 = x[1] * c - target
+    J = r0 * r0 * weight + r1 * r1
+    return J, [Control(x), Control(c)]
+
+
+def serial(members, m):
+    x0, x1, c = m
+    J = sum((x0 - t) ** 2 * w + (x1 * c - t) ** 2 for t, w in members)
+    dJ = [sum(2 * (x0 - t) * w for t, w in members),
+          sum(2 * (x1 * c - t) * c for t, w in members),
+          sum(2 * (x1 * c - t) * x1 for t, w in members)]
+    return J, np.array(dJ)
+
+
+def failing(member):
+    raise ValueError("no member %s" % member)
+
+
+def test_ensemble_reduced_functional():
+    members = [(1.0, 1.0), (2.0, 3.0), (4.0, 0.5), (-1.0, 2.0), (0.0, 1.0)]
+    with EnsembleReducedFunctional(scenario, members, processes=2) as Jhat:
+        assert_allclose(Jhat.get_controls(), [1.0, 2.0, 0.5])
+        assert [control.size for control in Jhat.controls] == [2, 1]
+
+        for m in [np.array([1.0, 2.0, 0.5]), np.array([0.5, -1.0, 2.0])]:
+            value, gradient = serial(members, m)
+            assert_allclose(Jhat(m), value)
+            assert_allclose(Jhat.derivative(), gradient)
+            fused_value, fused_gradient = Jhat.value_and_gradient(m)
+            assert_allclose(fused_value, value)
+            assert_allclose(fused_gradient, gradient)
+
+        # A Hessian action by finite differences of the derivative.
+        m = np.array([0.3, 0.2, 1.5])
+        m_dot = np.array([1.0, -2.0, 0.5])
+        eps = 1e-6
+        fd = (serial(members, m + eps * m_dot)[1] - serial(members, m - eps * m_dot)[1]) / (2 * eps)
+        assert_allclose(Jhat.hessian(m, m_dot), fd, rtol=1e-6)
+
+        opt = minimize(Jhat, options={"disp": False})
+        assert_allclose(Jhat.derivative(np.concatenate(opt)), 0.0, atol=1e-4)
+    with pytest.raises(RuntimeError):
+        Jhat(m)
+
+
+def test_ensemble_worker_error():
+    with pytest.raises(RuntimeError, match="no member"):
+        EnsembleReducedFunctional(failing, [0, 1], processes=2)
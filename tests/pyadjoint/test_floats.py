@@ -281,3 +281,117 @@ def test_float_components_minimize():
         z = minimize(rf)
         assert(z[1] == 1.0)
         assert(abs(z[0] + z[1]) < 5.0e-3)
+
+
+def test_mul_hessian():
+    a = AdjFloat(0.5)
+    J = (3.0 * a + 1.0) * a
+    Jhat = ReducedFunctional(J, Control(a))
+    assert Jhat.derivative() == 4.0
+    assert Jhat.hessian(AdjFloat(1.0)) == 6.0
+
+
+@pytest.mark.parametrize("min_width", [1, 16, 1000])
+def test_vectorized_tape(min_width, monkeypatch):
+    from numpy.testing import assert_allclose
+    from pyadjoint.adjfloat import VectorizedFloatTape, min, max
+
+    def model(a, b):
+        terms = [(a * i - b) ** 2 / (1.0 + a * b) - max(a, AdjFloat(0.1 * i)) for i in range(40)]
+        x = min(a, b)
+        for term in terms:
+            x = -x * 0.5 + term
+        return x ** 2
+
+    values = [AdjFloat(1.5), AdjFloat(0.5)]
+    h = [AdjFloat(0.3), AdjFloat(-1.0)]
+    set_working_tape(Tape())
+    a, b = AdjFloat(2.0), AdjFloat(3.0)
+    Jhat = ReducedFunctional(model(a, b), [Control(a), Control(b)])
+    expected = (Jhat(values), Jhat.derivative(), Jhat.hessian(h))
+
+    tape = Tape()
+    with set_working_tape(tape):
+        a, b = AdjFloat(2.0), AdjFloat(3.0)
+        J = model(a, b)
+    Jhat = ReducedFunctional(J, [Control(a), Control(b)], tape=tape)
+    monkeypatch.setattr(VectorizedFloatTape, "min_width", min_width)
+    frozen = tape.freeze(vectorize=True)
+    assert isinstance(frozen, VectorizedFloatTape)
+
+    assert_allclose(Jhat(values), expected[0])
+    assert_allclose(Jhat.derivative(), expected[1])
+    assert_allclose(Jhat.hessian(h), expected[2])
+    assert_allclose(Jhat(values), expected[0])
+    assert_allclose(Jhat([AdjFloat(2.0), AdjFloat(3.0)]), J)
+    assert taylor_test(Jhat, [a, b], h) > 1.9
+
+    tape.add_block(Block())
+    with pytest.raises(ValueError):
+        tape.freeze(vectorize=True)
+
+
+def test_batched_tlm():
+    from numpy import cos, sin
+    from numpy.testing import assert_allclose
+    from pyadjoint.overloaded_function import overload_function
+
+    class SinBlock(Block):
+        # Only implements the single direction tangent linear model.
+        def __init__(self, x, **kwargs):
+            super().__init__(**kwargs)
+            self.add_dependency(x)
+
+        def evaluate_tlm_component(self, inputs, tlm_inputs, block_variable, idx, prepared=None):
+            return cos(inputs[0]) * tlm_inputs[0]
+
+        def recompute_component(self, inputs, block_variable, idx, prepared):
+            return sin(inputs[0])
+
+    ad_sin = overload_function(lambda x: AdjFloat(sin(x)), SinBlock)
+    a = AdjFloat(2.0)
+    b = AdjFloat(3.0)
+    J = ad_sin(a * b) / (1.0 + b) - b ** a + (-a) ** 2.0
+    directions = [[AdjFloat(1.0), AdjFloat(0.0)], [AdjFloat(0.0), AdjFloat(1.0)], [AdjFloat(0.5), AdjFloat(-2.0)]]
+
+    tlm = compute_tlm_batch(J, [Control(a), Control(b)], directions)
+    assert tlm.shape == (3,)
+    for i, direction in enumerate(directions):
+        compute_tlm_batch(J, [Control(a), Control(b)], [direction])
+        da = 3.0 * cos(6.0) / 4.0 - log(3.0) * 9.0 + 4.0
+        db = 2.0 * cos(6.0) / 4.0 - sin(6.0) / 16.0 - 2.0 * 3.0
+        assert_allclose(tlm[i], da * direction[0] + db * direction[1])
+        assert_allclose(J.block_variable.tlm_value, [tlm[i]])
+
+
+def test_batched_adjoint():
+    from numpy import array, cos, sin
+    from numpy.testing import assert_allclose
+    from pyadjoint.overloaded_function import overload_function
+
+    class SinBlock(Block):
+        # Only implements the adjoint of a single functional.
+        def __init__(self, x, **kwargs):
+            super().__init__(**kwargs)
+            self.add_dependency(x)
+
+        def evaluate_adj_component(self, inputs, adj_inputs, block_variable, idx, prepared=None):
+            return cos(inputs[0]) * adj_inputs[0]
+
+        def recompute_component(self, inputs, block_variable, idx, prepared):
+            return sin(inputs[0])
+
+    ad_sin = overload_function(lambda x: AdjFloat(sin(x)), SinBlock)
+    a = AdjFloat(2.0)
+    b = AdjFloat(3.0)
+    J1 = ad_sin(a * b) / (1.0 + b) - b ** a
+    J2 = a * a * b
+    J3 = 2.0 * J1 + ad_sin(J2)
+    functionals = [J1, J2, J3]
+    controls = [Control(a), Control(b)]
+
+    expected = [compute_gradient(J, controls) for J in functionals]
+    assert_allclose(compute_gradient(functionals, controls), expected)
+    assert_allclose(compute_gradient(functionals, controls, adj_value=[1.0, 2.0, -1.0]),
+                    [expected[0], 2.0 * array(expected[1]), -array(expected[2])])
+    assert_allclose(compute_gradient([J2], controls[1]), [expected[1][1]])
@@ -0,0 +1,182 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+
+from pyadjoint import *
+from pyadjoint.reduced_functional_numpy import ReducedFunctionalNumPy
+import numpy_adjoint  # noqa: F401
+
+
+def in_place(x, y):
+    z = x * y
+    z *= x
+    z += 1.0
+    return np.sum(np.sqrt(z))
+
+
+@pytest.mark.parametrize("model, shapes", [
+    (lambda x: np.sum(np.sin(x) * x), [(5,)]),
+    (lambda x, y: np.sum(x ** 2 / y + np.exp(y) - np.log1p(x)), [(5,), (5,)]),
+    (lambda x, a: np.sum(np.tanh(x * a) ** 3), [(5,), ()]),
+    (lambda x, y: np.sum(np.maximum(x, y) * np.power(x, y) + np.arctan(x - y)), [(5,), (5,)]),
+    (lambda x, y: np.sum(x[:, None] * y), [(3,), (4,)]),
+    (lambda A, x: np.dot(np.dot(A, x), np.dot(A, x)), [(3, 4), (4,)]),
+    (lambda A, B: np.sum(np.square(A @ B)), [(2, 3, 4), (4, 2)]),
+    (lambda A, B: np.einsum("ij,jk->", A, B) * np.einsum("ij,ik", A, A).sum(), [(3, 4), (4, 2)]),
+    (lambda A: np.einsum("i...j,j->...", A, np.ones(3)) @ np.einsum("ijk->k", A), [(2, 3, 3)]),
+    (lambda A: np.sum(np.broadcast_to(A, (3, 2, 4)) ** 3), [(2, 4)]),
+    (lambda A: np.mean(np.log(A), axis=0) @ A.sum(axis=1, keepdims=True)[:, 0][1:], [(5, 4)]),
+    (in_place, [(4,), (4,)]),
+    (lambda A: np.sum(np.sin(np.reshape(A, (4, 3))) * A.T.ravel().reshape(4, 3, order="F")), [(3, 4)]),
+    (lambda A, x: np.sum(np.transpose(A, (1, 0, 2)).copy() ** 2 @ x) + np.sum(np.copy(A).flatten() ** 3),
+     [(2, 3, 4), (4,)]),
+])
+def test_ufunc_derivatives(model, shapes):
+    rng = np.random.default_rng(0)
+    controls = [create_overloaded_object(rng.uniform(0.5, 1.5, shape)) if shape else
+                AdjFloat(rng.uniform(0.5, 1.5)) for shape in shapes]
+    J = model(*controls)
+    # Each array operation is recorded as a single block.
+    assert len(get_working_tape().get_blocks()) <= 10
+    Jhat = ReducedFunctionalNumPy(J, [Control(c) for c in controls])
+
+    m = Jhat.get_controls()
+    dm = rng.normal(size=m.size)
+    eps = 1e-6
+    fd = (Jhat(m + eps * dm) - Jhat(m - eps * dm)) / (2 * eps)
+    Jhat(m + eps * dm)
+    gradient_plus = Jhat.derivative()
+    Jhat(m - eps * dm)
+    gradient_minus = Jhat.derivative()
+    Jhat(m)
+    assert_allclose(Jhat.derivative() @ dm, fd, rtol=1e-6)
+    assert_allclose(Jhat.hessian(m, dm), (gradient_plus - gradient_minus) / (2 * eps), rtol=1e-5, atol=1e-7)
+
+
+def test_ufunc_annotation():
+    x = create_overloaded_object(np.linspace(1.0, 2.0, 1000))
+    y = np.exp(-x) * x + 2.0
+    # Comparisons and the ufuncs without derivative rules are not recorded.
+    mask = x > 1.5
+    J = np.sum(y[mask])
+    assert isinstance(y, numpy_adjoint.ndarray)
+    assert isinstance(J, AdjFloat)
+    assert not isinstance(mask, OverloadedType)
+    # Reductions of differentiable ufuncs other than sums raise.
+    with pytest.raises(NotImplementedError):
+        y.max()
+    blocks = get_working_tape().get_blocks()
+    assert [str(block) for block in blocks[:4]] == ["numpy.negative", "numpy.exp", "numpy.multiply", "numpy.add"]
+    assert len(blocks) == 6
+
+    Jhat = ReducedFunctional(J, Control(x))
+    dJdx = Jhat.derivative()
+    xs = np.linspace(1.0, 2.0, 1000)
+    assert_allclose(dJdx, np.where(xs > 1.5, np.exp(-xs) * (1.0 - xs), 0.0))
+
+
+def test_reductions():
+    x = create_overloaded_object(np.arange(1.0, 5.0))
+    # The full mean is annotated, also when computed with the array method.
+    J = np.sum(x * x) + np.mean(x * x) + (x * x).mean()
+    assert isinstance(J, AdjFloat)
+    assert_allclose(ReducedFunctional(J, Control(x)).derivative(), 3 * np.arange(1.0, 5.0))
+
+    rng = np.random.default_rng(0)
+    A = create_overloaded_object(rng.uniform(0.5, 1.5, (4, 4)))
+    J = A.dot(x).dot(x) + np.linalg.norm(A) * x.mean() + np.std(A, axis=0) @ x + A.var(ddof=1) \
+        + np.linalg.norm(x, keepdims=True)[0] + np.var(x) * np.std(A)
+    Jhat = ReducedFunctionalNumPy(J, [Control(A), Control(x)])
+    m = Jhat.get_controls()
+    dm = rng.normal(size=m.size)
+    eps = 1e-6
+    fd = (Jhat(m + eps * dm) - Jhat(m - eps * dm)) / (2 * eps)
+    Jhat(m)
+    assert_allclose(Jhat.derivative() @ dm, fd, rtol=1e-6)
+
+    # Functions which are not annotated raise instead of losing the dependency.
+    for f in (np.prod, np.cumsum, lambda x: np.inner(x, x), lambda x: np.linalg.norm(x, ord=1)):
+        with pytest.raises(NotImplementedError):
+            f(x)
+    with stop_annotating():
+        assert_allclose(np.prod(x), 24.0)
+        assert_allclose(x.mean(), 2.5)
+
+
+def test_unannotated_operations_raise():
+    x = create_overloaded_object(np.arange(1.0, 5.0))
+    # Reshapes, transposes and copies are recorded, also as methods.
+    J = np.sum(x.reshape(2, 2).T.copy() * [[1.0, 2.0], [3.0, 4.0]]) + np.sum(np.reshape(x, (4, 1)).ravel() * x)
+    assert_allclose(ReducedFunctional(J, Control(x)).derivative(), [1.0, 3.0, 2.0, 4.0] + 2 * np.arange(1.0, 5.0))
+
+    # The other operations losing the dependency on x raise.
+    operations = [lambda x: x.max(), lambda x: x.prod(), np.max, np.cumsum, lambda x: np.multiply.outer(x, x),
+                  lambda x: np.where(x > 2.0, x, 0.0), lambda x: np.concatenate([x, x]),
+                  lambda x: np.clip(x, 2.0, 3.0), lambda x: np.exp(x, where=x > 2.0),
+                  lambda x: np.squeeze(x[None])]
+    for operation in operations:
+        with pytest.raises(NotImplementedError):
+            operation(x)
+    with stop_annotating():
+        for operation in operations:
+            operation(x)
+
+
+def test_sparse_slice_adjoint():
+    from numpy_adjoint.array import SparseArrayAdjoint
+
+    x = create_overloaded_object(np.arange(1.0, 7.0).reshape(2, 3))
+    J = AdjFloat(0.0)
+    for i in range(2):
+        for j in range(3):
+            J = J + x[i, j] * x[i, j]
+    # Repeated indices contribute once per occurrence.
+    J = J + np.sum(x[:, [0, 0]]) + np.sum(x[1] * x[1])
+
+    tape = get_working_tape()
+    J.block_variable.adj_value = 1.0
+    with stop_annotating():
+        tape.evaluate_adj()
+    # The contributions of the slices are accumulated lazily.
+    assert isinstance(x.block_variable._adj_value, SparseArrayAdjoint)
+    expected = 2 * np.arange(1.0, 7.0).reshape(2, 3) + [[2.0, 0.0, 0.0], [2.0, 0.0, 0.0]] \
+        + [[0.0, 0.0, 0.0], [8.0, 10.0, 12.0]]
+    assert_allclose(x.block_variable.adj_value, expected)
+
+    Jhat = ReducedFunctional(J, Control(x))
+    assert_allclose(Jhat.derivative(), expected)
+    assert_allclose(Jhat.hessian(create_overloaded_object(np.ones((2, 3)))), [[2.0, 2.0, 2.0], [4.0, 4.0, 4.0]])
+
+
+def test_copy_on_write_checkpoints():
+    from numpy_adjoint.array import CopyOnWriteCheckpoint
+
+    xs = np.linspace(0.0, 1.0, 5)
+    x = create_overloaded_object(xs)
+    y = np.exp(x)
+    J = np.sum(y * y)
+    # The checkpoint of y shares its memory, and y stays writable.
+    checkpoint = y.block_variable._checkpoint
+    assert isinstance(checkpoint, CopyOnWriteCheckpoint) and checkpoint.shared
+    assert np.shares_memory(checkpoint.value, y)
+    assert y.flags.writeable
+    assert get_working_tape().memory_report().summary(by=("category",))[0].category == "output"
+    # Writes through numpy_adjoint copy the checkpoint first.
+    y[1:3] *= 2.0
+    assert not checkpoint.shared
+    assert_allclose(checkpoint.value, np.exp(xs))
+    writes = [lambda z: z.__setitem__(Ellipsis, 0.0), lambda z: z.fill(0.0), lambda z: np.copyto(z, 0.0),
+              lambda z: np.multiply(z, 2.0, out=z), lambda z: z[1:3].fill(0.0), lambda z: np.putmask(z, z > 1.5, 0.0)]
+    for write in writes:
+        z = np.exp(x)
+        checkpoint = z.block_variable._checkpoint
+        assert checkpoint.shared
+        write(z)
+        assert not checkpoint.shared
+        assert_allclose(checkpoint.value, np.exp(xs))
+    # Arrays sharing memory with plain numpy arrays are copied.
+    assert not isinstance(x.block_variable._checkpoint, CopyOnWriteCheckpoint)
+
+    Jhat = ReducedFunctional(J, Control(x))
+    assert_allclose(Jhat(x), np.sum(np.exp(2 * xs)))
+    assert_allclose(Jhat.derivative(), 2 * np.exp(2 * xs))
@@ -0,0 +1,232 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+
+from pyadjoint import *
+
+
+class CountingBar:
+    """A progress bar which records the number of blocks in each tape evaluation."""
+    counts = []
+
+    def __init__(self, description, *args, **kwargs):
+        self.description = description
+
+    def iter(self, iterator):
+        iterator = list(iterator)
+        CountingBar.counts.append((self.description, len(iterator)))
+        return iterator
+
+
+def recomputed_blocks():
+    counts = [n for description, n in CountingBar.counts if description == "Evaluating functional"]
+    CountingBar.counts.clear()
+    return sum(counts)
+
+
+def test_incremental_recompute():
+    a = AdjFloat(2.0)
+    b = AdjFloat(3.0)
+    c = AdjFloat(4.0)
+    # 2 blocks depend on a, 3 on b and 1 on both.
+    x = a * a + 1.0
+    y = (b * c - 1.0) / 2.0
+    J = x * y
+
+    tape = get_working_tape()
+    tape.progress_bar = CountingBar
+    Jhat = ReducedFunctional(J, [Control(a), Control(b)], incremental_recompute=True)
+    Jref = ReducedFunctional(J, [Control(a), Control(b)])
+    recomputed_blocks()
+
+    def expected(a, b):
+        return (a * a + 1.0) * (b * 4.0 - 1.0) / 2.0
+
+    assert_allclose(Jhat([AdjFloat(2.0), AdjFloat(3.0)]), expected(2.0, 3.0))
+    assert recomputed_blocks() == 0
+    assert_allclose(Jhat([AdjFloat(5.0), AdjFloat(3.0)]), expected(5.0, 3.0))
+    assert recomputed_blocks() == 3
+    assert_allclose(Jhat([5.0, 1.0]), expected(5.0, 1.0))
+    assert recomputed_blocks() == 4
+    assert_allclose(Jhat([AdjFloat(1.0), AdjFloat(2.0)]), expected(1.0, 2.0))
+    assert recomputed_blocks() == 6
+
+    assert_allclose(Jhat.derivative(), Jref.derivative())
+
+    # Values changed by another functional on the same tape are detected.
+    assert_allclose(Jref([AdjFloat(3.0), AdjFloat(3.0)]), expected(3.0, 3.0))
+    assert_allclose(Jhat([AdjFloat(1.0), AdjFloat(3.0)]), expected(1.0, 3.0))
+    assert_allclose(Jhat([AdjFloat(1.0), AdjFloat(2.0)]), expected(1.0, 2.0))
+
+
+def sweeps(description):
+    counts = [n for d, n in CountingBar.counts if d == description]
+    CountingBar.counts.clear()
+    return len(counts)
+
+
+def test_evaluation_cache():
+    from pyadjoint.reduced_functional_numpy import ReducedFunctionalNumPy
+
+    a = AdjFloat(2.0)
+    b = AdjFloat(3.0)
+    J = a * a * b + b / a
+    tape = get_working_tape()
+    tape.progress_bar = CountingBar
+    controls = [Control(a), Control(b)]
+    Jhat = ReducedFunctional(J, controls, cache_size=2)
+    Jref = ReducedFunctional(J, controls)
+
+    def expected(a, b):
+        return a * a * b + b / a, [2 * a * b - b / a ** 2, a * a + 1 / a]
+
+    points = [[AdjFloat(1.0), AdjFloat(2.0)], [AdjFloat(3.0), AdjFloat(1.0)], [AdjFloat(2.0), AdjFloat(2.0)]]
+    assert_allclose(Jhat(points[0]), expected(1.0, 2.0)[0])
+    assert_allclose(Jhat.derivative(), expected(1.0, 2.0)[1])
+    assert_allclose(Jhat(points[1]), expected(3.0, 1.0)[0])
+    sweeps(None)
+
+    # Revisiting a point restores the tape and the derivative without any sweep.
+    assert_allclose(Jhat(points[0]), expected(1.0, 2.0)[0])
+    assert_allclose(Jhat.derivative(), expected(1.0, 2.0)[1])
+    assert not CountingBar.counts
+    assert_allclose(Jhat.hessian([AdjFloat(1.0), AdjFloat(0.0)]), Jref.hessian([AdjFloat(1.0), AdjFloat(0.0)]))
+    assert_allclose(Jhat.hessian([AdjFloat(1.0), AdjFloat(0.0)]), [2 * 2.0 + 2 * 2.0, 2.0 - 1.0])
+
+    # The least recently used point is evicted.
+    Jhat(points[2])
+    sweeps(None)
+    Jhat(points[0])
+    assert sweeps("Evaluating functional") == 0
+    assert_allclose(Jhat(points[1]), expected(3.0, 1.0)[0])
+    assert sweeps("Evaluating functional") == 1
+
+    # The derivative at a new point needs exactly one forward run.
+    Jnp = ReducedFunctionalNumPy(Jhat)
+    assert_allclose(Jnp.derivative([1.5, 0.5]), expected(1.5, 0.5)[1])
+    assert sweeps("Evaluating functional") == 1
+    assert_allclose(Jnp([1.5, 0.5]), expected(1.5, 0.5)[0])
+    assert sweeps("Evaluating functional") == 0
+
+    # Points whose tape snapshot exceeds the memory budget are not kept.
+    Jsmall = ReducedFunctional(J, controls, cache_size=2, cache_memory=1)
+    Jsmall(points[0])
+    Jsmall(points[0])
+    assert sweeps("Evaluating functional") == 2
+
+
+def array_control_model():
+    import numpy as np
+    import numpy_adjoint  # noqa: F401
+    from numpy_adjoint.array import CopyOnWriteCheckpoint
+
+    # The checkpoint of a ufunc result shares its memory until it is written to.
+    w = np.exp(create_overloaded_object(np.zeros(3)))
+    c = AdjFloat(2.0)
+    J = np.sum(w * w) * c + c * c
+    get_working_tape().progress_bar = CountingBar
+    assert isinstance(w.block_variable._checkpoint, CopyOnWriteCheckpoint)
+    with stop_annotating():
+        point = [np.exp(np.ones(3)), AdjFloat(3.0)]
+    return J, [Control(w), Control(c)], point
+
+
+def test_array_control_incremental_recompute():
+    J, controls, point = array_control_model()
+    Jhat = ReducedFunctional(J, controls, incremental_recompute=True)
+    recomputed_blocks()
+    assert_allclose(Jhat(point), 3 * np.sum(point[0] ** 2) + 9.0)
+    assert recomputed_blocks() == 5
+    # Only the blocks depending on the changed control are recomputed.
+    assert_allclose(Jhat([point[0], AdjFloat(1.0)]), np.sum(point[0] ** 2) + 1.0)
+    assert recomputed_blocks() == 3
+
+
+def test_array_control_cache():
+    J, controls, point = array_control_model()
+    Jhat = ReducedFunctional(J, controls, cache_size=2)
+    assert Jhat._current_key() is not None
+    Jhat(point)
+    assert_allclose(Jhat.derivative()[0], 6.0 * point[0])
+    Jhat([controls[0].control, controls[1].control])
+    sweeps(None)
+    # The derivative at a point evaluated before is cached.
+    Jhat(point)
+    assert_allclose(Jhat.derivative()[0], 6.0 * point[0])
+    assert not CountingBar.counts
+
+
+def test_value_and_gradient():
+    from pyadjoint.reduced_functional_numpy import ReducedFunctionalNumPy
+
+    a = AdjFloat(2.0)
+    b = AdjFloat(3.0)
+    J = (a - 1.0) ** 2 + (b + 2.0) ** 2 * 3.0 + a * b
+    tape = get_working_tape()
+    tape.progress_bar = CountingBar
+    Jhat = ReducedFunctional(J, [Control(a), Control(b)])
+
+    value, gradient = ReducedFunctionalNumPy(Jhat).value_and_gradient([1.0, 1.0])
+    assert_allclose(value, 0.0 + 27.0 + 1.0)
+    assert_allclose(gradient, [0.0 + 1.0, 18.0 + 1.0])
+
+    CountingBar.counts.clear()
+    opt = minimize(Jhat, value_and_gradient=True, options={"disp": False})
+    # Each point is recomputed once, together with one adjoint sweep.
+    descriptions = [d for d, n in CountingBar.counts]
+    assert descriptions.count("Evaluating functional") == descriptions.count("Evaluating adjoint") > 0
+    # The minimum solves 2(a - 1) + b = 0 and 6(b + 2) + a = 0.
+    assert_allclose([float(x) for x in opt], [24.0 / 11.0, -26.0 / 11.0], rtol=1e-5)
+
+
+def test_flat_control_views():
+    import numpy as np
+    import numpy_adjoint  # noqa: F401
+    from pyadjoint.reduced_functional_numpy import ReducedFunctionalNumPy
+
+    x = create_overloaded_object(np.array([[1.0, 2.0], [3.0, 4.0]]))
+    c = AdjFloat(2.0)
+    J = x[0, 0] * c + x[1, 1] ** 2 + x[0, 1] * x[1, 0]
+    Jhat = ReducedFunctionalNumPy(J, [Control(x), Control(c)])
+    assert_allclose(Jhat.get_controls(), [1.0, 2.0, 3.0, 4.0, 2.0])
+
+    m = np.array([1.0, 2.0, 3.0, 4.0, 3.0])
+    # Array controls are unpacked as views of a copy of the flat control vector.
+    m_reused = m.copy()
+    values = Jhat.set_local([None, None], m_reused)
+    assert not np.shares_memory(values[0], m_reused)
+    assert values[0].shape == (2, 2)
+    assert float(values[1]) == 3.0
+    # Writing to the flat control vector changes neither the unpacked nor the taped controls.
+    m_reused[:] = 0.0
+    assert_allclose(values[0], [[1.0, 2.0], [3.0, 4.0]])
+    assert_allclose(Jhat.rf(values), 3.0 + 16.0 + 6.0)
+    assert_allclose(Jhat.get_controls(), [1.0, 2.0, 3.0, 4.0, 3.0])
+
+    assert_allclose(Jhat(m), 3.0 + 16.0 + 6.0)
+    assert_allclose(Jhat.derivative(m), [3.0, 3.0, 2.0, 8.0, 1.0])
+    assert_allclose(Jhat.hessian(m, np.array([0.0, 0.0, 0.0, 1.0, 0.0])), [0.0, 0.0, 0.0, 2.0, 0.0])
+    # The tape keeps its own copy of the control values.
+    m[:] = 0.0
+    assert_allclose(Jhat.get_controls(), [1.0, 2.0, 3.0, 4.0, 3.0])
+
+
+def test_numpy_derivative_at_new_point():
+    from pyadjoint.reduced_functional_numpy import ReducedFunctionalNumPy
+
+    a = AdjFloat(2.0)
+    b = AdjFloat(3.0)
+    J = a * a * b
+    Jhat = ReducedFunctionalNumPy(J, [Control(a), Control(b)])
+    get_working_tape().progress_bar = CountingBar
+    CountingBar.counts.clear()
+
+    # The derivative at a point which was never evaluated recomputes the tape first.
+    assert_allclose(Jhat.derivative(np.array([1.0, 5.0])), [10.0, 1.0])
+    assert recomputed_blocks() == 2
+    assert_allclose(Jhat.get_controls(), [1.0, 5.0])
+    # The derivative at the last evaluated point does not.
+    assert_allclose(Jhat.derivative(np.array([1.0, 5.0])), [10.0, 1.0])
+    assert recomputed_blocks() == 0
+    assert_allclose(Jhat.hessian(np.array([2.0, 1.0]), np.array([1.0, 0.0])), [2.0, 4.0])
+    assert recomputed_blocks() == 2
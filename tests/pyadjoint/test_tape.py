@@ -0,0 +1,346 @@
+import pytest
+from numpy.testing import assert_allclose
+
+from pyadjoint import *
+from pyadjoint.tape import _find_relevant_nodes
+
+
+def test_tape_index():
+    tape = get_working_tape()
+    a = AdjFloat(2.0)
+    b = AdjFloat(3.0)
+    x = a * a
+    y = b + 1.0
+    J = x * y
+
+    controls = [Control(a)]
+    cone = tape._get_index().forward_cone(frozenset([a.block_variable]))
+    assert cone.blocks == [0, 2]
+    assert cone.nodes == {a.block_variable, x.block_variable, J.block_variable}
+    assert _find_relevant_nodes(tape, controls) is cone.nodes
+    assert tape._get_index().block_consumers(1) == [2]
+
+    # Appended blocks are indexed incrementally.
+    index = tape._get_index()
+    J2 = J + a
+    assert tape._get_index() is index
+    assert J2.block_variable in _find_relevant_nodes(tape, controls)
+
+    Jhat = ReducedFunctional(J, controls)
+    assert_allclose(Jhat.derivative(), 2 * 2.0 * 4.0)
+    Jhat.optimize_tape()
+    assert tape._get_index() is not index
+    assert _find_relevant_nodes(tape, controls) == cone.nodes
+    assert_allclose(Jhat.derivative(), 2 * 2.0 * 4.0)
+
+
+def test_reset_generations():
+    tape = get_working_tape()
+    a = AdjFloat(2.0)
+    J = a * a
+    bv = J.block_variable
+
+    bv.adj_value = 1.0
+    bv.tlm_value = 2.0
+    bv.hessian_value = 3.0
+    tape.reset_tlm_values()
+    assert bv.tlm_value is None
+    assert bv.adj_value == 1.0 and bv.hessian_value == 3.0
+    tape.reset_hessian_values()
+    assert bv.hessian_value is None and bv.adj_value == 1.0
+    tape.reset_variables()
+    assert bv.adj_value is None
+
+    bv.add_adj_output(2.0)
+    bv.add_adj_output(2.0)
+    assert bv.adj_value == 4.0
+
+    Jhat = ReducedFunctional(J, Control(a))
+    assert_allclose(Jhat.derivative(), 4.0)
+    assert_allclose(Jhat.derivative(), 4.0)
+    assert_allclose(Jhat.hessian(AdjFloat(1.0)), 2.0)
+
+
+def test_freeze():
+    tape = get_working_tape()
+    a = AdjFloat(2.0)
+    b = AdjFloat(3.0)
+    x = a * b + a ** 2
+    y = b / (1.0 + a)
+    J = x * y - b
+    controls = [Control(a), Control(b)]
+    Jhat = ReducedFunctional(J, controls)
+    values = [AdjFloat(1.5), AdjFloat(0.5)]
+    expected = (Jhat(values), Jhat.derivative(), Jhat.hessian(values))
+    Jb = ReducedFunctional(J, controls[1])
+    expected_b = Jb.derivative()
+
+    frozen = tape.freeze()
+    assert len(frozen) == len(tape.get_blocks())
+    deps = frozen.dep_idx[frozen.dep_ptr[-2]:frozen.dep_ptr[-1]]
+    assert [frozen.variables[k] for k in deps] == tape.get_blocks()[-1].get_dependencies()
+
+    assert_allclose(Jhat(values), expected[0])
+    assert_allclose(Jhat.derivative(), expected[1])
+    assert_allclose(Jhat.hessian(values), expected[2])
+    assert_allclose(Jb.derivative(), expected_b)
+    assert_allclose(Jhat.derivative(), expected[1])
+    assert tape._frozen is frozen
+
+    J + 1.0
+    assert tape._frozen is None
+
+
+class DoubleBlock(Block):
+    def __init__(self, x):
+        super().__init__()
+        self.add_dependency(x)
+        self.arguments = []
+
+    def evaluate_adj_component(self, inputs, adj_inputs, block_variable, idx, prepared=None):
+        self.arguments.append((inputs, adj_inputs))
+        return 2.0 * adj_inputs[0]
+
+    def recompute_component(self, inputs, block_variable, idx, prepared):
+        return AdjFloat(2.0 * inputs[0])
+
+
+def test_index_outputs_added_after_query():
+    tape = get_working_tape()
+    x = AdjFloat(3.0)
+    block = DoubleBlock(x)
+    tape.add_block(block)
+    # The tape is indexed before the output is added to the block.
+    cone = tape._get_index().forward_cone(frozenset([x.block_variable]))
+    assert cone.nodes == {x.block_variable}
+    y = AdjFloat(6.0)
+    block.add_output(y.create_block_variable())
+    index = tape._get_index()
+    assert index.producer[y.block_variable] == 0
+    assert index.forward_cone(frozenset([x.block_variable])).nodes == {x.block_variable, y.block_variable}
+    J = y * y
+    assert J.block_variable in _find_relevant_nodes(tape, [Control(x)])
+    assert tape._get_index().block_consumers(0) == [1]
+    assert_allclose(ReducedFunctional(J, Control(x)).derivative(), 24.0)
+
+
+def test_freeze_reuses_arguments():
+    tape = get_working_tape()
+    x = AdjFloat(3.0)
+    block = DoubleBlock(x)
+    tape.add_block(block)
+    y = AdjFloat(6.0)
+    block.add_output(y.create_block_variable())
+    J = y * y
+    Jhat = ReducedFunctional(J, Control(x))
+
+    tape.freeze()
+    assert_allclose(Jhat.derivative(), 24.0)
+    assert_allclose(Jhat(AdjFloat(2.0)), 16.0)
+    assert_allclose(Jhat.derivative(), 16.0)
+    # The argument lists are allocated when freezing, and refilled by each sweep.
+    (inputs, adj_inputs), (inputs_again, adj_inputs_again) = block.arguments
+    assert inputs is inputs_again and adj_inputs is adj_inputs_again
+    assert inputs == [2.0]
+
+
+def test_parallel_adjoint():
+    tape = get_working_tape()
+    a = AdjFloat(2.0)
+    b = AdjFloat(3.0)
+    terms = [a * b * float(k) + a ** 2 / (b + float(k)) for k in range(8)]
+    J = terms[0]
+    for term in terms[1:]:
+        J = J + term
+    controls = [Control(a), Control(b)]
+    Jhat = ReducedFunctional(J, controls)
+    values = [AdjFloat(1.5), AdjFloat(0.5)]
+    expected = (Jhat(values), Jhat.derivative(), Jhat.hessian(values))
+
+    levels = tape._get_index().reverse_levels(0, len(tape.get_blocks()))
+    assert sorted(i for level in levels for i in level) == list(range(len(tape.get_blocks())))
+    assert max(len(level) for level in levels) > 4
+
+    tape.enable_parallel_adjoint(4)
+    for _ in range(2):
+        assert_allclose(Jhat(values), expected[0])
+        assert_allclose(Jhat.derivative(), expected[1])
+        assert_allclose(Jhat.hessian(values), expected[2])
+        tape.freeze()
+    tape.enable_parallel_adjoint(None)
+
+
+def test_context_local_tapes():
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    barrier = threading.Barrier(4)
+
+    def gradient(k):
+        # Each thread records and differentiates its own tape.
+        with set_working_tape(Tape()) as tape:
+            a = AdjFloat(float(k))
+            barrier.wait()
+            J = a * a * float(k)
+            barrier.wait()
+            assert len(tape.get_blocks()) == 2
+            dJ = compute_gradient(J, Control(a))
+            barrier.wait()
+        return float(dJ)
+
+    main_tape = get_working_tape()
+    with ThreadPoolExecutor(4) as executor:
+        gradients = list(executor.map(gradient, range(1, 5)))
+    assert gradients == [2.0 * k * k for k in range(1, 5)]
+    assert get_working_tape() is main_tape
+    assert len(main_tape.get_blocks()) == 0
+
+    # Annotation is restored on exit, also for a re-entered instance.
+    stop = stop_annotating()
+    with stop:
+        with stop:
+            assert not annotate_tape()
+        assert not annotate_tape()
+    assert annotate_tape()
+
+
+def test_process_wide_tape():
+    import threading
+
+    seen = {}
+
+    def probe():
+        seen["tape"] = get_working_tape()
+        seen["annotate"] = annotate_tape()
+        with stop_annotating():
+            seen["stopped"] = annotate_tape()
+            started.set()
+            resume.wait()
+
+    # A new thread sees the tape and annotation flag set before it was started.
+    started, resume = threading.Event(), threading.Event()
+    main_tape = get_working_tape()
+    thread = threading.Thread(target=probe)
+    thread.start()
+    started.wait()
+    # Stopping annotation in the thread leaves it on in the main thread.
+    assert annotate_tape()
+    resume.set()
+    thread.join()
+    assert seen == {"tape": main_tape, "annotate": True, "stopped": False}
+
+    # Annotating with no working tape warns and records nothing.
+    from pyadjoint.tape import _process_state
+    _process_state.tape = None
+    try:
+        with pytest.warns(UserWarning, match="no working tape"):
+            J = AdjFloat(2.0) * AdjFloat(3.0)
+        assert J == 6.0
+    finally:
+        set_working_tape(main_tape)
+    assert len(main_tape.get_blocks()) == 0
+
+
+def test_profiler(tmp_path):
+    import json
+    from pyadjoint.profiler import Profiler
+
+    tape = get_working_tape()
+    a = AdjFloat(2.0)
+    b = AdjFloat(3.0)
+    J = a * b + 1.0
+    tape.get_blocks()[0].tag = "product"
+    Jhat = ReducedFunctional(J, [Control(a), Control(b)])
+
+    profiler = Profiler(memory=True)
+    tape.set_profiler(profiler)
+    Jhat([AdjFloat(1.0), AdjFloat(2.0)])
+    Jhat.derivative()
+    Jhat.hessian([AdjFloat(1.0), AdjFloat(0.0)])
+
+    calls = {(row.name, row.tag, row.sweep): row.calls for row in profiler.summary()}
+    assert calls[("MulBlock", "product", "recompute")] == 1
+    assert calls[("AddBlock", None, "adjoint")] >= 1
+    assert calls[("MulBlock", "product", "hessian")] == 1
+    assert all(row.nbytes is not None for row in profiler.summary())
+    by_sweep = profiler.summary(by=("sweep",))
+    assert {row.sweep for row in by_sweep} >= {"recompute", "adjoint", "tlm", "hessian"}
+    assert all(row.name is None for row in by_sweep)
+    assert "MulBlock" in profiler.table()
+
+    profiler.export_chrome_trace(tmp_path / "trace.json")
+    with open(tmp_path / "trace.json") as f:
+        trace = json.load(f)
+    assert len(trace["traceEvents"]) == len(profiler.events)
+    assert all(event["ph"] == "X" and event["dur"] >= 0 for event in trace["traceEvents"])
+
+    # A vectorized tape is recorded as one event per sweep.
+    profiler.clear()
+    tape.freeze(vectorize=True)
+    Jhat.derivative()
+    assert [event.name for event in profiler.events] == ["VectorizedFloatTape"]
+    tape.set_profiler(None)
+
+
+def test_memory_report():
+    import numpy as np
+    import numpy_adjoint  # noqa: F401
+    from pyadjoint.profiler import Profiler
+
+    tape = get_working_tape()
+    x = create_overloaded_object(np.ones(1000))
+    y = x[0] * x[1]
+    tape.get_blocks()[2].tag = "product"
+    J = y + x[2]
+    Jhat = ReducedFunctional(J, Control(x))
+
+    report = tape.memory_report()
+    usage = {(row.name, row.tag, row.category): row for row in report.summary()}
+    # The control array, and its checkpoint copy, are inputs of the slices.
+    assert usage[("Input", None, "output")].nbytes >= 8000
+    assert usage[("Input", None, "checkpoint")].nbytes >= 8000
+    assert usage[("MulBlock", "product", "output")].count == 1
+    assert ("Input", None, "adjoint") not in usage
+
+    profiler = Profiler(memory=True)
+    tape.set_profiler(profiler)
+    Jhat.derivative()
+    tape.set_profiler(None)
+    usage = {(row.name, row.category): row for row in tape.memory_report().summary(by=("name", "category"))}
+    # The adjoint of the control is a dense array.
+    assert usage[("Input", "adjoint")].nbytes >= 8000
+    assert profiler.high_water_mark > 0
+    assert profiler.high_water_event in profiler.events
+    assert "Input" in tape.memory_report().table()
+
+
+def test_reset_generations_per_tape():
+    def record(value):
+        tape = Tape()
+        with set_working_tape(tape):
+            a = AdjFloat(value)
+            J = a * a * a
+        return ReducedFunctional(J, Control(a), tape=tape)
+
+    r1 = record(2.0)
+    r2 = record(3.0)
+    assert_allclose(r1.derivative(), 12.0)
+    # Resetting the values of one tape leaves those of the other tape.
+    assert_allclose(r2.derivative(), 27.0)
+    assert_allclose(r1.hessian(AdjFloat(1.0)), 12.0)
+    assert_allclose(r2.hessian(AdjFloat(1.0)), 18.0)
+
+    # A block variable on both tapes is reset by either tape.
+    a = AdjFloat(2.0)
+    tapes = [Tape(), Tape()]
+    for tape in tapes:
+        with set_working_tape(tape):
+            J = a * a
+    tapes[0].reset_variables()
+    tapes[1].reset_variables()
+    a.block_variable.adj_value = 1.0
+    tapes[1].reset_variables()
+    assert a.block_variable.adj_value is None
+    a.block_variable.adj_value = 1.0
+    tapes[0].reset_variables()
+    assert a.block_variable.adj_value is None